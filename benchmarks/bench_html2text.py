@@ -0,0 +1,53 @@
+"""Benchmark building a configured HTML2Text converter per email.
+
+Compares configuring a new ``html2text.HTML2Text`` for every email, as the backend used to, with the preconfigured
+converters from ``templated_email_md.converters``, using the default and user-overridden settings.
+
+Run with ``python benchmarks/bench_html2text.py``.
+"""
+
+import timeit
+
+import html2text
+
+from templated_email_md.converters import HTML2TEXT_DEFAULTS
+from templated_email_md.converters import get_html2text_converter
+
+
+NUMBER = 20000
+HTML = "<h1>Hello!</h1><p>This is a <strong>test</strong> with <a href='http://example.com'>a link</a>.</p>" * 5
+SETTINGS = {
+    "default": {},
+    "overridden": {"ignore_links": True, "body_width": 78, "unicode_snob": True, "pad_tables": True},
+}
+
+
+def configure_per_email(settings):
+    """Configure a new converter the way the backend used to for every email."""
+    h = html2text.HTML2Text()
+    for setting_name, setting_value in HTML2TEXT_DEFAULTS.items():
+        setattr(h, setting_name, setting_value)
+    for setting_name, setting_value in settings.items():
+        setattr(h, setting_name, setting_value)
+    return h
+
+
+def main():
+    """Print the per-email cost of getting a converter and of converting a short email."""
+    for label, settings in SETTINGS.items():
+        assert configure_per_email(settings).handle(HTML) == get_html2text_converter(settings).handle(HTML)
+
+        per_email = timeit.timeit(lambda s=settings: configure_per_email(s), number=NUMBER) / NUMBER * 1e6
+        preconfigured = timeit.timeit(lambda s=settings: get_html2text_converter(s), number=NUMBER) / NUMBER * 1e6
+        handle = timeit.timeit(lambda s=settings: get_html2text_converter(s).handle(HTML), number=NUMBER // 10)
+        handle = handle / (NUMBER // 10) * 1e6
+
+        print(f"{label} settings:")
+        print(f"  configure per email:   {per_email:8.2f} us")
+        print(f"  preconfigured:         {preconfigured:8.2f} us")
+        print(f"  saving per email:      {per_email - preconfigured:8.2f} us")
+        print(f"  convert a short email: {handle:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark the time it takes to import the backend.
+
+Imports ``templated_email_md.backend`` in fresh interpreters with ``python -X importtime``, after Django is set up,
+and prints the median cumulative import time of the backend, along with the Markdown and CSS inlining dependencies
+that were imported with it. Those are imported on first render, so none should be listed.
+
+Run with ``python benchmarks/bench_import_time.py``.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+RUNS = 9
+MODULE = "templated_email_md.backend"
+# Dependencies that are only needed once an email is rendered
+DEFERRED_MODULES = ("markdown", "premailer", "cssutils", "lxml")
+SCRIPT = (
+    "import django; django.setup(); import sys; "
+    f"import {MODULE}; "
+    f"print(','.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))"
+)
+
+
+def import_time():
+    """Return the cumulative import time of the backend, in microseconds, and the deferred modules it imported."""
+    root = Path(__file__).resolve().parent.parent
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "example_project.settings", "PYTHONPATH": str(root)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        capture_output=True,
+        check=True,
+        cwd=root,
+        env=env,
+        text=True,
+    )
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == MODULE:
+            return int(fields[1]), result.stdout.strip()
+    raise RuntimeError(f"{MODULE} was not imported")
+
+
+def main():
+    """Print the median import time of the backend and the deferred modules it imported."""
+    times = []
+    imported = ""
+    for _ in range(RUNS):
+        elapsed, imported = import_time()
+        times.append(elapsed)
+    print(f"{MODULE}: median {statistics.median(times) / 1000:.1f} ms, min {min(times) / 1000:.1f} ms over {RUNS} runs")
+    print(f"deferred modules imported: {imported or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark the throughput of the Markdown engines.
+
+Converts a short and a long email body with each engine from ``templated_email_md.markdown_engines`` whose parser is
+installed, using the default ``TEMPLATED_EMAIL_MARKDOWN_EXTENSIONS``, and prints the time per conversion and the
+number of conversions per second.
+
+Run with ``python benchmarks/bench_markdown_engines.py``.
+"""
+
+import os
+import sys
+import timeit
+from pathlib import Path
+
+import django
+
+from templated_email_md.markdown_engines import get_markdown_engine
+
+
+EXTENSIONS = ["markdown.extensions.meta", "markdown.extensions.tables", "markdown.extensions.extra"]
+ENGINES = {
+    "python-markdown": "templated_email_md.markdown_engines.PythonMarkdownEngine",
+    "markdown-it-py": "templated_email_md.markdown_engines.MarkdownItEngine",
+    "mistune": "templated_email_md.markdown_engines.MistuneEngine",
+}
+SECTION = """
+## Section {index}
+
+Hello User, this is paragraph {index} with **bold**, *emphasis* and [a link](https://example.com/{index}).
+
+- First item of section {index}
+- Second item with `code`
+
+| Item | Quantity | Price |
+|------|----------|-------|
+| Widget {index} | {index} | ${index}.00 |
+"""
+BODIES = {
+    "short": "# Hello User!\n" + SECTION.format(index=0),
+    "long": "# Hello User!\n" + "".join(SECTION.format(index=index) for index in range(50)),
+}
+
+
+def main():
+    """Print the time per conversion and the throughput of each installed engine."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "example_project.settings")
+    django.setup()
+
+    for body_name, body in BODIES.items():
+        print(f"{body_name} body ({len(body)} characters):")
+        for label, path in ENGINES.items():
+            try:
+                engine = get_markdown_engine(EXTENSIONS, path)
+            except ImportError:
+                print(f"  {label:<16} not installed")
+                continue
+            timer = timeit.Timer(lambda e=engine, b=body: e.render(b))
+            number, _elapsed = timer.autorange()
+            per_call = min(timer.repeat(repeat=5, number=number)) / number
+            print(f"  {label:<16} {per_call * 1e6:10.1f} us  {1 / per_call:10.0f} per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Benchmark each stage of rendering an email, and rendering it end to end.
+
+Times the stages of ``MarkdownTemplateBackend._render_email`` separately (block rendering, Markdown conversion, base
+template rendering, CSS inlining, comment removal and plain text generation) and together, for fixtures that vary the
+body size, the number of tables, the size of the context and the size of the stylesheet. CSS inlining is timed with the
+configured inliner (premailer by default) and with ``LxmlInliner``.
+
+Run with ``python benchmarks/bench_pipeline.py``. Use ``--output results.json`` to save the results, and
+``--compare results.json`` to compare a later run with them, for example before and after a change.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from importlib.metadata import version
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.template.loader import get_template
+from django.test import override_settings
+
+from templated_email_md.backend import MarkdownTemplateBackend
+from templated_email_md.inliners import LxmlInliner
+
+
+DEFAULT_REPEAT = 5
+STAGES = (
+    "blocks",
+    "markdown",
+    "base_template",
+    "inline_css",
+    "inline_css_lxml",
+    "remove_comments",
+    "plain_text",
+    "end_to_end",
+)
+DEFAULT_BASE_TEMPLATE = "templated_email/markdown_base.html"
+LARGE_CSS_BASE_TEMPLATE = "templated_email/bench_large_css_base.html"
+
+SECTION = """
+## Section {index}
+
+Hello {{{{ name }}}}, this is paragraph {index} with **bold**, *emphasis* and [a link](https://example.com/{index}).
+<!-- A comment that is removed -->
+
+- First item of section {index}
+- Second item with `code`
+"""
+
+TABLE = """
+| Item | Quantity | Price |
+|------|----------|-------|
+| Widget {index} | {index} | ${index}.00 |
+| Gadget {index} | 2 | $9.99 |
+"""
+
+
+def markdown_template(sections: int, tables: int) -> str:
+    """Return a Markdown email template with a number of sections and tables."""
+    body = "".join(SECTION.format(index=index) for index in range(sections))
+    body += "".join(TABLE.format(index=index) for index in range(tables))
+    return (
+        "{% block subject %}Benchmark for {{ name }}{% endblock %}\n"
+        "{% block preheader %}Your benchmark email{% endblock %}\n"
+        f"{{% block content %}}\n# Hello {{{{ name }}}}!\n{body}\n{{% endblock %}}\n"
+    )
+
+
+def large_stylesheet(rules: int) -> str:
+    """Return a stylesheet with a number of class rules, and media queries that cannot be inlined."""
+    css = "".join(
+        f".class-{index} {{ color: #{index % 4096:03x}; margin: {index % 20}px; }}\n" for index in range(rules)
+    )
+    return css + "@media only screen and (max-width: 620px) { p { font-size: 16px !important; } }\n"
+
+
+# Each fixture: (sections, tables, extra context variables, base HTML template)
+FIXTURES = {
+    "small": (1, 0, 0, DEFAULT_BASE_TEMPLATE),
+    "typical": (6, 1, 10, DEFAULT_BASE_TEMPLATE),
+    "huge": (400, 20, 10, DEFAULT_BASE_TEMPLATE),
+    "many_tables": (6, 50, 10, DEFAULT_BASE_TEMPLATE),
+    "large_context": (6, 1, 5000, DEFAULT_BASE_TEMPLATE),
+    "large_css": (6, 1, 10, LARGE_CSS_BASE_TEMPLATE),
+}
+
+
+def write_templates(directory: Path) -> None:
+    """Write the fixture templates, and a base HTML template with a large stylesheet, to a template directory."""
+    email_directory = directory / "templated_email"
+    email_directory.mkdir()
+    for name, (sections, tables, _variables, _base) in FIXTURES.items():
+        (email_directory / f"bench_{name}.md").write_text(markdown_template(sections, tables))
+
+    (email_directory / "bench_large.css").write_text(large_stylesheet(2000))
+    base_source = get_template(DEFAULT_BASE_TEMPLATE).template.source
+    include = '{% include "templated_email/markdown_styles.css" %}'
+    (email_directory / "bench_large_css_base.html").write_text(
+        base_source.replace(include, include + '{% include "templated_email/bench_large.css" %}')
+    )
+
+
+def time_call(func, repeat: int) -> dict:
+    """Time a function, calling it enough times per run for a run to take at least 0.2 seconds.
+
+    Returns:
+        The number of calls per run, and the minimum and median time per call in microseconds
+    """
+    timer = timeit.Timer(func)
+    number, _elapsed = timer.autorange()
+    runs = [elapsed / number * 1e6 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {"number": number, "min_us": min(runs), "median_us": statistics.median(runs)}
+
+
+def bench_fixture(name: str, repeat: int) -> list:
+    """Time each stage of rendering a fixture, and rendering it end to end."""
+    _sections, _tables, variables, base_html_template = FIXTURES[name]
+    backend = MarkdownTemplateBackend()
+    backend.base_url = ""
+    backend.base_html_template = base_html_template
+    template_name = f"bench_{name}"
+    template_path = backend._get_template_path(template_name, None, None)
+    context = {"name": "Benchmark", **{f"variable_{index}": f"value {index}" for index in range(variables)}}
+
+    # Each stage is fed the output of the previous one, as in the backend
+    blocks = backend._render_blocks(template_path, context)
+    markdown_html = backend._render_markdown(blocks["content"])
+    html_content = backend._remove_comments(markdown_html)
+    base_template = get_template(backend.base_html_template)
+    base_context = backend._get_base_context(html_content, blocks, context)
+    rendered_html = base_template.render(base_context)
+    inlined_html = backend._inline_css(rendered_html)
+    html = backend._remove_comments(inlined_html)
+
+    stages = {
+        "blocks": lambda: backend._render_blocks(template_path, context),
+        "markdown": lambda: backend._render_markdown(blocks["content"]),
+        "base_template": lambda: base_template.render(base_context),
+        "inline_css": lambda: backend._inline_css(rendered_html),
+        "inline_css_lxml": lambda: LxmlInliner().inline(rendered_html),
+        "remove_comments": lambda: (backend._remove_comments(markdown_html), backend._remove_comments(inlined_html)),
+        "plain_text": lambda: backend._generate_plain_text(html),
+        "end_to_end": lambda: backend._render_email(template_name, context).render(),
+    }
+    results = []
+    for stage in STAGES:
+        result = {"fixture": name, "stage": stage, **time_call(stages[stage], repeat)}
+        results.append(result)
+        print(f"  {stage:<16} {result['median_us']:12.1f} us  (min {result['min_us']:.1f} us)", flush=True)
+    return results
+
+
+def git_revision() -> str:
+    """Return the current git commit, or an empty string outside of a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def metadata() -> dict:
+    """Return the versions and environment the benchmarks ran with."""
+    packages = ("django-templated-email-md", "django", "markdown", "premailer", "html2text", "lxml")
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = version(package)
+        except Exception:  # pylint: disable=W0718
+            versions[package] = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def compare(results: list, baseline_path: str) -> None:
+    """Print how the median times of each fixture and stage changed from a saved run."""
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {(result["fixture"], result["stage"]): result["median_us"] for result in baseline["results"]}
+    print(f"\nCompared with {baseline_path} ({baseline['metadata'].get('git_revision') or 'unknown revision'}):")
+    for result in results:
+        before = previous.get((result["fixture"], result["stage"]))
+        if before:
+            ratio = result["median_us"] / before
+            print(
+                f"  {result['fixture']:<14} {result['stage']:<16} {before:12.1f} -> {result['median_us']:12.1f} us  x{ratio:.2f}"
+            )
+
+
+def main():
+    """Run the benchmarks, print the results and save them as JSON if asked to."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="*", help=f"Fixtures to run, out of {', '.join(FIXTURES)}, defaults to all")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Number of timed runs of each stage")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results with a JSON file written by an earlier run")
+    args = parser.parse_args()
+    unknown = set(args.fixtures) - set(FIXTURES)
+    if unknown:
+        parser.error(f"unknown fixtures: {', '.join(sorted(unknown))}")
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "example_project.settings")
+    django.setup()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        write_templates(Path(directory))
+        templates = [{**settings.TEMPLATES[0], "DIRS": [directory, *settings.TEMPLATES[0]["DIRS"]]}]
+        with override_settings(TEMPLATES=templates):
+            for name in args.fixtures or FIXTURES:
+                print(f"{name}:", flush=True)
+                results.extend(bench_fixture(name, args.repeat))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"metadata": metadata(), "results": results}, indent=2) + "\n")
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
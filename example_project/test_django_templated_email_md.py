@@ -1,16 +1,89 @@
 """Test cases for the django-templated-email-md package."""
 
+import asyncio
+import base64
+import json
+import logging
+import pstats
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.image import MIMEImage
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import django
+import premailer
 import pytest
+from django.apps import apps
 from django.conf import settings
 from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+from django.core.mail.message import SafeMIMEText
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.test import override_settings
 from django.utils import translation
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 from templated_email import send_templated_mail
+from templated_email.utils import InlineImage
 
 from example_project.example.views import index
 from example_project.urls import urlpatterns
+from templated_email_md import css
+from templated_email_md import invalidation
+from templated_email_md import profiling
+from templated_email_md import render_plan
+from templated_email_md import warmup
 from templated_email_md.backend import MarkdownTemplateBackend
+from templated_email_md.bulk import BulkMessage
+from templated_email_md.comments import remove_comments
+from templated_email_md.converters import get_html2text_converter
+from templated_email_md.converters import get_markdown_converter
+from templated_email_md.css import inline_css
+from templated_email_md.css import inline_css_split
+from templated_email_md.exceptions import BulkSendError
+from templated_email_md.inline_images import get_inline_image_part
+from templated_email_md.inliners import LxmlInliner
+from templated_email_md.inliners import PremailerInliner
+from templated_email_md.inliners import get_inliner_class
+from templated_email_md.markdown_engines import DEFAULT_MARKDOWN_ENGINE
+from templated_email_md.markdown_engines import MistuneEngine
+from templated_email_md.markdown_engines import PythonMarkdownEngine
+from templated_email_md.markdown_engines import find_meta_placeholder
+from templated_email_md.markdown_engines import get_markdown_engine
+from templated_email_md.messages import SHARED_PARTS_SUPPORTED
+from templated_email_md.messages import (
+    EmailMultiAlternatives as SharedPartsEmailMultiAlternatives,
+)
+from templated_email_md.messages import get_text_part
+from templated_email_md.metrics import get_metrics
+from templated_email_md.metrics import is_metrics_enabled
+from templated_email_md.metrics import reset_metrics
+from templated_email_md.render_cache import UncacheableContext
+from templated_email_md.render_cache import fingerprint_context
+from templated_email_md.render_cache import get_render_cache
+from templated_email_md.render_cache import get_render_cache_stats
+from templated_email_md.render_cache import reset_render_cache_stats
+from templated_email_md.render_plan import get_content_template
+from templated_email_md.render_plan import get_render_plan
+from templated_email_md.rendered_email import RenderedEmail
+from templated_email_md.signals import stage_completed
+from templated_email_md.utils import SizedLRUCache
+from templated_email_md.warmup import find_templates
+from templated_email_md.warmup import warm_templates
+from templated_email_md.warmup import warm_up
 
 
 def test_succeeds() -> None:
@@ -403,6 +476,45 @@ def test_remove_comments():
     assert "<!--[if IE]>IE specific content<![endif]-->" in cleaned_html
 
 
+@pytest.mark.parametrize(
+    "html,expected",
+    [
+        ("<p>a</p><!-- note --><p>b</p>", "<p>a</p><p>b</p>"),
+        ("<!--[if mso]><table><![endif]-->", "<!--[if mso]><table><![endif]-->"),
+        ('<a href="https://example.com/a">x</a>', '<a href="https://example.com/a">x</a>'),
+        ("<img src='//cdn.example.com/a.png'>", "<img src='//cdn.example.com/a.png'>"),
+        ("<img src=//cdn.example.com/a.png>", "<img src=//cdn.example.com/a.png>"),
+        ("var x = 1; // note\nvar y = 2;", "var x = 1; \nvar y = 2;"),
+        ("a // note /* spans\nlines */ still a comment\nb", "a \nb"),
+        ("<!-- a // hides -->\n-->b", "b"),
+        ("<p>a</p>\n\n  \n\t\n<p>b</p>", "<p>a</p>\n<p>b</p>"),
+        ("<p>a</p><!-- unterminated", "<p>a</p><!-- unterminated"),
+        ("a /* unterminated", "a /* unterminated"),
+    ],
+)
+def test_remove_comments_rules(html, expected):
+    """Test the rules applied when removing comments."""
+    assert remove_comments(html) == expected
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        "<!--" * 100000,
+        "/*" * 100000,
+        "<!--/*" * 50000,
+        "//\n" * 100000,
+        "\n \n" * 100000,
+        "//" + "/**/" * 100000,
+    ],
+)
+def test_remove_comments_pathological_input(html):
+    """Test that removing comments takes linear time on inputs that made the regular expressions quadratic."""
+    start = time.perf_counter()
+    remove_comments(html)
+    assert time.perf_counter() - start < 5
+
+
 def test_default_subject_and_preheader():
     """
     Test that the default subject and preheader are used when
@@ -585,3 +697,1345 @@ def test_fail_silently_render_email(backend) -> None:
     assert result["plain"] == "Email template rendering failed."
     assert result["subject"] == backend.default_subject
     assert result["preheader"] == backend.default_preheader
+
+
+def test_rendered_email_is_lazy(backend) -> None:
+    """Test that the HTML and plain text are only rendered when they are read."""
+    with mock.patch.object(backend, "_inline_css", wraps=backend._inline_css) as inline_css_mock:
+        with mock.patch.object(backend, "_generate_plain_text", wraps=backend._generate_plain_text) as plain_mock:
+            response = backend._render_email("test_message", {"name": "Test User"})
+
+            assert response["subject"] == "Test Email"
+            assert not response.is_rendered
+            inline_css_mock.assert_not_called()
+            plain_mock.assert_not_called()
+
+            assert "Hello Test User!" in response["plain"]
+            assert response["plain"] is response.plain
+            assert "Hello Test User!" in response["html"]
+            assert response.is_rendered
+
+    inline_css_mock.assert_called_once()
+    plain_mock.assert_called_once()
+
+
+def test_rendered_email_is_dict_compatible(backend) -> None:
+    """Test that a RenderedEmail can be used like the dictionary of parts TemplateBackend expects."""
+    response = backend._render_email("test_message", {"name": "Test User"})
+
+    assert isinstance(response, RenderedEmail)
+    assert "html" in response and "plain" in response
+    assert "unknown" not in response
+    assert list(response) == ["html", "plain", "subject", "preheader"]
+
+    response["plain"] = "Replaced"
+    assert response["plain"] == "Replaced"
+    assert dict(response)["plain"] == "Replaced"
+
+    del response["plain"]
+    assert "plain" not in response
+    assert response.get("plain") is None
+    with pytest.raises(KeyError):
+        response["unknown"] = "value"
+
+
+def test_render_plan_is_reused(backend) -> None:
+    """Test that the render plan for a template is built once and reused across renders."""
+    plan = get_render_plan("templated_email/test_message.md")
+    backend._render_email("test_message", {"name": "Test User"})
+
+    assert get_render_plan("templated_email/test_message.md") is plan
+
+
+def test_render_plan_renders_all_blocks() -> None:
+    """Test that a render plan renders the subject, preheader and content blocks in one pass."""
+    blocks = get_render_plan("templated_email/test_subject_preheader_provided.md").render({"name": "Test User"})
+
+    assert blocks["subject"] == "Subject from Template"
+    assert blocks["preheader"] == "Preheader from Template"
+    assert "# Hello Test User!" in blocks["content"]
+
+
+def test_render_plan_template_inheritance() -> None:
+    """Test that a render plan resolves blocks from parent templates."""
+    blocks = get_render_plan("templated_email/child_email.md").render({})
+
+    assert blocks["subject"] == "Child Email Subject"
+    assert "Child Email Content" in blocks["content"]
+    assert blocks["preheader"] is None
+
+
+def test_render_plan_dynamic_parent(backend) -> None:
+    """Test that a template whose parent is named by a context variable is resolved with each render's context."""
+    assert get_render_plan("templated_email/dynamic_child_email.md").block_layers is None
+
+    response = backend._render_email("dynamic_child_email", {"base_template": "templated_email/base_email.md"})
+
+    assert response["subject"] == "Dynamic Child Subject"
+    assert "Dynamic Child Content" in response["html"]
+    assert "templated_email/base_email.md" in response["plain"]
+
+
+def test_implicit_content_template(backend) -> None:
+    """Test that a template without a content block renders everything except the subject and preheader."""
+    response = backend._render_email("test_implicit_content", {"name": "Test User"})
+
+    assert response["subject"] == "Implicit Content Subject"
+    assert response["preheader"] == "Implicit Content Preheader"
+    assert "Hello Test User!" in response["html"]
+    assert "Implicit Content Subject" not in response["plain"]
+
+
+def test_content_template_cache() -> None:
+    """Test that the stripped content template is compiled once and rebuilt when the template source changes."""
+    template = get_template("templated_email/test_implicit_content.md").template
+    content_template = get_content_template(template)
+
+    assert get_content_template(template) is content_template
+    assert "block subject" not in content_template.source
+
+    template.source = template.source + "\nMore content."
+    try:
+        changed_template = get_content_template(template)
+    finally:
+        template.source = template.source[: -len("\nMore content.")]
+
+    assert changed_template is not content_template
+    assert "More content." in changed_template.source
+
+
+def test_markdown_converter_reused(backend) -> None:
+    """Test that Markdown converters are reused within a thread and rebuilt when the extensions change."""
+    converter = get_markdown_converter(backend.markdown_extensions)
+    backend._render_markdown("# Title")
+
+    assert get_markdown_converter(backend.markdown_extensions) is converter
+    assert get_markdown_converter(["markdown.extensions.tables"]) is not converter
+
+
+def test_markdown_converter_state_is_reset(backend) -> None:
+    """Test that state from one conversion does not leak into the next."""
+    backend.markdown_extensions = ["markdown.extensions.footnotes"]
+
+    first = backend._render_markdown("Text with a footnote[^1].\n\n[^1]: The footnote.")
+    second = backend._render_markdown("Text without footnotes.")
+
+    assert "The footnote." in first
+    assert "The footnote." not in second
+    assert "footnote-backref" not in second
+
+
+def test_markdown_converter_threads(backend) -> None:
+    """Test that concurrent threads use their own converters and produce correct output."""
+    backend.markdown_extensions = ["markdown.extensions.tables"]
+
+    def convert(i):
+        return i, backend._render_markdown(f"# Title {i}\n\n| A | B |\n|---|---|\n| {i} | x |")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(convert, range(200)))
+
+    for i, html in results:
+        assert f"<h1>Title {i}</h1>" in html
+        assert f"<td>{i}</td>" in html
+
+
+MARKDOWN_FEATURES = {
+    "basics": "# Hello User!\n\nThis is a **bold** and *emphasis* test.\n\n1. Item one\n2. Item two\n\n"
+    "[A link](http://example.com)",
+    "lists": "- First\n- Second\n\nAfter the list.",
+    "tables": "| Header 1 | Header 2 |\n|----------|----------|\n| Cell 1 | Cell 2 |",
+    "meta": "Title: Welcome\nAuthors: Someone\n    Someone else\n\n# Hello",
+    "fenced_code": "```python\nprint('<b>')\n```",
+    "def_list": "Term\n:   Definition",
+    "raw_html": '<div class="note">Raw <em>HTML</em></div>\n\nText with <span>inline HTML</span>.',
+}
+MARKDOWN_ENGINES = {
+    "templated_email_md.markdown_engines.MarkdownItEngine": "mdit_py_plugins",
+    "templated_email_md.markdown_engines.MistuneEngine": "mistune",
+}
+DEFAULT_MARKDOWN_EXTENSIONS = ["markdown.extensions.meta", "markdown.extensions.tables", "markdown.extensions.extra"]
+
+
+def normalize_html(html: str) -> str:
+    """Return HTML without the whitespace between tags, which differs between Markdown engines."""
+    return re.sub(r">\s+<", "><", html).strip()
+
+
+@pytest.mark.parametrize("feature", MARKDOWN_FEATURES)
+@pytest.mark.parametrize("engine_path", MARKDOWN_ENGINES)
+def test_markdown_engine_conformance(engine_path, feature) -> None:
+    """Test that each Markdown engine renders the features the templates use like Python-Markdown."""
+    pytest.importorskip(MARKDOWN_ENGINES[engine_path])
+    content = MARKDOWN_FEATURES[feature]
+    expected = get_markdown_engine(DEFAULT_MARKDOWN_EXTENSIONS, DEFAULT_MARKDOWN_ENGINE).render(content)
+
+    engine = get_markdown_engine(DEFAULT_MARKDOWN_EXTENSIONS, engine_path)
+
+    assert normalize_html(engine.render(content)) == normalize_html(expected)
+
+
+@pytest.mark.parametrize("engine_path", MARKDOWN_ENGINES)
+def test_markdown_engine_footnotes(engine_path) -> None:
+    """Test that each Markdown engine renders footnotes, and does not keep them from one conversion to the next."""
+    pytest.importorskip(MARKDOWN_ENGINES[engine_path])
+    engine = get_markdown_engine(DEFAULT_MARKDOWN_EXTENSIONS, engine_path)
+
+    first = engine.render("Here is a footnote reference[^1].\n\n[^1]:\n    This is the footnote.")
+    second = engine.render("Text without footnotes.")
+
+    assert "<sup" in first
+    assert "This is the footnote." in first
+    assert normalize_html(second) == "<p>Text without footnotes.</p>"
+
+
+def test_markdown_engine_setting(caplog) -> None:
+    """Test that TEMPLATED_EMAIL_MARKDOWN_ENGINE sets the engine used by the backend."""
+    pytest.importorskip("mistune")
+    with override_settings(TEMPLATED_EMAIL_MARKDOWN_ENGINE="templated_email_md.markdown_engines.MistuneEngine"):
+        backend = MarkdownTemplateBackend()
+        backend.markdown_extensions = [*DEFAULT_MARKDOWN_EXTENSIONS, "markdown.extensions.toc"]
+        with caplog.at_level(logging.WARNING, logger="templated_email_md.markdown_engines"):
+            html = backend._render_email("test_markdown_table", {})["html"]
+        assert isinstance(get_markdown_engine(backend.markdown_extensions), MistuneEngine)
+
+    assert "attr_list, md_in_html, toc" in caplog.text
+    assert "Cell 1</td>" in html
+    assert isinstance(get_markdown_engine(backend.markdown_extensions), PythonMarkdownEngine)
+
+
+def test_inline_css_matches_premailer() -> None:
+    """Test that cached CSS inlining produces the same output as premailer."""
+    html = get_template("templated_email/markdown_base.html").render(
+        {"markdown_content": '<h1>Title</h1><p>A <a href="/page/">link</a></p>', "subject": "S", "preheader": "P"}
+    )
+    for base_url in ("", "http://example.com"):
+        expected = premailer.transform(
+            html=html,
+            strip_important=False,
+            keep_style_tags=False,
+            cssutils_logging_level=logging.ERROR,
+            base_url=base_url,
+        )
+        assert inline_css(html, base_url=base_url) == expected
+        # The second call uses the cached stylesheet
+        assert inline_css(html, base_url=base_url) == expected
+
+
+def test_inline_css_parses_stylesheet_once() -> None:
+    """Test that each distinct stylesheet is parsed only once."""
+    html = "<html><head><style>p { color: #123456; }</style></head><body><p>Text</p></body></html>"
+    with mock.patch.object(
+        premailer.Premailer, "_parse_style_rules", autospec=True, side_effect=premailer.Premailer._parse_style_rules
+    ) as parse:
+        first = inline_css(html)
+        second = inline_css(html)
+        inline_css(html.replace("#123456", "#654321"))
+
+    assert first == second
+    assert 'style="color:#123456"' in first
+    assert parse.call_count == 2
+
+
+def test_inline_css_keep_style_tags() -> None:
+    """Test that keep_style_tags and strip_important behave as in premailer."""
+    html = "<html><head><style>p { color: red !important; }</style></head><body><p>Text</p></body></html>"
+
+    kept = inline_css(html, keep_style_tags=True)
+    stripped = inline_css(html, strip_important=True)
+
+    assert "<style>" in kept
+    assert "!important" not in stripped
+    assert "<style>" not in stripped
+
+
+@pytest.mark.parametrize("template_name", ["test_message", "test_markdown_table", "test_render_local_links"])
+def test_split_inlining_matches_full_inlining(template_name) -> None:
+    """Test that split-phase inlining produces the same HTML as inlining the full document."""
+    context = {"name": "Tést & 'User' <b>", "some_id": 3, "url": "/3/"}
+    full_backend = MarkdownTemplateBackend()
+    split_backend = MarkdownTemplateBackend()
+    split_backend.split_inlining = True
+    for backend in (full_backend, split_backend):
+        backend.base_url = "http://example.com"
+
+    expected = full_backend._render_email(template_name, context)["html"]
+
+    with mock.patch("templated_email_md.css.inline_css", wraps=css.inline_css) as inline_css_mock:
+        assert split_backend._render_email(template_name, context)["html"] == expected
+    inline_css_mock.assert_not_called()
+    # The second render reuses the inlined shell
+    assert split_backend._render_email(template_name, context)["html"] == expected
+
+
+def test_split_inlining_reuses_shell() -> None:
+    """Test that the base shell is inlined once and only the content is inlined per call."""
+    shell = (
+        "<html><head><style>td p { color: red; }</style></head>"
+        "<body><table><tr><td>CONTENT</td></tr></table></body></html>"
+    )
+    html = shell.replace("CONTENT", "<p>First</p>")
+    marked_shell = shell.replace("CONTENT", css.CONTENT_MARKER)
+
+    with mock.patch("templated_email_md.css._build_inlined_shell", wraps=css._build_inlined_shell) as build:
+        first = inline_css_split(marked_shell, html)
+        second = inline_css_split(marked_shell, shell.replace("CONTENT", "<p>Second</p>"))
+
+    assert build.call_count == 1
+    assert first == inline_css(html)
+    assert '<p style="color:red">Second</p>' in second
+
+
+def test_split_inlining_falls_back_for_sibling_selectors() -> None:
+    """Test that shells whose styles depend on elements outside the content are inlined as a whole."""
+    shell = (
+        "<html><head><style>td:first-child p { color: red; }</style></head>"
+        "<body><table><tr><td>x</td><td>CONTENT</td></tr></table></body></html>"
+    )
+    html = shell.replace("CONTENT", "<p>Content</p>")
+
+    result = inline_css_split(shell.replace("CONTENT", css.CONTENT_MARKER), html)
+
+    assert result == inline_css(html)
+    assert 'style="color:red"' not in result
+
+
+@pytest.mark.parametrize("content", ["<div>Unclosed", "Stray</div>", "<table><tr><td>Unclosed", "</td></tr>"])
+def test_split_inlining_falls_back_for_malformed_content(content) -> None:
+    """Test that content with unclosed or stray tags, which would match tags of the base template, is inlined whole."""
+    context = {"name": mark_safe(content)}
+    full_backend = MarkdownTemplateBackend()
+    split_backend = MarkdownTemplateBackend()
+    split_backend.split_inlining = True
+    for backend in (full_backend, split_backend):
+        backend.base_url = ""
+
+    expected = full_backend._render_email("test_message", context)["html"]
+
+    with mock.patch("templated_email_md.css.inline_css", wraps=css.inline_css) as inline_css_mock:
+        assert split_backend._render_email("test_message", context)["html"] == expected
+    inline_css_mock.assert_called_once()
+
+
+SELECTOR_DOCUMENT = """<html><head><style>
+p { color: red; } .a { color: blue; } #b { font-size: 2px; } div > p { margin: 0; } h1 + p { padding: 1px; }
+h1 ~ ul { margin: 2px; } li:first-child { color: green; } li:last-child { color: pink; } a[href] { color: black; }
+a:hover { color: red; } @media (max-width: 600px) { p { color: black; } } td p.a.c { border: 0 !important; }
+p.a { color: yellow !important; } img { border: none; }
+</style><style media="print">p { color: red; }</style><style data-premailer="ignore">p { color: red; }</style></head>
+<body><!-- a --><h1>Title</h1><!-- b --><p class="a c" id="b" style="color: orange">x</p><div><p>y</p><span><p
+class="a">z</p></span></div><ul><!-- c --><li>1</li><li>2</li><!-- d --></ul><table><tr><td><p class="c a">q</p></td>
+</tr></table><a href="/page/">a</a><a>b</a><img style="float: right" src="image.png"><img src="cid:logo"></body></html>"""
+
+
+@pytest.mark.parametrize("document", ["base", "selectors"])
+@pytest.mark.parametrize("base_url", ["", "http://example.com"])
+@pytest.mark.parametrize("keep_style_tags", [False, True])
+def test_lxml_inliner_matches_premailer(document, base_url, keep_style_tags) -> None:
+    """Test that the lxml inliner produces the same output as premailer."""
+    if document == "base":
+        html = get_template("templated_email/markdown_base.html").render(
+            {
+                "markdown_content": '<h1>Title</h1><p>A <a href="/page/">link</a></p><ul><li>One</li><li>Two</li></ul>'
+                "<table><tr><td>1</td></tr></table><blockquote><p>Quote</p></blockquote>",
+                "subject": "S",
+                "preheader": "P",
+            }
+        )
+    else:
+        html = SELECTOR_DOCUMENT
+    expected = premailer.transform(
+        html=html,
+        strip_important=False,
+        keep_style_tags=keep_style_tags,
+        cssutils_logging_level=logging.ERROR,
+        base_url=base_url,
+    )
+
+    inliner = LxmlInliner(base_url=base_url, keep_style_tags=keep_style_tags)
+    assert inliner.inline(html) == expected
+    # The second call uses the compiled stylesheets
+    assert inliner.inline(html) == expected
+
+
+def test_css_inliner_setting() -> None:
+    """Test that TEMPLATED_EMAIL_CSS_INLINER sets the inliner used by the backend."""
+    context = {"name": "User", "some_id": 3, "url": "/3/"}
+    expected = MarkdownTemplateBackend()._render_email("test_message", context)["html"]
+
+    with override_settings(
+        TEMPLATED_EMAIL_CSS_INLINER="templated_email_md.inliners.LxmlInliner", TEMPLATED_EMAIL_SPLIT_INLINING=True
+    ):
+        assert get_inliner_class() is LxmlInliner
+        backend = MarkdownTemplateBackend()
+        with mock.patch.object(LxmlInliner, "inline", autospec=True, side_effect=LxmlInliner.inline) as inline:
+            html = backend._render_email("test_message", context)["html"]
+
+    assert inline.call_count == 1
+    assert html == expected
+    assert get_inliner_class() is PremailerInliner
+
+
+def test_html2text_converters_are_isolated() -> None:
+    """Test that each preconfigured html2text converter has its own per-document state."""
+    first = get_html2text_converter({})
+    second = get_html2text_converter({})
+
+    assert first is not second
+    assert first.outtextlist is not second.outtextlist
+    assert first.handle("<p><a href='http://example.com'>one</a></p>").strip() == "[one](http://example.com)"
+    assert second.handle("<p>two</p>").strip() == "two"
+
+
+def test_html2text_converter_settings_change() -> None:
+    """Test that the preconfigured converter follows changes to the html2text settings."""
+    html = "<p>Text with <a href='http://example.com'>a link</a> and <em>emphasis</em>.</p>"
+
+    assert "http://example.com" in get_html2text_converter({}).handle(html)
+    assert "http://example.com" not in get_html2text_converter({"ignore_links": True}).handle(html)
+    assert "_emphasis_" in get_html2text_converter({"ignore_emphasis": False}).handle(html)
+    assert "_emphasis_" not in get_html2text_converter({}).handle(html)
+
+
+def test_send_many(backend) -> None:
+    """Test that send_many renders a message per recipient and sends them over a single connection."""
+    messages = [
+        BulkMessage("first@example.com", {"name": "First"}),
+        ("second@example.com", {"name": "Second"}),
+        (["third@example.com", "fourth@example.com"], {"name": "Third"}),
+    ]
+
+    with mock.patch("templated_email_md.backend.get_connection", wraps=mail.get_connection) as get_connection_mock:
+        results = backend.send_many("test_message", messages, from_email="from@example.com")
+
+    get_connection_mock.assert_called_once()
+    assert [result.success for result in results] == [True, True, True]
+    assert [result.recipient for result in results] == [message[0] for message in messages]
+    assert len(mail.outbox) == 3
+    assert mail.outbox[1].to == ["second@example.com"]
+    assert mail.outbox[2].to == ["third@example.com", "fourth@example.com"]
+    assert "Hello Second!" in mail.outbox[1].body
+    assert mail.outbox[0].subject == "Test Email"
+
+
+def test_send_many_chunks(backend) -> None:
+    """Test that send_many hands the messages to the connection in chunks."""
+    connection = LocmemEmailBackend()
+    messages = [(f"user{i}@example.com", {"name": f"User {i}"}) for i in range(5)]
+
+    with mock.patch.object(connection, "send_messages", wraps=connection.send_messages) as send_messages_mock:
+        results = backend.send_many("test_message", messages, chunk_size=2, connection=connection)
+
+    assert [len(call.args[0]) for call in send_messages_mock.call_args_list] == [2, 2, 1]
+    assert all(result.success for result in results)
+    assert len(mail.outbox) == 5
+
+
+class PersistentEmailBackend(LocmemEmailBackend):
+    """A locmem backend that opens and closes a connection, as the SMTP backend does."""
+
+    connection = None
+
+    def open(self):
+        """Open the connection, returning True if it was not open already."""
+        if self.connection is not None:
+            return False
+        self.connection = object()
+        return True
+
+    def close(self):
+        """Close the connection."""
+        self.connection = None
+
+
+def test_send_many_closes_connection_it_opened(backend) -> None:
+    """Test that a connection given closed is closed once sent, and one given open is left open."""
+    messages = [("user@example.com", {"name": "User"})]
+    connection = PersistentEmailBackend()
+
+    assert backend.send_many("test_message", messages, connection=connection)[0].success
+    assert connection.connection is None
+
+    connection.open()
+    assert backend.send_many("test_message", messages, connection=connection)[0].success
+    assert connection.connection is not None
+    assert len(mail.outbox) == 2
+
+
+def test_send_many_render_failure(backend) -> None:
+    """Test that a message that fails to render is reported without stopping the others."""
+    render_blocks = backend._render_blocks
+
+    def failing_render_blocks(template_path, context):
+        if context["name"] == "Broken":
+            raise ValueError("Broken context")
+        return render_blocks(template_path, context)
+
+    messages = [("ok@example.com", {"name": "Ok"}), ("broken@example.com", {"name": "Broken"})]
+    with mock.patch.object(backend, "_render_blocks", side_effect=failing_render_blocks):
+        results = backend.send_many("test_message", messages)
+
+    assert results[0].success
+    assert not results[1].success
+    assert isinstance(results[1].error, ValueError)
+    assert [email.to for email in mail.outbox] == [["ok@example.com"]]
+
+
+def test_send_many_connection_failure(backend) -> None:
+    """Test that every message of a chunk the connection fails to send is reported as failed."""
+    connection = LocmemEmailBackend()
+    messages = [(f"user{i}@example.com", {"name": f"User {i}"}) for i in range(3)]
+
+    with mock.patch.object(connection, "send_messages", side_effect=[1, OSError("Connection lost")]):
+        results = backend.send_many("test_message", messages, chunk_size=2, connection=connection)
+
+    assert [result.success for result in results] == [False, False, False]
+    assert isinstance(results[0].error, BulkSendError)
+    assert isinstance(results[2].error, OSError)
+
+
+def test_send_many_with_workers(backend) -> None:
+    """Test that messages rendered in worker processes match messages rendered in process, in order."""
+    messages = [(f"user{i}@example.com", {"name": f"User {i}"}) for i in range(7)]
+
+    results = backend.send_many("test_message", messages, workers=2, render_chunk_size=2)
+
+    assert all(result.success for result in results)
+    assert [email.to for email in mail.outbox] == [[recipient] for recipient, _ in messages]
+    for email, (_recipient, context) in zip(mail.outbox, messages):
+        expected = backend._render_email("test_message", context)
+        assert email.body == expected["plain"]
+        assert email.alternatives[0][0] == expected["html"]
+
+
+def test_send_many_with_workers_failures(backend) -> None:
+    """Test that messages that cannot be rendered in a worker process are reported as failed."""
+    messages = [
+        ("ok@example.com", {"name": "Ok"}),
+        ("unpicklable@example.com", {"name": "Unpicklable", "callback": lambda: None}),
+        ("other@example.com", {"name": "Other"}),
+    ]
+
+    results = backend.send_many("test_message", messages, workers=1, render_chunk_size=1)
+
+    assert [result.success for result in results] == [True, False, True]
+    assert [email.to for email in mail.outbox] == [["ok@example.com"], ["other@example.com"]]
+
+    results = backend.send_many("non_existent_template", messages[:1], workers=1)
+
+    assert isinstance(results[0].error, TemplateDoesNotExist)
+
+
+# A 1x1 PNG image
+PNG_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+def test_inline_image_part() -> None:
+    """Test that the part of an inline image matches templated_email's, and is rebuilt when the image changes."""
+    image = InlineImage("logo.png", PNG_IMAGE)
+    message = EmailMessage()
+    image.attach_to_message(message)
+
+    part = get_inline_image_part(image)
+    assert part.as_bytes() == message.attachments[0].as_bytes()
+    assert get_inline_image_part(image) is part
+
+    image.content = PNG_IMAGE + b"\0"
+    changed = get_inline_image_part(image)
+    assert changed is not part
+    assert changed["Content-ID"] != part["Content-ID"]
+
+
+@override_settings(TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE=1024)
+def test_inline_images_encoded_once(backend) -> None:
+    """Test that an image is encoded once, and that bulk sends attach the same part to every message."""
+    logo = InlineImage("logo.png", PNG_IMAGE)
+    messages = [(f"user{i}@example.com", {"name": f"User {i}"}) for i in range(3)]
+    parts = []
+
+    def attach_part(image):
+        parts.append(get_inline_image_part(image))
+        return parts[-1]
+
+    with mock.patch("templated_email_md.inline_images.MIMEImage", wraps=MIMEImage) as mime_image_mock:
+        with mock.patch("templated_email_md.backend.get_inline_image_part", side_effect=attach_part):
+            backend.send_many("test_message", messages, shared_context={"logo": logo})
+            backend.send(
+                "test_message", "from@example.com", ["other@example.com"], {"logo": InlineImage("a.png", PNG_IMAGE)}
+            )
+
+    mime_image_mock.assert_called_once()
+    assert parts[0] is parts[1] is parts[2]
+    assert parts[3].get_payload() == parts[0].get_payload()
+    assert parts[3]["Content-ID"] != parts[0]["Content-ID"]
+    assert f"cid:{parts[0]['Content-ID'][1:-1]}" == str(logo)
+    assert [email.attachments[0]["Content-ID"] for email in mail.outbox] == [part["Content-ID"] for part in parts]
+
+
+def test_send_many_with_workers_inline_images(backend) -> None:
+    """Test that emails rendered in worker processes refer to the Content-ID their inline images are attached with."""
+    messages = [
+        (f"user{i}@example.com", {"name": f"User {i}", "logo": InlineImage("logo.png", PNG_IMAGE)}) for i in range(2)
+    ]
+    messages.append(("shared@example.com", {"name": "Shared"}))
+
+    results = backend.send_many(
+        "test_inline_image",
+        messages,
+        workers=2,
+        render_chunk_size=1,
+        shared_context={"logo": InlineImage("s.png", PNG_IMAGE)},
+    )
+
+    assert all(result.success for result in results)
+    content_ids = set()
+    for email in mail.outbox:
+        content_id = email.attachments[0]["Content-ID"]
+        assert f'src="cid:{content_id[1:-1]}"' in email.alternatives[0][0]
+        content_ids.add(content_id)
+    assert len(content_ids) == 3
+
+
+@override_settings(TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE=0)
+def test_inline_image_cache_disabled() -> None:
+    """Test that images are encoded for every message when the cache is disabled."""
+    image = InlineImage("logo.png", PNG_IMAGE)
+
+    with mock.patch("templated_email_md.inline_images.MIMEImage", wraps=MIMEImage) as mime_image_mock:
+        assert get_inline_image_part(image) is not get_inline_image_part(image)
+
+    assert mime_image_mock.call_count == 2
+
+
+def test_sized_lru_cache() -> None:
+    """Test that the cache evicts the least recently used values once their sizes exceed its limit."""
+    cache = SizedLRUCache(maxbytes=10)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    cache.get("a")
+    cache.set("c", "cccc")
+
+    assert "b" not in cache
+    assert cache.currsize == 8
+
+    cache.set("d", "d" * 11)
+    assert "d" not in cache
+    cache.set("a", "a")
+    assert cache.pop("c") == "cccc"
+    assert cache.currsize == 1
+
+
+def test_shared_parts_message_matches_django() -> None:
+    """Test that sharing encoded parts builds the same MIME parts as Django, and shares the alternatives."""
+    html = "<p>" + "Long line with café. " * 100 + "</p>"
+
+    def build(message_class):
+        message = message_class("Subject", "Plain text", "from@example.com", ["to@example.com"])
+        message.attach_alternative(html, "text/html")
+        message.attach("notes.txt", html, "text/plain")
+        return message.message()
+
+    expected = build(EmailMultiAlternatives)
+    shared = build(SharedPartsEmailMultiAlternatives)
+    other = build(SharedPartsEmailMultiAlternatives)
+
+    expected_parts = [*expected.get_payload()[0].get_payload(), expected.get_payload()[1]]
+    shared_parts = [*shared.get_payload()[0].get_payload(), shared.get_payload()[1]]
+    assert [part.as_bytes() for part in shared_parts] == [part.as_bytes() for part in expected_parts]
+    assert shared_parts[1]["Content-Transfer-Encoding"] == "quoted-printable"
+    assert shared_parts[1] is other.get_payload()[0].get_payload()[1]
+    # Attachments get their own headers, so they are not shared
+    assert shared_parts[2] is not other.get_payload()[1]
+
+
+def test_shared_parts_override_is_called() -> None:
+    """Test that Django builds alternatives with the method SharedPartsMixin overrides, on the versions it supports."""
+    message = SharedPartsEmailMultiAlternatives("Subject", "Plain text", "from@example.com", ["to@example.com"])
+    message.attach_alternative("<p>Hello</p>", "text/html")
+
+    with mock.patch("templated_email_md.messages.get_text_part", wraps=get_text_part) as get_text_part_mock:
+        message.message()
+
+    assert get_text_part_mock.call_count == (1 if SHARED_PARTS_SUPPORTED else 0), (
+        f"Django {django.get_version()} no longer builds alternatives with SharedPartsMixin._create_alternatives, "
+        "update SHARED_PARTS_SUPPORTED"
+    )
+
+
+def test_shared_parts_unsupported_django() -> None:
+    """Test that messages are built as usual on Django versions whose message building is not supported."""
+    with mock.patch("templated_email_md.messages.SHARED_PARTS_SUPPORTED", False):
+        with mock.patch("templated_email_md.messages.get_text_part") as get_text_part_mock:
+            message = SharedPartsEmailMultiAlternatives("Subject", "Plain text", "from@example.com", ["to@example.com"])
+            message.attach_alternative("<p>Hello</p>", "text/html")
+            parts = message.message().get_payload()
+
+    get_text_part_mock.assert_not_called()
+    assert [part.get_content_type() for part in parts] == ["text/plain", "text/html"]
+
+
+@override_settings(
+    TEMPLATED_EMAIL_EMAIL_MULTIALTERNATIVES_CLASS="templated_email_md.messages.EmailMultiAlternatives",
+    TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE=1024 * 1024,
+)
+def test_send_many_shares_encoded_parts(backend) -> None:
+    """Test that messages with the same body encode it once, and only differ in their headers."""
+    messages = [(f"user{i}@example.com", {}) for i in range(3)]
+
+    with mock.patch("templated_email_md.messages.SafeMIMEText", wraps=SafeMIMEText) as safe_mime_text_mock:
+        results = backend.send_many("test_message", messages, shared_context={"name": "Everyone"})
+
+    assert all(result.success for result in results)
+    assert safe_mime_text_mock.call_count == 1
+    assert [email.to for email in mail.outbox] == [[recipient] for recipient, _ in messages]
+    assert len({email.message()["Message-ID"] for email in mail.outbox}) == 3
+
+
+@override_settings(TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE=0)
+def test_text_part_cache_disabled() -> None:
+    """Test that text parts are encoded for every message when the cache is disabled."""
+    assert get_text_part("<p>Hello</p>", "html", "utf-8") is not get_text_part("<p>Hello</p>", "html", "utf-8")
+
+
+class SMTPStandIn:
+    """A minimal SMTP server running on the event loop, which records the messages it receives."""
+
+    def __init__(self):
+        """Initialize the SMTPStandIn."""
+        self.messages = []
+        self.sessions = 0
+        self.max_sessions = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        """Start listening on a free local port."""
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening."""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        """Answer the SMTP commands of a client session."""
+        self.sessions += 1
+        self.max_sessions = max(self.max_sessions, self.sessions)
+        writer.write(b"220 localhost SMTP stand-in\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            verb = line[:4].upper()
+            if verb == b"DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                self.messages.append((await reader.readuntil(b"\r\n.\r\n")).decode())
+                # Keep the session open a little, so that concurrent sessions overlap
+                await asyncio.sleep(0.01)
+                writer.write(b"250 OK\r\n")
+            elif verb == b"QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 localhost\r\n")
+            await writer.drain()
+        writer.close()
+        self.sessions -= 1
+
+
+def run_with_smtp_stand_in(coroutine_function):
+    """Run a coroutine function with an SMTP stand-in on a new event loop, and return the stand-in."""
+
+    async def main():
+        smtp = SMTPStandIn()
+        await smtp.start()
+        try:
+            await asyncio.wait_for(coroutine_function(smtp), timeout=30)
+        finally:
+            await smtp.stop()
+        return smtp
+
+    return asyncio.run(main())
+
+
+def test_asend(backend) -> None:
+    """Test that asend delivers emails over SMTP without blocking the event loop."""
+
+    async def send_all(smtp):
+        await asyncio.gather(
+            *(
+                backend.asend(
+                    "test_message",
+                    "from@example.com",
+                    [f"user{i}@example.com"],
+                    {"name": f"User {i}"},
+                    connection=SMTPEmailBackend(host="127.0.0.1", port=smtp.port, timeout=10),
+                )
+                for i in range(20)
+            )
+        )
+
+    # The stand-in runs on the same event loop, so it could not answer if delivery blocked the loop
+    smtp = run_with_smtp_stand_in(send_all)
+
+    assert len(smtp.messages) == 20
+    assert sum("Hello User 7!" in message for message in smtp.messages) == 1
+    assert smtp.max_sessions > 1
+
+
+def test_asend_concurrency_limit(backend) -> None:
+    """Test that the number of emails sent at the same time on an event loop is limited."""
+
+    async def send_all(smtp):
+        await asyncio.gather(
+            *(
+                backend.asend(
+                    "test_message",
+                    "from@example.com",
+                    [f"user{i}@example.com"],
+                    {"name": f"User {i}"},
+                    connection=SMTPEmailBackend(host="127.0.0.1", port=smtp.port, timeout=10),
+                )
+                for i in range(10)
+            )
+        )
+
+    with mock.patch.object(settings, "TEMPLATED_EMAIL_ASYNC_CONCURRENCY", 2, create=True):
+        smtp = run_with_smtp_stand_in(send_all)
+
+    assert len(smtp.messages) == 10
+    assert smtp.max_sessions <= 2
+
+
+def test_arender(backend) -> None:
+    """Test that arender returns an email with every part rendered."""
+    rendered = asyncio.run(backend.arender("test_message", {"name": "Test User"}))
+    expected = backend._render_email("test_message", {"name": "Test User"})
+
+    assert rendered.is_rendered
+    assert rendered["html"] == expected["html"]
+    assert rendered["plain"] == expected["plain"]
+    assert rendered["subject"] == "Test Email"
+
+
+def test_render_many(backend) -> None:
+    """Test that render_many gives the same emails as rendering each context in full."""
+    shared_context = {"company": "Acme"}
+    contexts = [
+        {"name": "Ann", "plan": "GOLD", "account_id": 1},
+        {"name": "Zoë Ünal", "plan": "SILVER", "account_id": 22},
+        {"name": "bob@example.com", "plan": "GOLD", "account_id": "b-3"},
+    ]
+
+    rendered = list(backend.render_many("test_personalized_message", contexts, shared_context=shared_context))
+
+    assert len(rendered) == 3
+    for email, context in zip(rendered, contexts):
+        expected = backend._render_email("test_personalized_message", {**shared_context, **context})
+        assert dict(email) == dict(expected)
+    assert rendered[1]["subject"] == "Welcome to Acme, Zoë Ünal"
+    assert "https://example.com/account/22" in rendered[1]["html"]
+
+
+@override_settings(TEMPLATED_EMAIL_MARKDOWN_EXTENSIONS=["markdown.extensions.extra", "markdown.extensions.meta"])
+def test_render_many_meta_data_values() -> None:
+    """Test that values the meta extension would read as meta-data are rendered as in full renders."""
+    backend = MarkdownTemplateBackend()
+    contexts = [{"headline": "Reminder: payment due", "name": "Ann"}, {"headline": "Welcome", "name": "Bob"}]
+
+    rendered = list(backend.render_many("test_meta_personalized", contexts, shared_context={"plan": "GOLD"}))
+
+    for email, context in zip(rendered, contexts):
+        expected = backend._render_email("test_meta_personalized", {"plan": "GOLD", **context})
+        assert dict(email) == dict(expected)
+    assert "Reminder" not in rendered[0]["html"]
+    assert "Welcome" in rendered[1]["html"]
+
+
+def test_find_meta_placeholder() -> None:
+    """Test that only values that could start or extend the meta-data are found."""
+    placeholders = {"name": "PH0X", "title": "PH1X"}
+
+    assert find_meta_placeholder(placeholders, "PH0X\n\nText") == "name"
+    assert find_meta_placeholder(placeholders, "Title: PH1X\nKey-PH0X: x\n\nText") == "name"
+    assert find_meta_placeholder(placeholders, "Title: PH1X\n# Hello PH0X\n\nText") is None
+    assert find_meta_placeholder(placeholders, "Title: x\n\nPH0X") is None
+
+
+@override_settings(TEMPLATED_EMAIL_PLAIN_TEXT_MODE="fragment", TEMPLATED_EMAIL_HTML2TEXT_SETTINGS={})
+def test_plain_text_fragment_mode() -> None:
+    """Test that fragment mode generates the plain text from the preheader, Markdown content and footer."""
+    backend = MarkdownTemplateBackend()
+    backend.base_url = "http://example.com"
+    backend.base_html_template = "templated_email/test_footer_base.html"
+
+    email = backend._render_email("test_preheader_block", {"name": "Ann", "company": "Acme"})
+
+    assert email["plain"] == (
+        "Preheader from Template\n\n# Hello Ann!\n\nThis is a test message.\n\n"
+        "Sent by Acme. [Unsubscribe](http://example.com/unsubscribe/)"
+    )
+    assert "Sent by Acme" in email["html"]
+
+
+@override_settings(
+    TEMPLATED_EMAIL_PLAIN_TEXT_MODE="fragment",
+    TEMPLATED_EMAIL_HTML2TEXT_SETTINGS={"ignore_links": True},
+    TEMPLATED_EMAIL_DEFAULT_PREHEADER="",
+)
+def test_plain_text_fragment_mode_html2text_settings() -> None:
+    """Test that fragment mode applies TEMPLATED_EMAIL_HTML2TEXT_SETTINGS."""
+    backend = MarkdownTemplateBackend()
+
+    plain = backend._render_email("test_message", {"name": "Ann"})["plain"]
+
+    assert plain.startswith("# Hello Ann!\n\nThis is a bold test.")
+    assert plain.endswith("A link")
+
+
+def test_render_many_plain_text_fragment_mode() -> None:
+    """Test that emails rendered once and personalized get the same plain text as full renders in fragment mode."""
+    with override_settings(
+        TEMPLATED_EMAIL_PLAIN_TEXT_MODE="fragment",
+        TEMPLATED_EMAIL_HTML2TEXT_SETTINGS={},
+        TEMPLATED_EMAIL_DEFAULT_PREHEADER="",
+    ):
+        backend = MarkdownTemplateBackend()
+    backend.base_html_template = "templated_email/test_footer_base.html"
+    contexts = [{"name": "Ann", "plan": "GOLD", "account_id": 1}, {"name": "Zoë", "plan": "SILVER", "account_id": 2}]
+
+    rendered = list(backend.render_many("test_personalized_message", contexts, shared_context={"company": "Acme"}))
+
+    for email, context in zip(rendered, contexts):
+        expected = backend._render_email("test_personalized_message", {"company": "Acme", **context})
+        assert dict(email) == dict(expected)
+    assert rendered[1]["plain"].endswith(
+        "(https://example.com/account/2)\n\nSent by Acme. [Unsubscribe](/unsubscribe/)"
+    )
+
+
+def test_render_many_renders_shared_parts_once(backend) -> None:
+    """Test that render_many converts and inlines the email once for recipients whose values can be substituted."""
+    contexts = [{"name": f"User {i}", "plan": "GOLD", "account_id": i} for i in range(5)]
+
+    with mock.patch.object(backend, "_inline_css", wraps=backend._inline_css) as inline_css_mock:
+        with mock.patch.object(backend, "_render_markdown", wraps=backend._render_markdown) as markdown_mock:
+            rendered = [email.render() for email in backend.render_many("test_personalized_message", contexts)]
+
+    inline_css_mock.assert_called_once()
+    markdown_mock.assert_called_once()
+    assert "Hello User 4!" in rendered[4]["plain"]
+
+
+@pytest.mark.parametrize(
+    "context",
+    [
+        {"name": "Ann", "plan": "gold", "account_id": 1},
+        {"name": "<b>Ann</b>", "plan": "GOLD", "account_id": 1},
+        {"name": "Ann", "plan": "GOLD", "account_id": "1 2"},
+        {"name": "Ann  Lee", "plan": "GOLD", "account_id": 1},
+        {"name": "1. Ann", "plan": "GOLD", "account_id": 1},
+        {"name": ["Ann"], "plan": "GOLD", "account_id": 1},
+    ],
+)
+def test_render_many_falls_back_to_full_render(backend, context) -> None:
+    """Test that recipients whose values cannot be substituted have their email rendered in full."""
+    contexts = [{"name": "Bob", "plan": "GOLD", "account_id": 2}, context]
+
+    with mock.patch.object(backend, "_inline_css", wraps=backend._inline_css) as inline_css_mock:
+        rendered = [email.render() for email in backend.render_many("test_personalized_message", contexts)]
+
+    assert inline_css_mock.call_count == 2
+    expected = backend._render_email("test_personalized_message", context)
+    assert dict(rendered[1]) == dict(expected)
+
+
+def test_send_many_with_shared_context(backend) -> None:
+    """Test that send_many merges the shared context into each message's context."""
+    messages = [(f"user{i}@example.com", {"name": f"User {i}", "plan": "GOLD", "account_id": i}) for i in range(3)]
+
+    results = backend.send_many("test_personalized_message", messages, shared_context={"company": "Acme"})
+
+    assert all(result.success for result in results)
+    assert [email.subject for email in mail.outbox] == [f"Welcome to Acme, User {i}" for i in range(3)]
+    assert "Your Acme plan is GOLD." in mail.outbox[2].body
+
+
+@pytest.fixture
+def render_cache():
+    """Enable the render cache, starting from an empty cache and zero counts."""
+    get_render_cache().clear()
+    reset_render_cache_stats()
+    with mock.patch.object(settings, "TEMPLATED_EMAIL_RENDER_CACHE", True, create=True):
+        yield get_render_cache()
+    get_render_cache().clear()
+
+
+def test_render_cache(backend, render_cache) -> None:
+    """Test that an email rendered with the same context is read from the cache."""
+    first = backend._render_email("test_message", {"name": "Cached User"})
+
+    with mock.patch.object(backend, "_render_html", wraps=backend._render_html) as render_html_mock:
+        second = backend._render_email("test_message", {"name": "Cached User"})
+        render_html_mock.assert_not_called()
+        backend._render_email("test_message", {"name": "Other User"})
+        render_html_mock.assert_called_once()
+
+    assert dict(second) == dict(first)
+    assert "Hello Cached User!" in second["plain"]
+    assert get_render_cache_stats() == {"hits": 1, "misses": 2, "skipped": 0}
+
+    with translation.override("es"):
+        backend._render_email("test_message", {"name": "Cached User"})
+    assert get_render_cache_stats()["misses"] == 3
+
+    backend._render_email("test_message", {"name": "Cached User", "user": object()})
+    assert get_render_cache_stats()["skipped"] == 1
+
+
+def test_render_cache_limits(backend, render_cache) -> None:
+    """Test that emails larger than the maximum entry size and emails that fail to render are not cached."""
+    with mock.patch.object(settings, "TEMPLATED_EMAIL_RENDER_CACHE_MAX_ENTRY_SIZE", 100, create=True):
+        backend._render_email("test_message", {"name": "Large User"})
+        backend._render_email("test_message", {"name": "Large User"})
+    assert get_render_cache_stats()["hits"] == 0
+
+    backend.fail_silently = True
+    with mock.patch.object(backend, "_render_markdown", side_effect=ValueError("Broken")):
+        failed = backend._render_email("test_message", {"name": "Failed User"})
+        assert "Email template rendering failed." in failed["html"]
+    rendered = backend._render_email("test_message", {"name": "Failed User"})
+    assert "Hello Failed User!" in rendered["html"]
+
+
+def test_fingerprint_context() -> None:
+    """Test that equal contexts have the same fingerprint, and values that only look alike do not."""
+    assert fingerprint_context({"a": 1, "b": [1, 2]}) == fingerprint_context({"b": (1, 2), "a": 1})
+    assert fingerprint_context({"a": 1}) != fingerprint_context({"a": "1"})
+    assert fingerprint_context({"a": 1}) != fingerprint_context({"a": 1.0})
+    assert fingerprint_context({"a": {"b": None}}) != fingerprint_context({"a": ["b", None]})
+    assert fingerprint_context({"a": ["float", "1.0"]}) != fingerprint_context({"a": 1.0})
+    assert fingerprint_context({"a": ["uuid", str(uuid.UUID(int=0))]}) != fingerprint_context({"a": uuid.UUID(int=0)})
+    assert fingerprint_context({"a": mark_safe("<b>")}) != fingerprint_context({"a": "<b>"})
+
+
+def test_fingerprint_context_string_subclass() -> None:
+    """Test that a string subclass other than a safe string is not cached, since it may render differently."""
+
+    class Markup(str):
+        """A string rendered in its own way."""
+
+    with pytest.raises(UncacheableContext):
+        fingerprint_context({"a": Markup("<b>")})
+
+
+def test_render_cache_escapes_plain_string(backend, render_cache) -> None:
+    """Test that a plain string is escaped after the same text, marked safe, was rendered and cached."""
+    text = '<img src="x" onerror="alert(1)">'
+    safe = backend._render_email("test_message", {"name": mark_safe(text)})
+    plain = backend._render_email("test_message", {"name": text})
+
+    assert "<img" in safe["html"] and "&lt;img" not in safe["html"]
+    assert "<img" not in plain["html"] and "&lt;img" in plain["html"]
+
+
+def test_find_templates() -> None:
+    """Test that every Markdown template under the template prefix is found, by the name it is sent with."""
+    templates = find_templates("templated_email/", "md")
+
+    assert "test_message" in templates
+    assert "child_email" in templates
+    assert not any(name.endswith(".md") for name in templates)
+
+
+def test_warm_templates(backend, render_cache) -> None:
+    """Test that warming reports each template, and stores the rendered emails in the render cache if asked to."""
+    reports = warm_templates(backend, ["test_message", "non_existent_template"], {"name": "Warm"}, store=True)
+
+    assert [report.success for report in reports] == [True, False]
+    assert reports[0].cached
+    assert reports[0].render_time is not None
+    assert isinstance(reports[1].error, TemplateDoesNotExist)
+
+    backend._render_email("test_message", {"name": "Warm"})
+    assert get_render_cache_stats()["hits"] == 1
+
+
+def test_warm_email_templates_command() -> None:
+    """Test that the command reports timings, and fails if a template fails to render."""
+    stdout = StringIO()
+    call_command("warm_email_templates", "test_message", "test_subject_block", stdout=stdout, stderr=StringIO())
+
+    output = stdout.getvalue()
+    assert "test_message: compile" in output
+    assert "Warmed 2 email templates." in output
+
+    stderr = StringIO()
+    with pytest.raises(CommandError, match="1 of 1 email templates failed"):
+        call_command("warm_email_templates", "test_render_local_links", stdout=StringIO(), stderr=stderr)
+    assert "test_render_local_links" in stderr.getvalue()
+
+    call_command(
+        "warm_email_templates", "test_render_local_links", context='{"some_id": 1}', stdout=StringIO(), stderr=stderr
+    )
+
+
+@override_settings(TEMPLATED_EMAIL_WARMUP_TEMPLATES=["test_message", "non_existent_template"])
+def test_warm_up() -> None:
+    """Test that warming up renders the configured templates in the calling thread."""
+    threads = []
+    original_warm_template = warmup.warm_template
+
+    def warm_template(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return original_warm_template(*args, **kwargs)
+
+    with mock.patch("templated_email_md.warmup.warm_template", side_effect=warm_template):
+        with mock.patch("templated_email_md.warmup.gc.freeze") as freeze:
+            reports = warm_up(freeze=True)
+
+    assert [report.template_name for report in reports] == ["test_message", "non_existent_template"]
+    assert [report.success for report in reports] == [True, False]
+    assert threads == [threading.get_ident()] * 2
+    freeze.assert_called_once()
+
+    assert [report.template_name for report in warm_up(["test_subject_block"], {"name": "Warm"})] == [
+        "test_subject_block"
+    ]
+
+
+def test_app_ready_warm_up(caplog) -> None:
+    """Test that the app warms email templates when it is ready, only if configured to, and survives failures."""
+    app_config = apps.get_app_config("templated_email_md")
+    with mock.patch("templated_email_md.warmup.warm_up", side_effect=RuntimeError("Broken")) as warm_up_mock:
+        app_config.ready()
+        assert not warm_up_mock.called
+
+        with override_settings(TEMPLATED_EMAIL_WARMUP=True):
+            app_config.ready()
+    warm_up_mock.assert_called_once_with()
+    assert "Failed to warm email templates" in caplog.text
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    """Add a temporary directory to the template directories, for templates that change during a test."""
+    (tmp_path / "templated_email").mkdir()
+    templates = [{**settings.TEMPLATES[0], "DIRS": [str(tmp_path)]}]
+    with override_settings(TEMPLATES=templates):
+        yield tmp_path / "templated_email"
+
+
+def test_check_sources_reloads_changed_templates(backend, template_dir) -> None:
+    """Test that a change to a template's source is picked up once the sources are checked."""
+    template_file = template_dir / "changing.md"
+    template_file.write_text("{% block content %}First version{% endblock %}")
+    assert "First version" in backend._render_email("changing", {})["plain"]
+    assert str(template_file) in invalidation.tracked_sources()
+
+    template_file.write_text("{% block content %}Second, longer version{% endblock %}")
+    assert invalidation.check_sources(force=True) == [str(template_file)]
+    assert "Second, longer version" in backend._render_email("changing", {})["plain"]
+
+    template_file.write_text("{% block content %}Third version{% endblock %}")
+    invalidation.on_file_changed(file_path=template_file)
+    assert "Third version" in backend._render_email("changing", {})["plain"]
+
+
+def test_check_sources_tracks_base_template(backend, template_dir) -> None:
+    """Test that a change to a template included by the base HTML template is picked up."""
+    (template_dir / "base.html").write_text(
+        '<style>{% include "templated_email/styles.css" %}</style>{{ markdown_content|safe }}'
+    )
+    (template_dir / "styles.css").write_text("p { color: red; }")
+    backend.base_html_template = "templated_email/base.html"
+    assert "color:red" in backend._render_email("test_message", {"name": "Style"})["html"]
+
+    (template_dir / "styles.css").write_text("p { color: blue; }")
+    invalidation.check_sources(force=True)
+    assert "color:blue" in backend._render_email("test_message", {"name": "Style"})["html"]
+
+
+def test_setting_changed_clears_caches(backend) -> None:
+    """Test that changing a setting clears the caches that depend on it."""
+    backend._render_email("test_message", {"name": "Settings"})
+    assert len(render_plan._render_plans) > 0
+
+    with override_settings(TEMPLATED_EMAIL_SPLIT_INLINING=True):
+        assert len(render_plan._render_plans) == 0
+
+
+@pytest.fixture
+def metrics():
+    """Enable metrics, starting from an empty registry."""
+    reset_metrics()
+    with override_settings(TEMPLATED_EMAIL_METRICS=True):
+        yield
+    reset_metrics()
+
+
+def test_metrics_time_each_stage(backend, metrics) -> None:
+    """Test that sending an email times each stage, and sends a signal for each of them."""
+    received = []
+
+    def receiver(sender, **kwargs):
+        received.append((sender, kwargs["template_name"], kwargs["size"]))
+
+    stage_completed.connect(receiver)
+    try:
+        backend.send("test_message", "from@example.com", ["to@example.com"], {"name": "Metrics"})
+    finally:
+        stage_completed.disconnect(receiver)
+
+    recorded = {metric["stage"]: metric for metric in get_metrics()}
+    assert set(recorded) == {
+        "blocks",
+        "markdown",
+        "base_template",
+        "inline_css",
+        "remove_comments",
+        "plain_text",
+        "render",
+        "deliver",
+    }
+    assert all(metric["template"] == "templated_email/test_message.md" for metric in recorded.values())
+    assert recorded["remove_comments"]["count"] == 2
+    assert recorded["markdown"]["total_size"] > 0
+    assert sum(count for _, count in recorded["render"]["histogram"]) == 1
+    assert ("inline_css", "templated_email/test_message.md", recorded["inline_css"]["total_size"]) in received
+    assert len(received) == 9
+
+
+def test_metrics_count_errors(backend, metrics) -> None:
+    """Test that a stage that fails is counted as an error."""
+    with pytest.raises(TemplateDoesNotExist):
+        backend._render_email("non_existent_template", {})
+    backend.fail_silently = True
+    with mock.patch("templated_email_md.markdown_engines.render_markdown", side_effect=ValueError("Broken")):
+        backend._render_email("test_message", {"name": "Metrics"}).render()
+
+    recorded = {(metric["template"], metric["stage"]): metric for metric in get_metrics()}
+    assert recorded[("templated_email/test_message.md", "markdown")]["errors"] == 1
+    assert recorded[("templated_email/non_existent_template.md", "blocks")]["errors"] == 1
+
+
+def test_metrics_disabled(backend) -> None:
+    """Test that nothing is recorded when metrics are off."""
+    reset_metrics()
+    assert not is_metrics_enabled()
+    backend._render_email("test_message", {"name": "Metrics"}).render()
+    assert get_metrics() == []
+
+
+def test_email_metrics_command(backend, metrics) -> None:
+    """Test that the command prints the metrics of the current process, and resets them."""
+    backend._render_email("test_message", {"name": "Metrics"}).render()
+
+    stdout = StringIO()
+    call_command("email_metrics", stdout=stdout)
+    assert "templated_email/test_message.md" in stdout.getvalue()
+    assert "inline_css" in stdout.getvalue()
+
+    stdout = StringIO()
+    call_command("email_metrics", format="json", reset=True, stdout=stdout)
+    assert {metric["stage"] for metric in json.loads(stdout.getvalue())} >= {"blocks", "plain_text"}
+    assert get_metrics() == []
+
+    stdout = StringIO()
+    call_command("email_metrics", stdout=stdout)
+    assert "call this command with call_command" in stdout.getvalue()
+
+
+def test_profile_sampled_renders(backend, tmp_path) -> None:
+    """Test that sampled renders are profiled with their stage timings, keeping the newest profiles."""
+    with override_settings(
+        TEMPLATED_EMAIL_PROFILE_RATE=1.0, TEMPLATED_EMAIL_PROFILE_DIR=str(tmp_path), TEMPLATED_EMAIL_PROFILE_MAX_FILES=2
+    ):
+        for i in range(3):
+            rendered = backend._render_email("test_message", {"name": f"Profiled {i}"})
+            assert rendered.is_rendered
+
+    profiles = sorted(tmp_path.glob("*.prof"))
+    assert len(profiles) == 2
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert "render_markdown" in str(pstats.Stats(str(profiles[-1])).stats)
+
+    details = json.loads(profiles[-1].with_suffix(".json").read_text())
+    assert details["template"] == "templated_email/test_message.md"
+    assert details["error"] is None
+    assert {stage["stage"] for stage in details["stages"]} >= {"blocks", "markdown", "inline_css", "plain_text"}
+    assert not is_metrics_enabled()
+    assert get_metrics() == []
+
+
+def test_profile_rate(backend, tmp_path) -> None:
+    """Test that only the configured fraction of renders is profiled."""
+    with override_settings(TEMPLATED_EMAIL_PROFILE_RATE=0, TEMPLATED_EMAIL_PROFILE_DIR=str(tmp_path)):
+        backend._render_email("test_message", {"name": "Not profiled"}).render()
+    assert list(tmp_path.iterdir()) == []
+
+    with override_settings(TEMPLATED_EMAIL_PROFILE_RATE=0.5, TEMPLATED_EMAIL_PROFILE_DIR=str(tmp_path)):
+        with mock.patch("templated_email_md.profiling.random.random", side_effect=[0.7, 0.2]):
+            backend._render_email("test_message", {"name": "Not sampled"})
+            backend._render_email("test_message", {"name": "Sampled"})
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+
+
+def test_profile_default_dir(backend, tmp_path) -> None:
+    """Test that profiles are written to a private directory created for the process if no directory is set."""
+    with (
+        mock.patch("tempfile.tempdir", str(tmp_path)),
+        mock.patch("templated_email_md.profiling._default_profile_dir", None),
+    ):
+        with override_settings(TEMPLATED_EMAIL_PROFILE_RATE=1.0, TEMPLATED_EMAIL_PROFILE_DIR=None):
+            backend._render_email("test_message", {"name": "First"})
+            backend._render_email("test_message", {"name": "Second"})
+
+    (directory,) = tmp_path.iterdir()
+    assert directory.name.startswith("templated_email_md_profiles-")
+    assert directory.stat().st_mode & 0o777 == 0o700
+    assert len(list(directory.glob("*.prof"))) == 2
+
+
+def test_profile_while_another_render_is_profiled(backend, tmp_path) -> None:
+    """Test that a render sampled while another one holds the profiler is rendered without being profiled."""
+    with override_settings(TEMPLATED_EMAIL_PROFILE_RATE=1.0, TEMPLATED_EMAIL_PROFILE_DIR=str(tmp_path)):
+        with profiling._profiler_lock:
+            rendered = backend._render_email("test_message", {"name": "Waiting"})
+
+    assert "Hello Waiting!" in rendered["plain"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_failed_render(backend, tmp_path) -> None:
+    """Test that a render that fails is profiled with its error, and the error is raised."""
+    with override_settings(TEMPLATED_EMAIL_PROFILE_RATE=1.0, TEMPLATED_EMAIL_PROFILE_DIR=str(tmp_path)):
+        with pytest.raises(TemplateDoesNotExist):
+            backend._render_email("non_existent_template", {})
+
+    (details_file,) = tmp_path.glob("*.json")
+    details = json.loads(details_file.read_text())
+    assert "TemplateDoesNotExist" in details["error"]
+    assert details["stages"][0]["error"] is True
+
+
+def test_backend_import_defers_rendering_dependencies() -> None:
+    """Test that importing the backend does not import the Markdown and CSS inlining dependencies."""
+    script = (
+        "import sys, django; django.setup(); import templated_email_md.backend; "
+        "print(','.join(name for name in ('markdown', 'premailer', 'cssutils', 'lxml') if name in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=Path(__file__).resolve().parent.parent,
+        text=True,
+    )
+
+    assert result.stdout.strip() == ""
@@ -159,6 +159,15 @@ def tests(session: Session, django: str) -> None:
             session.notify("coverage", posargs=[])
 
 
+@session(python=PYTHON_STABLE_VERSION)
+@nox.parametrize("django", DJANGO_STABLE_VERSION)
+def benchmarks(session: Session, django: str) -> None:
+    """Benchmark the stages of rendering an email and the import time of the backend."""
+    session.run("uv", "sync", "--prerelease=allow", "--extra=dev")
+    session.run("python", "benchmarks/bench_pipeline.py", *session.posargs)
+    session.run("python", "benchmarks/bench_import_time.py")
+
+
 @session(python=PYTHON_STABLE_VERSION)
 @nox.parametrize("django", DJANGO_STABLE_VERSION)
 def coverage(session: Session, django: str) -> None:
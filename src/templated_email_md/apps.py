@@ -1,6 +1,12 @@
 """App configuration for templated_email_md."""
 
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
 
 
 class TemplatedEmailMdConfig(AppConfig):
@@ -8,3 +14,26 @@ class TemplatedEmailMdConfig(AppConfig):
 
     name = "templated_email_md"
     verbose_name = "Templated Email Markdown"
+
+    def ready(self):
+        """Clear the rendering caches when settings or template sources change, and warm them if configured to.
+
+        With ``TEMPLATED_EMAIL_WARMUP`` enabled, the email templates are warmed with
+        :func:`templated_email_md.warmup.warm_up` when Django starts.
+        """
+        from django.core.signals import setting_changed  # pylint: disable=C0415
+        from django.utils.autoreload import file_changed  # pylint: disable=C0415
+
+        from templated_email_md import invalidation  # pylint: disable=C0415
+
+        setting_changed.connect(invalidation.on_setting_changed, dispatch_uid="templated_email_md_setting_changed")
+        file_changed.connect(invalidation.on_file_changed, dispatch_uid="templated_email_md_file_changed")
+
+        if getattr(settings, "TEMPLATED_EMAIL_WARMUP", False):
+            from templated_email_md.warmup import warm_up  # pylint: disable=C0415
+
+            try:
+                warm_up()
+            except Exception:  # pylint: disable=W0718
+                # Warming up is an optimization, so a failure must not prevent Django from starting
+                logger.exception("Failed to warm email templates")
@@ -1,36 +1,89 @@
 """Backend that uses Django templates and allows writing email content in Markdown."""
 
+import copy
+import functools
 import logging
-import re
+from collections import deque
+from contextlib import closing
+from contextvars import ContextVar
 from typing import Any
+from typing import Deque
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
-import html2text
-import markdown
-import premailer
 from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
 from django.template import Context
 from django.template import Template
 from django.template.loader import get_template
+from django.utils.html import conditional_escape
 from django.utils.translation import gettext as _
-from render_block import BlockNotFound
-from render_block import render_block_to_string
+from templated_email.backends.vanilla_django import EmailRenderException
 from templated_email.backends.vanilla_django import TemplateBackend
-
+from templated_email.utils import InlineImage
+
+from templated_email_md.bulk import DEFAULT_CHUNK_SIZE
+from templated_email_md.bulk import BulkMessage
+from templated_email_md.bulk import Recipient
+from templated_email_md.bulk import SendResult
+from templated_email_md.bulk import chunked
+from templated_email_md.bulk import recipient_list
+from templated_email_md.comments import remove_comments
+from templated_email_md.converters import HTML2TEXT_DEFAULTS
+from templated_email_md.converters import get_html2text_converter
+from templated_email_md.exceptions import BulkSendError
 from templated_email_md.exceptions import CSSInliningError
 from templated_email_md.exceptions import MarkdownRenderError
+from templated_email_md.executors import get_delivery_executor
+from templated_email_md.executors import get_render_executor
+from templated_email_md.executors import get_semaphore
+from templated_email_md.executors import run_in_executor
+from templated_email_md.inline_images import get_inline_image_part
+from templated_email_md.invalidation import track_template
+from templated_email_md.markdown_engines import DEFAULT_MARKDOWN_ENGINE
+from templated_email_md.markdown_engines import find_meta_placeholder
+from templated_email_md.markdown_engines import get_markdown_engine
+from templated_email_md.metrics import bind_template
+from templated_email_md.metrics import is_metrics_enabled
+from templated_email_md.metrics import template_scope
+from templated_email_md.metrics import timed
+from templated_email_md.metrics import timed_call
+from templated_email_md.parallel import DEFAULT_RENDER_CHUNK_SIZE
+from templated_email_md.parallel import RenderPool
+from templated_email_md.partial import PartialRender
+from templated_email_md.partial import find_unsupported_placeholder
+from templated_email_md.partial import make_placeholders
+from templated_email_md.partial import supports_plain_text_substitution
+from templated_email_md.profiling import profile_render
+from templated_email_md.profiling import should_profile
+from templated_email_md.render_cache import get_cached_email
+from templated_email_md.render_cache import is_render_cache_enabled
+from templated_email_md.render_cache import make_render_cache_key
+from templated_email_md.render_cache import record_skipped
+from templated_email_md.render_cache import set_cached_email
+from templated_email_md.render_plan import get_render_plan
+from templated_email_md.rendered_email import RenderedEmail
 
 
 logger = logging.getLogger(__name__)
 
+# Parts rendered ahead of get_email_message, for _render_email to return
+_prerendered_email: ContextVar[Optional[RenderedEmail]] = ContextVar("prerendered_email", default=None)
+
 
 class MarkdownTemplateBackend(TemplateBackend):
     """Backend that uses Django templates and allows writing email content in Markdown.
 
     It renders the Markdown into HTML, wraps it with a base template, and inlines CSS styling.
-    The plain text version is generated from the final HTML using html2text.
+    The plain text version is generated from the final HTML using html2text, or from the Markdown content with its
+    preheader and footer when ``TEMPLATED_EMAIL_PLAIN_TEXT_MODE`` is ``"fragment"``.
     """
 
     def __init__(
@@ -72,7 +125,12 @@ class MarkdownTemplateBackend(TemplateBackend):
                 "markdown.extensions.extra",
             ],
         )
+        self.markdown_engine = getattr(settings, "TEMPLATED_EMAIL_MARKDOWN_ENGINE", DEFAULT_MARKDOWN_ENGINE)
         self.html2text_settings = getattr(settings, "TEMPLATED_EMAIL_HTML2TEXT_SETTINGS", {})
+        self.plain_text_mode = getattr(settings, "TEMPLATED_EMAIL_PLAIN_TEXT_MODE", "html")
+        self.split_inlining = getattr(settings, "TEMPLATED_EMAIL_SPLIT_INLINING", False)
+        # Resolved on first use, so that premailer and lxml are not imported until an email is rendered
+        self.css_inliner = getattr(settings, "TEMPLATED_EMAIL_CSS_INLINER", None)
         self.default_subject = getattr(settings, "TEMPLATED_EMAIL_DEFAULT_SUBJECT", _("Hello!"))
         self.default_preheader = getattr(settings, "TEMPLATED_EMAIL_DEFAULT_PREHEADER", _(""))
 
@@ -99,7 +157,8 @@ class MarkdownTemplateBackend(TemplateBackend):
     ):
         """Send an email using the Markdown template.
 
-        Overrides the send method to add support for a base URL, used by premailer to resolve relative URLs.
+        Overrides the send method to add support for a base URL, used by premailer to resolve relative URLs, and to
+        time rendering the message apart from handing it to the mail connection.
         """
 
         # Extract base_url from kwargs if provided
@@ -107,26 +166,660 @@ class MarkdownTemplateBackend(TemplateBackend):
             "base_url", getattr(settings, "TEMPLATED_EMAIL_BASE_URL", "")
         )
 
-        return super().send(
-            template_name,
-            from_email,
-            recipient_list,
-            context,
-            cc=cc,
-            bcc=bcc,
-            fail_silently=fail_silently,
-            headers=headers,
-            template_prefix=template_prefix,
-            template_suffix=template_suffix,
-            template_dir=template_dir,
-            file_extension=file_extension,
-            auth_user=auth_user,
-            auth_password=auth_password,
-            connection=connection,
-            attachments=attachments,
-            create_link=create_link,
-            **kwargs,
+        connection = connection or get_connection(
+            username=auth_user, password=auth_password, fail_silently=fail_silently
+        )
+
+        with template_scope(self._get_metrics_template_name(template_name, template_dir, file_extension)):
+            with timed("render"):
+                email_message = self.get_email_message(
+                    template_name,
+                    context,
+                    from_email=from_email,
+                    to=recipient_list,
+                    cc=cc,
+                    bcc=bcc,
+                    headers=headers,
+                    template_prefix=template_prefix,
+                    template_suffix=template_suffix,
+                    template_dir=template_dir,
+                    file_extension=file_extension,
+                    attachments=attachments,
+                    create_link=create_link,
+                )
+            email_message.connection = connection
+
+            try:
+                with timed("deliver"):
+                    email_message.send(fail_silently)
+            except NameError as e:
+                raise EmailRenderException("Couldn't render plain or html parts") from e
+
+        return email_message.extra_headers.get("Message-Id", None)
+
+    async def arender(
+        self,
+        template_name: Union[str, list, tuple],
+        context: Dict[str, Any],
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ) -> RenderedEmail:
+        """Render an email without blocking the event loop.
+
+        Every part is rendered in a thread of the shared render executor. The number of emails rendered or sent at the
+        same time on an event loop is limited by ``TEMPLATED_EMAIL_ASYNC_CONCURRENCY``.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            context: The context to render the template with
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            base_url: Base URL used to resolve relative URLs, defaults to ``TEMPLATED_EMAIL_BASE_URL``
+
+        Returns:
+            RenderedEmail with every part rendered
+        """
+        backend = self._with_base_url(base_url)
+        async with get_semaphore():
+            return await run_in_executor(
+                get_render_executor(),
+                lambda: backend._render_email(  # pylint: disable=W0212
+                    template_name, context, template_dir, file_extension
+                ).render(),
+            )
+
+    async def asend(
+        self,
+        template_name: Union[str, list, tuple],
+        from_email: Optional[str] = None,
+        recipient_list: Optional[List[str]] = None,
+        context: Optional[Dict[str, Any]] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        fail_silently: bool = False,
+        headers: Optional[Dict[str, str]] = None,
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+        auth_user: Optional[str] = None,
+        auth_password: Optional[str] = None,
+        connection: Optional[BaseEmailBackend] = None,
+        attachments: Optional[List[Any]] = None,
+        base_url: Optional[str] = None,
+    ) -> Optional[str]:
+        """Render and send an email without blocking the event loop.
+
+        The email is rendered in a thread of the shared render executor, then handed to the mail connection in a
+        thread of the shared delivery executor, so that waiting on the network does not hold up rendering. The number
+        of emails rendered or sent at the same time on an event loop is limited by
+        ``TEMPLATED_EMAIL_ASYNC_CONCURRENCY``.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            from_email: The sender of the email
+            recipient_list: The recipients of the email
+            context: The context to render the template with
+            cc: Addresses to copy the email to
+            bcc: Addresses to blind copy the email to
+            fail_silently: Whether to suppress errors raised while sending
+            headers: Extra headers to add to the email
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            auth_user: Username for the mail connection if one is created
+            auth_password: Password for the mail connection if one is created
+            connection: An existing mail connection to send the email with
+            attachments: Attachments to add to the email
+            base_url: Base URL used to resolve relative URLs, defaults to ``TEMPLATED_EMAIL_BASE_URL``
+
+        Returns:
+            The Message-Id header of the email, if one was set
+        """
+        backend = self._with_base_url(base_url)
+        template_label = self._get_metrics_template_name(template_name, template_dir, file_extension)
+        async with get_semaphore():
+            with template_scope(template_label):
+                email_message = await run_in_executor(
+                    get_render_executor(),
+                    functools.partial(
+                        timed_call,
+                        "render",
+                        backend.get_email_message,
+                        template_name,
+                        context,
+                        from_email=from_email,
+                        to=recipient_list,
+                        cc=cc,
+                        bcc=bcc,
+                        headers=headers,
+                        template_dir=template_dir,
+                        file_extension=file_extension,
+                        attachments=attachments,
+                    ),
+                )
+                email_message.connection = connection or get_connection(
+                    username=auth_user, password=auth_password, fail_silently=fail_silently
+                )
+                await run_in_executor(get_delivery_executor(), timed_call, "deliver", email_message.send, fail_silently)
+        return email_message.extra_headers.get("Message-Id", None)
+
+    def _with_base_url(self, base_url: Optional[str]) -> "MarkdownTemplateBackend":
+        """Return a copy of the backend that resolves relative URLs against a base URL.
+
+        Concurrent renders use their own copy, so that they do not change the base URL of each other.
+
+        Args:
+            base_url: Base URL used to resolve relative URLs, defaults to ``TEMPLATED_EMAIL_BASE_URL``
+
+        Returns:
+            A shallow copy of the backend
+        """
+        backend = copy.copy(self)
+        backend.base_url = (  # pylint: disable=W0201
+            base_url if base_url is not None else getattr(settings, "TEMPLATED_EMAIL_BASE_URL", "")
+        )
+        return backend
+
+    def _get_metrics_template_name(
+        self, template_name: Union[str, list, tuple], template_dir: Optional[str], file_extension: Optional[str]
+    ) -> Optional[str]:
+        """Return the path of the template that the metrics of an email are recorded for, if metrics are enabled."""
+        if not is_metrics_enabled():
+            return None
+        return self._get_template_path(
+            template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
+        )
+
+    def render_many(
+        self,
+        template_name: Union[str, list, tuple],
+        contexts: Iterable[Dict[str, Any]],
+        shared_context: Optional[Dict[str, Any]] = None,
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ) -> Iterator[RenderedEmail]:
+        """Render a template for many recipients that share most of their context.
+
+        The template is rendered, converted to HTML, inlined and converted to plain text once, with a placeholder for
+        each variable of the recipients' contexts. Each recipient's email is then made by substituting their values
+        for the placeholders. The Django templates are still rendered for each recipient, to check that they give
+        the same output as the substitution, so filters and tags that depend on a value are handled.
+
+        A recipient whose values are not all short strings or numbers made of letters, digits, spaces and common
+        punctuation, or whose rendered templates differ from the substitution, has their email rendered in full.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            contexts: The variables that differ for each recipient
+            shared_context: The variables that are the same for every recipient
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            base_url: Base URL used to resolve relative URLs, defaults to ``TEMPLATED_EMAIL_BASE_URL``
+
+        Yields:
+            The RenderedEmail for each context, in order
+        """
+        self.base_url = (  # pylint: disable=W0201
+            base_url if base_url is not None else getattr(settings, "TEMPLATED_EMAIL_BASE_URL", "")
+        )
+        for rendered in self._render_personalized_many(
+            template_name, contexts, shared_context or {}, template_dir, file_extension
+        ):
+            if isinstance(rendered, Exception):
+                raise rendered
+            yield rendered
+
+    def _render_personalized_many(
+        self,
+        template_name: Union[str, list, tuple],
+        contexts: Iterable[Dict[str, Any]],
+        shared_context: Dict[str, Any],
+        template_dir: Optional[str],
+        file_extension: Optional[str],
+    ) -> Iterator[Union[RenderedEmail, Exception]]:
+        """Render a template for each recipient's context on top of a shared context.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            contexts: The variables that differ for each recipient
+            shared_context: The variables that are the same for every recipient
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+
+        Yields:
+            The RenderedEmail for each context, in order, or the exception raised while rendering it
+        """
+        template_path = self._get_template_path(
+            template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
+        )
+        # Recipients with the same personalized variables share a partial render
+        partial_renders: Dict[frozenset, Optional[PartialRender]] = {}
+        for personal_context in contexts:
+            names = frozenset(personal_context)
+            if names not in partial_renders:
+                partial_renders[names] = self._build_partial_render(template_path, shared_context, names)
+            context = {**shared_context, **personal_context}
+            try:
+                rendered = self._substitute_partial_render(
+                    partial_renders[names], template_path, context, personal_context
+                )
+                if rendered is None:
+                    rendered = self._render_email(template_name, context, template_dir, file_extension)
+            except Exception as e:  # pylint: disable=W0718
+                rendered = e
+            yield rendered
+
+    def _build_partial_render(
+        self, template_path: str, shared_context: Dict[str, Any], names: Iterable[str]
+    ) -> Optional[PartialRender]:
+        """Render a template once with a placeholder for each personalized variable.
+
+        Args:
+            template_path: Path to the template file
+            shared_context: The variables that are the same for every recipient
+            names: The names of the personalized variables
+
+        Returns:
+            The PartialRender, or None if the emails have to be rendered in full
+        """
+        markdown_engine = get_markdown_engine(self.markdown_extensions, self.markdown_engine)
+        if not markdown_engine.supports_partial_rendering():
+            return None
+
+        placeholders = make_placeholders(names)
+        context = {**shared_context, **placeholders}
+        try:
+            with template_scope(template_path):
+                blocks = self._render_blocks(template_path, context)
+                html_content = self._remove_comments(self._render_markdown(blocks["content"]))
+                base_template = self._get_base_template()
+                base_context = self._get_base_context(html_content, blocks, context)
+                rendered_html = self._render_base_template(base_template, base_context)
+                html = self._finish_html(base_template, base_context, rendered_html)
+        except Exception as e:  # pylint: disable=W0718
+            # The emails are rendered in full, where the error is reported for each of them
+            logger.debug("Failed to render %s with placeholders: %s", template_path, e)
+            return None
+
+        name = find_unsupported_placeholder(
+            placeholders, blocks["content"], rendered_html, html, getattr(self, "base_url", "")
+        )
+        if name is None and "meta" in markdown_engine.enabled:
+            name = find_meta_placeholder(placeholders, blocks["content"])
+        if name is not None:
+            logger.debug(
+                "Rendering %s in full for each recipient, since '%s' cannot be substituted", template_path, name
+            )
+            return None
+
+        plain = None
+        fragment = self._get_plain_text_fragment(html_content, base_context)
+        plain_source = self._get_plain_text_document(**fragment) if fragment else html
+        if supports_plain_text_substitution(
+            {**HTML2TEXT_DEFAULTS, **self.html2text_settings}, placeholders, plain_source
+        ):
+            with template_scope(template_path):
+                plain = self._get_plain_text_content_from_template(html, fragment)
+        return PartialRender(placeholders, blocks, html_content, rendered_html, html, plain)
+
+    def _substitute_partial_render(
+        self,
+        partial_render: Optional[PartialRender],
+        template_path: str,
+        context: Dict[str, Any],
+        personal_context: Dict[str, Any],
+    ) -> Optional[RenderedEmail]:
+        """Make a recipient's email from a partial render, if their values give the same output as a full render.
+
+        Args:
+            partial_render: The template rendered with placeholders, or None
+            template_path: Path to the template file
+            context: The full context of the recipient
+            personal_context: The variables that are personalized for the recipient
+
+        Returns:
+            The RenderedEmail, or None if the email has to be rendered in full
+        """
+        if partial_render is None:
+            return None
+        values = partial_render.values_for(personal_context)
+        if values is None:
+            return None
+
+        # Filters and tags may treat a value differently from its placeholder, so the Django templates are checked
+        with template_scope(template_path):
+            blocks = self._render_blocks(template_path, context)
+            if any(
+                blocks[key] != partial_render.substitute(block, values) for key, block in partial_render.blocks.items()
+            ):
+                return None
+            html_content = partial_render.substitute(partial_render.html_content, values)
+            base_template = self._get_base_template()
+            base_context = self._get_base_context(html_content, blocks, context)
+            rendered_html = self._render_base_template(base_template, base_context)
+            if rendered_html != partial_render.substitute(partial_render.rendered_html, values):
+                return None
+
+        plain = partial_render.substitute(partial_render.plain, values)
+        return RenderedEmail(
+            subject=blocks["subject"],
+            preheader=blocks["preheader"],
+            html=partial_render.substitute(partial_render.html, values),
+            plain=plain,
+            render_plain=(
+                bind_template(
+                    template_path,
+                    functools.partial(
+                        self._get_plain_text_content_from_template,
+                        fragment=self._get_plain_text_fragment(html_content, base_context),
+                    ),
+                )
+                if plain is None
+                else None
+            ),
+        )
+
+    def send_many(
+        self,
+        template_name: Union[str, list, tuple],
+        messages: Iterable[Union[BulkMessage, Tuple[Recipient, Dict[str, Any]]]],
+        from_email: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+        attachments: Optional[List[Any]] = None,
+        chunk_size: Optional[int] = None,
+        fail_silently: bool = False,
+        auth_user: Optional[str] = None,
+        auth_password: Optional[str] = None,
+        connection: Optional[BaseEmailBackend] = None,
+        base_url: Optional[str] = None,
+        workers: Optional[int] = None,
+        render_chunk_size: Optional[int] = None,
+        shared_context: Optional[Dict[str, Any]] = None,
+    ) -> List[SendResult]:
+        """Render a template for many recipients and send the messages over a single mail connection.
+
+        Messages are rendered with this backend and handed to the connection's ``send_messages`` in chunks of
+        ``chunk_size``. A message that fails to render is reported as failed and the others are still sent. If the
+        connection raises, or sends fewer messages than it was given, every message of that chunk is reported as
+        failed, since the connection does not tell which ones were sent. Use a ``chunk_size`` of 1 to know the
+        outcome of each message exactly.
+
+        With ``workers`` set, messages are rendered in that many worker processes, which recreate this backend from
+        its configuration. Contexts are then pickled to be sent to the workers, so they must be picklable.
+
+        With ``shared_context`` set, each message's context only holds the variables that differ for its recipient, and
+        the messages are rendered with :meth:`render_many`, so the parts of the email that are the same for everyone
+        are rendered once. Worker processes render each message in full, with the shared context merged in.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            messages: The recipient (an address or a list of addresses) and context of each message
+            from_email: The sender of the messages
+            cc: Addresses to copy each message to
+            bcc: Addresses to blind copy each message to
+            headers: Extra headers to add to each message
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            attachments: Attachments to add to each message
+            chunk_size: Number of messages sent at a time, defaults to ``TEMPLATED_EMAIL_SEND_MANY_CHUNK_SIZE``
+            fail_silently: Passed to the mail connection if one is created
+            auth_user: Username for the mail connection if one is created
+            auth_password: Password for the mail connection if one is created
+            connection: An existing mail connection to send the messages with. It is closed afterwards if it was not
+                open yet.
+            base_url: Base URL used to resolve relative URLs, defaults to ``TEMPLATED_EMAIL_BASE_URL``
+            workers: Number of worker processes to render the messages in, defaults to
+                ``TEMPLATED_EMAIL_RENDER_WORKERS``. With 0, messages are rendered in the calling process.
+            render_chunk_size: Number of messages a worker renders per task, defaults to
+                ``TEMPLATED_EMAIL_RENDER_CHUNK_SIZE``
+            shared_context: The variables that are the same for every message
+
+        Returns:
+            One SendResult per message, in the order the messages were given
+        """
+        self.base_url = (  # pylint: disable=W0201
+            base_url if base_url is not None else getattr(settings, "TEMPLATED_EMAIL_BASE_URL", "")
+        )
+        if chunk_size is None:
+            chunk_size = getattr(settings, "TEMPLATED_EMAIL_SEND_MANY_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+        if workers is None:
+            workers = getattr(settings, "TEMPLATED_EMAIL_RENDER_WORKERS", 0)
+        if render_chunk_size is None:
+            render_chunk_size = getattr(settings, "TEMPLATED_EMAIL_RENDER_CHUNK_SIZE", DEFAULT_RENDER_CHUNK_SIZE)
+
+        template_label = self._get_metrics_template_name(template_name, template_dir, file_extension)
+        owns_connection = connection is None
+        if owns_connection:
+            connection = get_connection(username=auth_user, password=auth_password, fail_silently=fail_silently)
+
+        prerendered = self._prerender_many(
+            template_name, messages, template_dir, file_extension, workers, render_chunk_size, shared_context
         )
+        message_kwargs = {
+            "from_email": from_email,
+            "cc": cc,
+            "bcc": bcc,
+            "headers": headers,
+            "template_dir": template_dir,
+            "file_extension": file_extension,
+            "attachments": attachments,
+        }
+        results: List[SendResult] = []
+        opened = False
+        try:
+            # A connection given already open is left open, as Django's send_messages does
+            opened = connection.open()
+            for chunk in chunked(prerendered, chunk_size):
+                results.extend(
+                    self._send_prerendered_chunk(connection, chunk, template_name, template_label, message_kwargs)
+                )
+        finally:
+            prerendered.close()
+            if owns_connection or opened:
+                connection.close()
+
+        return results
+
+    def _send_prerendered_chunk(
+        self,
+        connection: BaseEmailBackend,
+        chunk: List[Tuple[Recipient, Dict[str, Any], Union[RenderedEmail, Exception, None]]],
+        template_name: Union[str, list, tuple],
+        template_label: Optional[str],
+        message_kwargs: Dict[str, Any],
+    ) -> List[SendResult]:
+        """Build the messages of a chunk of a bulk send, and send those that rendered with a single connection call.
+
+        Args:
+            connection: The mail connection to send the messages with
+            chunk: The recipient, context and prerendered email or rendering error of each message
+            template_name: The name of the Markdown template to render
+            template_label: The template the messages are timed for
+            message_kwargs: The other arguments of each message, passed to :meth:`_get_prerendered_email_message`
+
+        Returns:
+            One SendResult per message of the chunk, in order
+        """
+        # Messages that failed to render have their result already, the others get it once sent
+        chunk_results: List[Optional[SendResult]] = []
+        pending = []
+        for recipient, context, rendered in chunk:
+            try:
+                if isinstance(rendered, Exception):
+                    raise rendered
+                email_message = self._get_prerendered_email_message(
+                    rendered, template_name, context, to=recipient_list(recipient), **message_kwargs
+                )
+            except Exception as e:  # pylint: disable=W0718
+                logger.error("Failed to render email for %s: %s", recipient, e)
+                chunk_results.append(SendResult(recipient, False, error=e))
+            else:
+                email_message.connection = connection
+                pending.append((recipient, email_message))
+                chunk_results.append(None)
+
+        sent_results = iter(self._send_chunk(connection, pending, template_label))
+        return [result or next(sent_results) for result in chunk_results]
+
+    def _prerender_many(
+        self,
+        template_name: Union[str, list, tuple],
+        messages: Iterable[Union[BulkMessage, Tuple[Recipient, Dict[str, Any]]]],
+        template_dir: Optional[str],
+        file_extension: Optional[str],
+        workers: int,
+        render_chunk_size: int,
+        shared_context: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[Tuple[Recipient, Dict[str, Any], Union[RenderedEmail, Exception, None]]]:
+        """Render the messages of a bulk send ahead of building them, in worker processes or from a shared context.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            messages: The recipient and context of each message
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            workers: Number of worker processes, or 0 to render in the calling process
+            render_chunk_size: Number of messages a worker renders per task
+            shared_context: The variables that are the same for every message, if they were given apart
+
+        Yields:
+            The recipient and full context of each message, in order, with the RenderedEmail or the exception raised
+            while rendering it, or None if the message is to be rendered when it is built
+        """
+        if workers < 1 and shared_context is None:
+            for recipient, context in messages:
+                yield recipient, context, None
+            return
+
+        if shared_context is not None and workers >= 1:
+            # Worker processes render every message in full
+            messages = ((recipient, {**shared_context, **context}) for recipient, context in messages)
+
+        # Messages are read ahead of the results, and wait here for their result
+        queued: Deque[Tuple[Recipient, Dict[str, Any]]] = deque()
+
+        def contexts() -> Iterator[Dict[str, Any]]:
+            for recipient, context in messages:
+                queued.append((recipient, context))
+                yield context
+
+        if workers < 1:
+            for rendered in self._render_personalized_many(
+                template_name, contexts(), shared_context, template_dir, file_extension
+            ):
+                recipient, context = queued.popleft()
+                yield recipient, {**shared_context, **context}, rendered
+            return
+
+        # Closing the pool's generator as soon as this one is closed shuts the worker processes down
+        with closing(
+            self._render_in_pool(template_name, contexts(), template_dir, file_extension, workers, render_chunk_size)
+        ) as rendered_emails:
+            for rendered in rendered_emails:
+                recipient, context = queued.popleft()
+                yield recipient, context, rendered
+
+    def _render_in_pool(
+        self,
+        template_name: Union[str, list, tuple],
+        contexts: Iterable[Dict[str, Any]],
+        template_dir: Optional[str],
+        file_extension: Optional[str],
+        workers: int,
+        render_chunk_size: int,
+    ) -> Iterator[Union[RenderedEmail, Exception]]:
+        """Render an email for each context in a pool of worker processes that have the template warmed.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            contexts: The full context of each email
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+            workers: Number of worker processes
+            render_chunk_size: Number of messages a worker renders per task
+
+        Yields:
+            The RenderedEmail for each context, in order, or the exception raised while rendering it
+        """
+        template_path = self._get_template_path(
+            template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
+        )
+        with RenderPool(self, workers, render_chunk_size, warm_templates=[template_path]) as pool:
+            yield from pool.render(template_name, contexts, template_dir, file_extension)
+
+    def _get_prerendered_email_message(
+        self,
+        rendered: Optional[RenderedEmail],
+        template_name: Union[str, list, tuple],
+        context: Dict[str, Any],
+        **kwargs,
+    ) -> EmailMessage:
+        """Build an email message from parts that are already rendered, or render them if there are none.
+
+        Args:
+            rendered: The rendered parts of the message, or None to render them
+            template_name: The name of the Markdown template
+            context: The context of the message
+            **kwargs: Arguments for ``get_email_message``
+
+        Returns:
+            The email message
+        """
+        token = _prerendered_email.set(rendered)
+        try:
+            return self.get_email_message(template_name, context, **kwargs)
+        finally:
+            _prerendered_email.reset(token)
+
+    def attach_inline_images(self, message: EmailMessage, context: Dict[str, Any]) -> None:
+        """Attach the InlineImage values of the context to a message, reusing their encoded MIME parts.
+
+        Args:
+            message: The email message
+            context: The context of the message
+        """
+        for value in context.values():
+            if isinstance(value, InlineImage):
+                message.attach(get_inline_image_part(value))
+
+    def _send_chunk(
+        self,
+        connection: BaseEmailBackend,
+        pending: List[Tuple[Recipient, EmailMessage]],
+        template_name: Optional[str] = None,
+    ) -> List[SendResult]:
+        """Send rendered messages with a single call to the connection's ``send_messages``.
+
+        Args:
+            connection: The mail connection to send the messages with
+            pending: The recipient and rendered message of each message to send
+            template_name: The template the messages were rendered from, that their delivery is timed for
+
+        Returns:
+            One SendResult per message
+        """
+        if not pending:
+            return []
+
+        try:
+            with timed("deliver", template_name):
+                sent = connection.send_messages([email_message for _, email_message in pending]) or 0
+        except Exception as e:  # pylint: disable=W0718
+            logger.error("Failed to send %d emails: %s", len(pending), e)
+            return [SendResult(recipient, False, error=e) for recipient, _ in pending]
+
+        error = None
+        if sent < len(pending):
+            error = BulkSendError(f"Only {sent} of {len(pending)} messages were sent.")
+            logger.error("Failed to send emails: %s", error)
+        return [
+            SendResult(recipient, error is None, email_message.extra_headers.get("Message-Id"), error)
+            for recipient, email_message in pending
+        ]
 
     def _render_markdown(self, content: str) -> str:
         """Convert Markdown content to HTML.
@@ -141,18 +834,22 @@ class MarkdownTemplateBackend(TemplateBackend):
             MarkdownRenderError: If Markdown conversion fails
         """
         try:
-            return markdown.markdown(content, extensions=self.markdown_extensions)
+            with timed("markdown") as timer:
+                html = get_markdown_engine(self.markdown_extensions, self.markdown_engine).render(content)
+                timer.set_output(html)
+            return html
         except Exception as e:
             logger.error("Failed to render Markdown: %s", e)
             if self.fail_silently:
                 return content  # Return raw content if conversion fails
             raise MarkdownRenderError(f"Failed to render Markdown: {e}") from e
 
-    def _inline_css(self, html: str) -> str:
+    def _inline_css(self, html: str, shell: Optional[str] = None) -> str:
         """Inline CSS styles in HTML content.
 
         Args:
             html: HTML content to process
+            shell: The base HTML rendered without the Markdown content, used for split-phase inlining
 
         Returns:
             HTML with inlined CSS
@@ -160,14 +857,23 @@ class MarkdownTemplateBackend(TemplateBackend):
         Raises:
             CSSInliningError: If CSS inlining fails
         """
+        from templated_email_md import inliners  # pylint: disable=C0415
+        from templated_email_md.css import inline_css_split  # pylint: disable=C0415
+
+        base_url = self.base_url if hasattr(self, "base_url") else ""
         try:
-            return premailer.transform(
-                html=html,
-                strip_important=False,
-                keep_style_tags=False,
-                cssutils_logging_level=logging.ERROR,
-                base_url=self.base_url if hasattr(self, "base_url") else "",
-            )
+            with timed("inline_css") as timer:
+                if shell is not None:
+                    inlined_html = inline_css_split(
+                        shell, html, base_url=base_url, strip_important=False, keep_style_tags=False
+                    )
+                else:
+                    inliner = inliners.get_inliner_class(self.css_inliner)(
+                        base_url=base_url, strip_important=False, keep_style_tags=False
+                    )
+                    inlined_html = inliner.inline(html)
+                timer.set_output(inlined_html)
+            return inlined_html
         except Exception as e:
             logger.error("Failed to inline CSS: %s", e)
             if self.fail_silently:
@@ -225,30 +931,23 @@ class MarkdownTemplateBackend(TemplateBackend):
         blocks["content"] = template_content.strip()
         return blocks
 
-    def _generate_plain_text(self, html_content: str) -> str:
+    def _generate_plain_text(self, html_content: str, base_url: str = "") -> str:
         """Generate plain text content from HTML.
 
         Args:
             html_content: HTML content to convert
+            base_url: Base URL that relative links are resolved against
 
         Returns:
             Plain text content without Markdown formatting
         """
-        h = html2text.HTML2Text()
-
-        # Apply default settings
-        h.ignore_links = False
-        h.ignore_images = True
-        h.body_width = 0
-        h.ignore_emphasis = True
-        h.mark_code = False
-        h.wrap_links = False
-
-        # Override with user-defined settings
-        for setting_name, setting_value in self.html2text_settings.items():
-            setattr(h, setting_name, setting_value)
-
-        return h.handle(html_content).strip()
+        with timed("plain_text") as timer:
+            h = get_html2text_converter(self.html2text_settings)
+            if base_url:
+                h.baseurl = base_url
+            plain_text = h.handle(html_content).strip()
+            timer.set_output(plain_text)
+        return plain_text
 
     def _render_email(
         self,
@@ -256,9 +955,13 @@ class MarkdownTemplateBackend(TemplateBackend):
         context: Dict[str, Any],
         template_dir: Optional[str] = None,
         file_extension: Optional[str] = None,
-    ) -> Dict[str, str]:
+    ) -> RenderedEmail:
         """Render the email content using the Markdown template and base HTML template.
 
+        The subject and preheader are rendered right away. The HTML is rendered when it is first read, and the plain
+        text is generated from it when it is first read. Renders sampled for profiling by
+        ``TEMPLATED_EMAIL_PROFILE_RATE`` render every part right away, under the profiler.
+
         Args:
             template_name (str or list): The name of the Markdown template to render.
             context (dict): The context to render the template with.
@@ -266,77 +969,265 @@ class MarkdownTemplateBackend(TemplateBackend):
             file_extension (str): The file extension of the template file.
 
         Returns:
-            Dictionary containing the rendered HTML, plain text, and subject.
+            RenderedEmail with the HTML, plain text, subject and preheader.
         """
-        fallback_content = _("Email template rendering failed.")
+        prerendered = _prerendered_email.get()
+        if prerendered is not None:
+            return prerendered
+
+        if should_profile():
+            return profile_render(
+                self._get_template_path(
+                    template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
+                ),
+                lambda: self._render_email(template_name, context, template_dir, file_extension).render(),
+            )
+
+        if is_render_cache_enabled():
+            cached = self._render_email_cached(template_name, context, template_dir, file_extension)
+            if cached is not None:
+                return cached
 
         try:
             template_path = self._get_template_path(
                 template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
             )
+            with template_scope(template_path):
+                blocks = self._render_blocks(template_path, context)
 
-            subject = self._get_subject_from_template(template_path, context)
-
-            preheader = self._get_preheader_from_template(template_path, context)
+        except Exception as e:
+            logger.error("Failed to render email: %s", str(e))
+            if self.fail_silently:
+                fallback_content = _("Email template rendering failed.")
+                return RenderedEmail(
+                    subject=self.default_subject,
+                    preheader=self.default_preheader,
+                    html=fallback_content,
+                    plain=fallback_content,
+                )
+            raise
 
-            content = self._get_content_from_template(template_path, context)
+        # In fragment mode, rendering the HTML keeps the content and context the plain text is generated from
+        fragment: Dict[str, Any] = {}
+        render_plain = self._get_plain_text_content_from_template
+        if self.plain_text_mode == "fragment":
+            render_plain = functools.partial(render_plain, fragment=fragment)
+        return RenderedEmail(
+            subject=blocks["subject"],
+            preheader=blocks["preheader"],
+            render_html=bind_template(
+                template_path, functools.partial(self._render_html, blocks, dict(context), fragment)
+            ),
+            render_plain=bind_template(template_path, render_plain),
+        )
 
-            html_content = self._get_html_content_from_template(content)
+    def _render_email_cached(
+        self,
+        template_name: Union[str, list, tuple],
+        context: Dict[str, Any],
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+    ) -> Optional[RenderedEmail]:
+        """Return an email from the render cache, rendering and storing it if it is not there yet.
 
-            # Get the base template
-            base_template = get_template(self.base_html_template)
+        Args:
+            template_name: The name of the Markdown template to render
+            context: The context to render the template with
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
 
-            # Create context for base template with all needed variables
-            base_context = {
-                **context,  # Original context
-                "markdown_content": html_content,
-                "subject": context.get("subject", subject),
-                "preheader": context.get("preheader", preheader),
-            }
+        Returns:
+            RenderedEmail with every part rendered, or None if the email cannot be cached
+        """
+        template_path = self._get_template_path(
+            template_name if isinstance(template_name, str) else template_name[0], template_dir, file_extension
+        )
+        try:
+            key = make_render_cache_key(template_path, context, self._get_render_cache_config())
+        except Exception as e:  # pylint: disable=W0718
+            # Contexts without a stable fingerprint are rendered as usual, and errors such as a missing template are
+            # reported when the email is rendered
+            logger.debug("Not caching email rendered from %s: %s", template_path, e)
+            record_skipped()
+            return None
+
+        parts = get_cached_email(key)
+        if parts is not None:
+            return RenderedEmail(**parts)
+
+        # Render without falling back, so that fallback content for a failure is never cached
+        strict = copy.copy(self)
+        strict.fail_silently = False
+        try:
+            with template_scope(template_path):
+                blocks = strict._render_blocks(template_path, context)  # pylint: disable=W0212
+                fragment: Dict[str, Any] = {}
+                html = strict._render_html(blocks, context, fragment)  # pylint: disable=W0212
+                plain = strict._get_plain_text_content_from_template(html, fragment)  # pylint: disable=W0212
+        except Exception:  # pylint: disable=W0718
+            return None
+
+        parts = {"html": html, "plain": plain, "subject": blocks["subject"], "preheader": blocks["preheader"]}
+        set_cached_email(key, parts)
+        return RenderedEmail(**parts)
+
+    def _get_render_cache_config(self) -> Dict[str, Any]:
+        """Return the settings of the backend that change a rendered email, to make its cache key."""
+        return {
+            "base_html_template": self.base_html_template,
+            "markdown_extensions": self.markdown_extensions,
+            "markdown_engine": self.markdown_engine,
+            "html2text_settings": self.html2text_settings,
+            "plain_text_mode": self.plain_text_mode,
+            "split_inlining": self.split_inlining,
+            "css_inliner": self.css_inliner,
+            "default_subject": self.default_subject,
+            "default_preheader": self.default_preheader,
+            "base_url": getattr(self, "base_url", ""),
+        }
+
+    def _render_html(
+        self, blocks: Dict[str, str], context: Dict[str, Any], fragment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Render the final HTML of an email from its rendered blocks.
 
-            # Render base template
-            rendered_html = base_template.render(base_context)
+        Args:
+            blocks: The rendered subject, preheader and content of the email
+            context: The context the blocks were rendered with
+            fragment: Updated with the HTML content and base context, to generate the plain text from in fragment mode
 
-            # Inline CSS
-            inlined_html = self._inline_css(rendered_html)
+        Returns:
+            The HTML content, with CSS inlined and comments removed
+        """
+        try:
+            html_content = self._get_html_content_from_template(blocks["content"])
 
-            # Remove comments from the final HTML message
-            final_html = self._remove_comments(inlined_html)
+            # Get the base template
+            base_template = self._get_base_template()
 
-            plain_text = self._get_plain_text_content_from_template(final_html)
+            # Render base template
+            base_context = self._get_base_context(html_content, blocks, context)
+            if fragment is not None:
+                fragment.update(self._get_plain_text_fragment(html_content, base_context))
+            rendered_html = self._render_base_template(base_template, base_context)
 
-            return {"html": final_html, "plain": plain_text, "subject": subject, "preheader": preheader}
+            return self._finish_html(base_template, base_context, rendered_html)
 
         except Exception as e:
             logger.error("Failed to render email: %s", str(e))
             if self.fail_silently:
-                return {
-                    "html": fallback_content,
-                    "plain": fallback_content,
-                    "subject": self.default_subject,
-                    "preheader": self.default_preheader,
-                }
+                return _("Email template rendering failed.")
             raise
 
-    def _get_subject_from_template(self, template_path: str, context: Dict[str, Any]) -> Optional[str]:
-        """Extract subject from template block.
+    def _get_base_template(self) -> Any:
+        """Return the base HTML template, tracking its sources so that changes to them are picked up."""
+        base_template = get_template(self.base_html_template)
+        track_template(base_template.template)
+        return base_template
+
+    def _render_base_template(self, base_template: Any, base_context: Dict[str, Any]) -> str:
+        """Render the base HTML template around the HTML converted from the Markdown content.
+
+        Args:
+            base_template: The base HTML template
+            base_context: The context returned by ``_get_base_context``
+
+        Returns:
+            The rendered base template, before CSS is inlined
+        """
+        with timed("base_template") as timer:
+            rendered_html = base_template.render(base_context)
+            timer.set_output(rendered_html)
+        return rendered_html
+
+    def _get_base_context(self, html_content: str, blocks: Dict[str, str], context: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the context for the base HTML template.
+
+        Args:
+            html_content: The HTML converted from the Markdown content
+            blocks: The rendered subject, preheader and content of the email
+            context: The context the blocks were rendered with
+
+        Returns:
+            The original context, with the HTML content, subject and preheader
+        """
+        return {
+            **context,  # Original context
+            "markdown_content": html_content,
+            "subject": context.get("subject", blocks["subject"]),
+            "preheader": context.get("preheader", blocks["preheader"]),
+        }
+
+    def _finish_html(self, base_template: Any, base_context: Dict[str, Any], rendered_html: str) -> str:
+        """Inline the CSS of the rendered base HTML template and remove its comments.
+
+        Args:
+            base_template: The base HTML template
+            base_context: The context the base template was rendered with
+            rendered_html: The rendered base template
+
+        Returns:
+            The final HTML content
+        """
+        # Inline CSS, reusing the inlined base shell if split-phase inlining is enabled
+        from templated_email_md import inliners  # pylint: disable=C0415
+        from templated_email_md.css import CONTENT_MARKER  # pylint: disable=C0415
+
+        shell = None
+        if self.split_inlining and inliners.get_inliner_class(self.css_inliner).supports_split_inlining:
+            shell = base_template.render({**base_context, "markdown_content": CONTENT_MARKER})
+        inlined_html = self._inline_css(rendered_html, shell=shell)
+
+        # Remove comments from the final HTML message
+        return self._remove_comments(inlined_html)
+
+    def _render_blocks(self, template_path: str, context: Dict[str, Any]) -> Dict[str, str]:
+        """Render the subject, preheader and content of a template in a single pass.
 
         Args:
             template_path: Path to the template file
             context: Context to render the template with
 
         Returns:
-            Subject text
+            Dictionary containing the rendered subject, preheader and content
         """
-        try:
-            subject = render_block_to_string(template_path, "subject", context).strip()
-        except BlockNotFound:
+        with timed("blocks") as timer:
+            blocks = get_render_plan(template_path).render(context)
+            timer.set_output(blocks["content"])
+        return {
+            "subject": self._resolve_subject(blocks["subject"], context),
+            "preheader": self._resolve_preheader(blocks["preheader"], context),
+            "content": blocks["content"],
+        }
+
+    def _resolve_subject(self, subject: Optional[str], context: Dict[str, Any]) -> Optional[str]:
+        """Apply the default subject and any subject provided in the context to a rendered subject block."""
+        if subject is None:
             subject = self.default_subject
 
         # Override subject if 'subject' is in context
-        subject = context.get("subject", subject)
+        return context.get("subject", subject)
 
-        return subject
+    def _resolve_preheader(self, preheader: Optional[str], context: Dict[str, Any]) -> Optional[str]:
+        """Apply the default preheader and any preheader provided in the context to a rendered preheader block."""
+        if preheader is None:
+            preheader = self.default_preheader
+
+        # Override preheader if 'preheader' is in context
+        return context.get("preheader", preheader)
+
+    def _get_subject_from_template(self, template_path: str, context: Dict[str, Any]) -> Optional[str]:
+        """Extract subject from template block.
+
+        Args:
+            template_path: Path to the template file
+            context: Context to render the template with
+
+        Returns:
+            Subject text
+        """
+        subject = get_render_plan(template_path).render(context, ("subject",))["subject"]
+        return self._resolve_subject(subject, context)
 
     def _get_preheader_from_template(self, template_path: str, context: Dict[str, Any]) -> Optional[str]:
         """Extract preheader from template block.
@@ -348,52 +1239,27 @@ class MarkdownTemplateBackend(TemplateBackend):
         Returns:
             Preheader text
         """
-        try:
-            preheader = render_block_to_string(template_path, "preheader", context).strip()
-        except BlockNotFound:
-            preheader = self.default_preheader
-
-        # Override preheader if 'preheader' is in context
-        preheader = context.get("preheader", preheader)
-
-        return preheader
+        preheader = get_render_plan(template_path).render(context, ("preheader",))["preheader"]
+        return self._resolve_preheader(preheader, context)
 
     def _get_content_from_template(
         self,
         template_path: str,
         context: Dict[str, Any],
-    ) -> Dict[str, str]:
+    ) -> str:
         """Extract content from template block.
 
+        If the template has no 'content' block, the entire template is rendered without its 'subject' and
+        'preheader' blocks.
+
         Args:
             template_path: Path to the template file
             context: Context to render the template with
 
         Returns:
-            Dictionary containing the rendered HTML, plain text, and subject.
+            The rendered content
         """
-        try:
-            content = render_block_to_string(template_path, "content", context).strip()
-        except BlockNotFound:
-            # If 'content' block is not defined, render the entire template without 'subject' and 'preheader' blocks
-            md_template = get_template(template_path)
-            template_source = md_template.template.source
-            # Remove the 'subject' and 'preheader' blocks from the template source
-            patterns = [
-                r"{% block subject %}.*?{% endblock %}",
-                r"{% block subject %}.*?{% endblock subject %}",
-                r"{% block preheader %}.*?{% endblock %}",
-                r"{% block preheader %}.*?{% endblock preheader %}",
-            ]
-            content_without_subject_or_preheader = template_source
-            for pattern in patterns:
-                content_without_subject_or_preheader = re.sub(
-                    pattern, "", content_without_subject_or_preheader, flags=re.DOTALL
-                ).strip()
-
-            content_template = Template(content_without_subject_or_preheader)
-            content = content_template.render(Context(context))
-        return content
+        return get_render_plan(template_path).render(context, ("content",))["content"]
 
     def _get_html_content_from_template(
         self,
@@ -422,20 +1288,60 @@ class MarkdownTemplateBackend(TemplateBackend):
         html_content = self._remove_comments(html_content)
         return html_content
 
-    def _get_plain_text_content_from_template(
-        self,
-        content: str,
-    ) -> str:
+    def _get_plain_text_fragment(self, html_content: str, base_context: Dict[str, Any]) -> Dict[str, Any]:
+        """Return what the plain text is generated from in fragment mode, or an empty dict in html mode.
+
+        Args:
+            html_content: The HTML converted from the Markdown content
+            base_context: The context of the base HTML template
+
+        Returns:
+            The keyword arguments of ``_get_plain_text_document``
+        """
+        if self.plain_text_mode != "fragment":
+            return {}
+        return {"html_content": html_content, "base_context": base_context}
+
+    def _get_plain_text_document(self, html_content: str, base_context: Dict[str, Any]) -> str:
+        """Return the HTML the plain text is generated from in fragment mode.
+
+        Only the preheader, the HTML converted from the Markdown content and the ``footer`` block of the base HTML
+        template are converted, rather than the whole base template with its CSS inlined.
+
+        Args:
+            html_content: The HTML converted from the Markdown content
+            base_context: The context of the base HTML template
+
+        Returns:
+            The preheader, content and footer as HTML
+        """
+        parts = []
+        preheader = base_context.get("preheader")
+        if preheader:
+            parts.append(f"<p>{conditional_escape(preheader)}</p>")
+        parts.append(html_content)
+        footer = get_render_plan(self.base_html_template).render(base_context, ("footer",))["footer"]
+        if footer:
+            parts.append(f"<div>{self._remove_comments(footer)}</div>")
+        return "\n".join(parts)
+
+    def _get_plain_text_content_from_template(self, content: str, fragment: Optional[Dict[str, Any]] = None) -> str:
         """Generate plain text content from HTML.
 
         Args:
-            html_content: HTML content to convert
+            content: HTML content to convert
+            fragment: The arguments of ``_get_plain_text_document`` in fragment mode, to generate the plain text from
+                the Markdown content and footer instead of the HTML content
 
         Returns:
             Plain text content without Markdown formatting
         """
         try:
-            plain_text = self._generate_plain_text(content)
+            if fragment:
+                document = self._get_plain_text_document(**fragment)
+                plain_text = self._generate_plain_text(document, getattr(self, "base_url", ""))
+            else:
+                plain_text = self._generate_plain_text(content)
         except Exception as e:  # pylint: disable=W0718
             if self.fail_silently:
                 logger.error("Error generating plain text: %s", e)
@@ -444,24 +1350,6 @@ class MarkdownTemplateBackend(TemplateBackend):
                 raise
         return plain_text
 
-    def _remove_multiline_comments(self, html: str) -> str:
-        """Remove multi-line JavaScript and CSS comments."""
-        return re.sub(r"/\*[\s\S]*?\*/", "", html)
-
-    def _remove_singleline_comments(self, html: str) -> str:
-        """Remove single-line JavaScript and CSS comments while preserving URLs."""
-        # Pattern to match // comments not preceded by :, ", ', or =
-        pattern = r'(?<!:)(?<!")(?<!\')(?<!=)//.*?$'
-        return re.sub(pattern, "", html, flags=re.MULTILINE)
-
-    def _remove_html_comments(self, html: str) -> str:
-        """Remove HTML comments but preserve IE conditional comments."""
-        return re.sub(r"<!--(?!\[if).*?-->", "", html, flags=re.DOTALL)
-
-    def _clean_extra_blank_lines(self, html: str) -> str:
-        """Remove extra blank lines created by comment removal."""
-        return re.sub(r"\n\s*\n", "\n", html)
-
     def _remove_comments(self, html: str) -> str:
         """Remove HTML, JavaScript, and CSS comments from HTML content while retaining URLs and IE-specific comments.
 
@@ -471,8 +1359,7 @@ class MarkdownTemplateBackend(TemplateBackend):
         Returns:
             str: HTML content with comments removed.
         """
-        html = self._remove_multiline_comments(html)
-        html = self._remove_singleline_comments(html)
-        html = self._remove_html_comments(html)
-        html = self._clean_extra_blank_lines(html)
+        with timed("remove_comments") as timer:
+            html = remove_comments(html)
+            timer.set_output(html)
         return html
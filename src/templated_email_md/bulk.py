@@ -0,0 +1,67 @@
+"""Types and helpers for sending one template to many recipients."""
+
+from itertools import islice
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import TypeVar
+from typing import Union
+
+
+# Default number of messages handed to the mail connection at a time
+DEFAULT_CHUNK_SIZE = 100
+
+T = TypeVar("T")
+
+Recipient = Union[str, Sequence[str]]
+
+
+class BulkMessage(NamedTuple):
+    """A recipient and the context to render the template with for them.
+
+    Plain ``(recipient, context)`` tuples are accepted wherever a BulkMessage is.
+    """
+
+    recipient: Recipient
+    context: Dict[str, Any]
+
+
+class SendResult(NamedTuple):
+    """The outcome of sending a message to a recipient."""
+
+    recipient: Recipient
+    success: bool
+    message_id: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+def recipient_list(recipient: Recipient) -> List[str]:
+    """Return the list of addresses for a recipient given as an address or a list of addresses."""
+    if isinstance(recipient, str):
+        return [recipient]
+    return list(recipient)
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yield lists of up to ``size`` items.
+
+    Args:
+        items: The items to split
+        size: The maximum number of items in a chunk
+
+    Yields:
+        Consecutive chunks of the items
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1.")
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
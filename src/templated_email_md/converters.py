@@ -0,0 +1,142 @@
+"""Reusable converter instances for the MarkdownTemplateBackend."""
+
+import threading
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from templated_email_md.invalidation import register_cache
+
+
+if TYPE_CHECKING:
+    import html2text
+    import markdown
+
+
+# Settings applied to html2text before any TEMPLATED_EMAIL_HTML2TEXT_SETTINGS
+HTML2TEXT_DEFAULTS = {
+    "ignore_links": False,
+    "ignore_images": True,
+    "body_width": 0,
+    "ignore_emphasis": True,
+    "mark_code": False,
+    "wrap_links": False,
+}
+
+_local = threading.local()
+_html2text_factory: Tuple[Dict[str, Any], "HTML2TextFactory"] = ({}, None)
+
+# Incremented to discard the converters of every thread
+_generation = 0
+
+
+def get_markdown_converter(extensions: Sequence) -> "markdown.Markdown":
+    """Return this thread's Markdown converter for a list of extensions.
+
+    Building a ``markdown.Markdown`` instance imports and registers every extension, so converters are built once per
+    thread and per list of extensions. A change to the extensions builds a new converter. Python-Markdown itself is
+    only imported when the first converter is built.
+
+    Args:
+        extensions: The Markdown extensions to enable
+
+    Returns:
+        A Markdown converter owned by the current thread
+    """
+    key = tuple(extensions)
+    converters: Dict[Tuple, "markdown.Markdown"] = getattr(_local, "markdown_converters", None)
+    if converters is None or _local.generation != _generation:
+        converters = _local.markdown_converters = {}
+        _local.generation = _generation
+
+    converter = converters.get(key)
+    if converter is None:
+        import markdown  # pylint: disable=C0415
+
+        converter = converters[key] = markdown.Markdown(extensions=list(extensions))
+    return converter
+
+
+def render_markdown(content: str, extensions: Sequence) -> str:
+    """Convert Markdown content to HTML using a reusable converter.
+
+    Args:
+        content: Markdown content to convert
+        extensions: The Markdown extensions to enable
+
+    Returns:
+        Converted HTML content
+    """
+    # Reset any state (footnotes, meta data, etc.) left over from the previous conversion
+    return get_markdown_converter(extensions).reset().convert(content)
+
+
+class HTML2TextFactory:
+    """Builds isolated, fully configured HTML2Text converters from a template converter.
+
+    The template is configured once with the defaults and the user's settings. Each converter handed out starts from a
+    copy of the template's attributes, with fresh copies of the containers that hold per-document state.
+    """
+
+    def __init__(self, settings: Dict[str, Any]):
+        """Initialize the HTML2TextFactory.
+
+        Args:
+            settings: html2text settings overriding :data:`HTML2TEXT_DEFAULTS`
+        """
+        import html2text  # pylint: disable=C0415
+
+        self._converter_class = html2text.HTML2Text
+        template = self._converter_class()
+        for setting_name, setting_value in {**HTML2TEXT_DEFAULTS, **settings}.items():
+            setattr(template, setting_name, setting_value)
+
+        self._state = dict(template.__dict__)
+        # The default output callback is bound to the template, so it is rebound to each new converter
+        self._rebind_out = getattr(template.out, "__self__", None) is template
+        if self._rebind_out:
+            del self._state["out"]
+        self._containers = [(name, type(value)) for name, value in self._state.items() if type(value) in (list, dict)]
+
+    def __call__(self) -> "html2text.HTML2Text":
+        """Return a new converter configured like the template."""
+        converter = self._converter_class.__new__(self._converter_class)
+        converter.__dict__ = state = self._state.copy()
+        for name, container_type in self._containers:
+            state[name] = container_type(state[name])
+        if self._rebind_out:
+            state["out"] = converter.outtextf
+        return converter
+
+
+def get_html2text_converter(settings: Dict[str, Any]) -> "html2text.HTML2Text":
+    """Return a new HTML2Text converter configured with the defaults and the given settings.
+
+    Args:
+        settings: html2text settings overriding :data:`HTML2TEXT_DEFAULTS`
+
+    Returns:
+        A converter that is not shared with any other caller
+    """
+    global _html2text_factory  # pylint: disable=W0603
+
+    # Backends share the same settings, so only the factory for the most recent settings is kept
+    factory_settings, factory = _html2text_factory
+    if factory is None or factory_settings != settings:
+        factory = HTML2TextFactory(settings)
+        _html2text_factory = (dict(settings), factory)
+    return factory()
+
+
+def reset_converters() -> None:
+    """Discard the converters of every thread, so that they are built again on next use."""
+    global _generation, _html2text_factory  # pylint: disable=W0603
+
+    _generation += 1
+    _html2text_factory = ({}, None)
+
+
+# Converters are keyed by their settings, so they do not depend on the template sources
+register_cache(reset_converters, on_source_change=False)
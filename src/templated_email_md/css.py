@@ -0,0 +1,336 @@
+"""CSS inlining that parses each distinct stylesheet only once."""
+
+import hashlib
+import logging
+import re
+from copy import deepcopy
+from html.parser import HTMLParser
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from lxml import etree
+from premailer import Premailer
+
+from templated_email_md.invalidation import register_cache
+from templated_email_md.utils import LRUCache
+
+
+# Maximum number of parsed stylesheets to keep
+STYLESHEET_CACHE_SIZE = 64
+
+# Maximum number of pre-inlined base HTML shells to keep
+SHELL_CACHE_SIZE = 128
+
+# Placeholder rendered in place of the Markdown content when rendering a base HTML shell
+CONTENT_MARKER = "TEMPLATED-EMAIL-MD-CONTENT-0c5e8f2a"
+
+# Selectors that depend on siblings outside the content, which split-phase inlining cannot match
+UNSUPPORTED_SELECTOR_PATTERN = re.compile(r"[+~]|:(first|last|nth|only)-")
+
+# Elements that have no end tag
+VOID_ELEMENTS = frozenset(
+    ("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr")
+)
+
+
+class ParsedLeftover(list):
+    """The rules of a stylesheet that cannot be inlined, along with their serialized CSS."""
+
+    css_text: str = ""
+
+
+_parsed_stylesheets = LRUCache(maxsize=STYLESHEET_CACHE_SIZE)
+# Stylesheets are keyed by their content, so they do not depend on the template sources
+register_cache(_parsed_stylesheets.clear, on_source_change=False)
+
+
+class CachedPremailer(Premailer):
+    """A Premailer that reuses the parsed rules of stylesheets it has already seen.
+
+    Parsing a stylesheet with cssutils and serializing the rules that cannot be inlined (media queries and
+    pseudo-classes) is the most expensive part of inlining, and it depends only on the stylesheet and the inlining
+    options. Results are cached by a hash of the stylesheet's content and shared by every instance.
+    """
+
+    def _cache_key(self, css_body: str, ruleset_index: int) -> Tuple:
+        """Return the key for a parsed stylesheet."""
+        return (
+            hashlib.sha256(css_body.encode("utf-8")).hexdigest(),
+            ruleset_index,
+            self.strip_important,
+            self.exclude_pseudoclasses,
+            self.include_star_selectors,
+            self.disable_validation,
+        )
+
+    def _parse_style_rules(self, css_body: str, ruleset_index: int) -> Tuple[List, List]:
+        """Return the rules to inline and the leftover rules of a stylesheet, parsing it only once.
+
+        Args:
+            css_body: The stylesheet
+            ruleset_index: The position of the stylesheet in the document
+
+        Returns:
+            The rules to inline and the rules that cannot be inlined
+        """
+        if not css_body:
+            return [], []
+
+        key = self._cache_key(css_body, ruleset_index)
+        cached = _parsed_stylesheets.get(key)
+        if cached is None:
+            rules, leftover = super()._parse_style_rules(css_body, ruleset_index)
+            parsed_leftover = ParsedLeftover(leftover)
+            parsed_leftover.css_text = super()._css_rules_to_string(leftover)
+            cached = (tuple(rules), parsed_leftover)
+            _parsed_stylesheets.set(key, cached)
+
+        rules, leftover = cached
+        return list(rules), leftover
+
+    def _css_rules_to_string(self, rules: List) -> str:
+        """Return the CSS for rules that cannot be inlined, reusing the serialized CSS of cached stylesheets.
+
+        Args:
+            rules: The rules to serialize
+
+        Returns:
+            The serialized CSS
+        """
+        if isinstance(rules, ParsedLeftover):
+            return rules.css_text
+        return super()._css_rules_to_string(rules)
+
+
+def _premailer_options(base_url: str, strip_important: bool, keep_style_tags: bool) -> dict:
+    """Return the keyword arguments used to build a CachedPremailer."""
+    return {
+        "strip_important": strip_important,
+        "keep_style_tags": keep_style_tags,
+        "cssutils_logging_level": logging.ERROR,
+        "base_url": base_url,
+    }
+
+
+def inline_css(html: str, base_url: str = "", strip_important: bool = False, keep_style_tags: bool = False) -> str:
+    """Inline the CSS styles of an HTML document.
+
+    Args:
+        html: HTML content to process
+        base_url: Base URL used to resolve relative URLs
+        strip_important: Whether to strip ``!important`` from the inlined styles
+        keep_style_tags: Whether to keep the ``<style>`` tags after inlining
+
+    Returns:
+        HTML with inlined CSS
+    """
+    return CachedPremailer(**_premailer_options(base_url, strip_important, keep_style_tags)).transform(
+        html, pretty_print=False
+    )
+
+
+class InlinedShell:
+    """A base HTML shell that has been inlined once, ready to have inlined content spliced into it."""
+
+    __slots__ = ("before", "after", "ancestors", "styles")
+
+    def __init__(self, before: str, after: str, ancestors: List[Tuple[str, dict]], styles: List[Any]):
+        """Initialize the InlinedShell.
+
+        Args:
+            before: The inlined shell up to the content
+            after: The inlined shell after the content
+            ancestors: The tag and attributes of each element containing the content, outermost first
+            styles: The ``<style>`` elements of the shell
+        """
+        self.before = before
+        self.after = after
+        self.ancestors = ancestors
+        self.styles = styles
+
+
+_inlined_shells = LRUCache(maxsize=SHELL_CACHE_SIZE)
+register_cache(_inlined_shells.clear, on_source_change=False)
+
+
+def _find_content_element(tree: Any) -> Optional[Any]:
+    """Return the element whose text contains the content marker."""
+    for element in tree.iter():
+        if element.text and CONTENT_MARKER in element.text:
+            return element
+        if element.tail and CONTENT_MARKER in element.tail:
+            return element.getparent()
+    return None
+
+
+def _build_inlined_shell(shell: str, options: dict) -> Optional[InlinedShell]:
+    """Inline a base HTML shell and record what is needed to inline content for it.
+
+    Args:
+        shell: The base HTML rendered with the content marker in place of the Markdown content
+        options: The options to build the CachedPremailer with
+
+    Returns:
+        The InlinedShell, or None if the shell does not support split-phase inlining
+    """
+    tree = etree.fromstring(shell.strip(), etree.HTMLParser()).getroottree()
+    content_element = _find_content_element(tree)
+    if content_element is None or tree.xpath("//link[contains(concat(' ', @rel, ' '), ' stylesheet ')]"):
+        return None
+
+    premailer = CachedPremailer(**options)
+    styles = tree.xpath("//style")
+    for index, style in enumerate(styles):
+        rules, _ = premailer._parse_style_rules(style.text, index)  # pylint: disable=W0212
+        if any(UNSUPPORTED_SELECTOR_PATTERN.search(selector) for _, selector, _ in rules):
+            return None
+
+    inlined = premailer.transform(shell, pretty_print=False)
+    before, marker, after = inlined.partition(CONTENT_MARKER)
+    if not marker or CONTENT_MARKER in after:
+        return None
+
+    ancestors = [(element.tag, dict(element.attrib)) for element in reversed(list(content_element.iterancestors()))]
+    ancestors.append((content_element.tag, dict(content_element.attrib)))
+    return InlinedShell(before, after, ancestors, [deepcopy(style) for style in styles])
+
+
+def get_inlined_shell(
+    shell: str, base_url: str = "", strip_important: bool = False, keep_style_tags: bool = False
+) -> Optional[InlinedShell]:
+    """Return the inlined version of a base HTML shell, inlining it on first use.
+
+    Args:
+        shell: The base HTML rendered with the content marker in place of the Markdown content
+        base_url: Base URL used to resolve relative URLs
+        strip_important: Whether to strip ``!important`` from the inlined styles
+        keep_style_tags: Whether to keep the ``<style>`` tags after inlining
+
+    Returns:
+        The InlinedShell, or None if the shell does not support split-phase inlining
+    """
+    key = (hashlib.sha256(shell.encode("utf-8")).hexdigest(), base_url, strip_important, keep_style_tags)
+    if key in _inlined_shells:
+        return _inlined_shells.get(key)
+
+    inlined_shell = _build_inlined_shell(shell, _premailer_options(base_url, strip_important, keep_style_tags))
+    _inlined_shells.set(key, inlined_shell)
+    return inlined_shell
+
+
+class _TagSequenceParser(HTMLParser):
+    """Collects the start and end tags of an HTML document, other than those of void elements."""
+
+    def __init__(self):
+        """Initialize the _TagSequenceParser."""
+        super().__init__(convert_charrefs=True)
+        self.tags: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        """Record a start tag."""
+        if tag not in VOID_ELEMENTS:
+            self.tags.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        """Record a self-closing tag, which HTML parsers read as a start tag."""
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str) -> None:
+        """Record an end tag."""
+        if tag not in VOID_ELEMENTS:
+            self.tags.append(f"/{tag}")
+
+
+def _tag_sequence(html: str) -> List[str]:
+    """Return the start and end tags of an HTML document, in order, other than those of void elements."""
+    parser = _TagSequenceParser()
+    parser.feed(html)
+    parser.close()
+    return parser.tags
+
+
+def _inline_fragment(inlined_shell: InlinedShell, fragment: str, options: dict) -> Optional[str]:
+    """Inline the CSS of the shell into a content fragment.
+
+    The fragment is placed in a skeleton document made of the shell's styles and the chain of elements that contain
+    the content, so that selectors match the fragment as they would in the full document.
+
+    Args:
+        inlined_shell: The shell the fragment will be spliced into
+        fragment: The rendered content
+        options: The options to build the CachedPremailer with
+
+    Returns:
+        The inlined fragment, or None if the fragment has unclosed or stray tags, which the parser would match with
+        tags of the shell in the full document
+    """
+    parsed = etree.fromstring(f"<html><body><div>{fragment}</div></body></html>", etree.HTMLParser())
+    container = parsed.find("body/div")
+    if container is None:
+        return None
+    serialized_fragment = etree.tostring(container, method="html", encoding="unicode", with_tail=False)
+    if _tag_sequence(serialized_fragment) != ["div", *_tag_sequence(fragment), "/div"]:
+        return None
+
+    (root_tag, root_attrib), *ancestors = inlined_shell.ancestors
+    root = etree.Element(root_tag, root_attrib)
+    head = etree.SubElement(root, "head")
+    for style in inlined_shell.styles:
+        head.append(deepcopy(style))
+    slot = root
+    for tag, attrib in ancestors:
+        slot = etree.SubElement(slot, tag, attrib)
+
+    slot.text = container.text
+    for child in list(container):
+        slot.append(child)
+
+    CachedPremailer(**options).transform(root)
+
+    slot.attrib.clear()
+    serialized = etree.tostring(slot, method="html", encoding="unicode", with_tail=False)
+    return serialized[len(f"<{slot.tag}>") : -len(f"</{slot.tag}>")]
+
+
+def inline_css_split(
+    shell: str, html: str, base_url: str = "", strip_important: bool = False, keep_style_tags: bool = False
+) -> str:
+    """Inline the CSS styles of an HTML document by inlining its base shell once and only its content per call.
+
+    The shell is the base HTML rendered with :data:`CONTENT_MARKER` in place of the Markdown content. If the shell
+    cannot be split around the content, its styles use selectors that depend on elements outside the content, or the
+    content has unclosed or stray tags, the whole document is inlined instead.
+
+    Args:
+        shell: The base HTML rendered with the content marker in place of the Markdown content
+        html: The base HTML rendered with the Markdown content
+        base_url: Base URL used to resolve relative URLs
+        strip_important: Whether to strip ``!important`` from the inlined styles
+        keep_style_tags: Whether to keep the ``<style>`` tags after inlining
+
+    Returns:
+        HTML with inlined CSS
+    """
+    prefix, marker, suffix = shell.partition(CONTENT_MARKER)
+    inlined_shell = None
+    if (
+        marker
+        and CONTENT_MARKER not in suffix
+        and len(html) >= len(prefix) + len(suffix)
+        and html.startswith(prefix)
+        and html.endswith(suffix)
+    ):
+        inlined_shell = get_inlined_shell(shell, base_url, strip_important, keep_style_tags)
+
+    if inlined_shell is None:
+        return inline_css(html, base_url, strip_important, keep_style_tags)
+
+    fragment = html[len(prefix) : len(html) - len(suffix)]
+    inlined_fragment = _inline_fragment(
+        inlined_shell, fragment, _premailer_options(base_url, strip_important, keep_style_tags)
+    )
+    if inlined_fragment is None:
+        return inline_css(html, base_url, strip_important, keep_style_tags)
+    return inlined_shell.before + inlined_fragment + inlined_shell.after
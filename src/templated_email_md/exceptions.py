@@ -11,3 +11,11 @@ class MarkdownRenderError(MarkdownTemplateBackendError):
 
 class CSSInliningError(MarkdownTemplateBackendError):
     """Raised when CSS inlining fails."""
+
+
+class BulkSendError(MarkdownTemplateBackendError):
+    """Raised when the mail connection does not send every message of a chunk."""
+
+
+class RenderWorkerError(MarkdownTemplateBackendError):
+    """Raised in place of an error from a render worker process that cannot be sent back to the calling process."""
@@ -0,0 +1,111 @@
+"""Executors and limits shared by the asynchronous API of the MarkdownTemplateBackend."""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from django.conf import settings
+
+from templated_email_md.invalidation import register_cache
+
+
+# Default number of emails rendered or sent at the same time on an event loop
+DEFAULT_ASYNC_CONCURRENCY = 100
+
+_executors_lock = threading.Lock()
+_render_executor: Optional[ThreadPoolExecutor] = None
+_delivery_executor: Optional[ThreadPoolExecutor] = None
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def get_async_concurrency() -> int:
+    """Return the maximum number of emails rendered or sent at the same time on an event loop."""
+    return getattr(settings, "TEMPLATED_EMAIL_ASYNC_CONCURRENCY", DEFAULT_ASYNC_CONCURRENCY)
+
+
+def get_render_executor() -> ThreadPoolExecutor:
+    """Return the executor that runs the CPU-bound rendering stages.
+
+    Rendering holds the GIL, so the executor has as many threads as ``TEMPLATED_EMAIL_ASYNC_RENDER_THREADS``,
+    which defaults to the number of CPUs.
+    """
+    global _render_executor  # pylint: disable=W0603
+
+    with _executors_lock:
+        if _render_executor is None:
+            threads = getattr(settings, "TEMPLATED_EMAIL_ASYNC_RENDER_THREADS", None) or os.cpu_count() or 1
+            _render_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="templated-email-render")
+        return _render_executor
+
+
+def get_delivery_executor() -> ThreadPoolExecutor:
+    """Return the executor that hands rendered messages to the mail connection.
+
+    Delivery waits on the network, so the executor has as many threads as emails can be sent at the same time.
+    """
+    global _delivery_executor  # pylint: disable=W0603
+
+    with _executors_lock:
+        if _delivery_executor is None:
+            _delivery_executor = ThreadPoolExecutor(
+                max_workers=get_async_concurrency(), thread_name_prefix="templated-email-delivery"
+            )
+        return _delivery_executor
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore that limits the number of emails rendered or sent at the same time on the running loop."""
+    loop = asyncio.get_running_loop()
+    with _executors_lock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = _semaphores[loop] = asyncio.Semaphore(get_async_concurrency())
+        return semaphore
+
+
+async def run_in_executor(executor: ThreadPoolExecutor, func: Callable[..., Any], *args: Any) -> Any:
+    """Run a function in an executor, in a copy of the current context.
+
+    Copying the context keeps context-local state, such as the active translation, in the executor's thread.
+
+    Args:
+        executor: The executor to run the function in
+        func: The function to run
+        *args: Arguments for the function
+
+    Returns:
+        The value returned by the function
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shut down the shared executors, so that they are created again with the current settings on next use.
+
+    Args:
+        wait: Whether to wait for running tasks to finish
+    """
+    global _render_executor, _delivery_executor  # pylint: disable=W0603
+
+    with _executors_lock:
+        executors = (_render_executor, _delivery_executor)
+        _render_executor = _delivery_executor = None
+        _semaphores.clear()
+    for executor in executors:
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+register_cache(
+    lambda: shutdown_executors(wait=False),
+    on_source_change=False,
+    settings=("TEMPLATED_EMAIL_ASYNC_CONCURRENCY", "TEMPLATED_EMAIL_ASYNC_RENDER_THREADS"),
+)
@@ -0,0 +1,136 @@
+"""Encoded MIME parts of inline images, reused by every email the process sends."""
+
+import hashlib
+import threading
+import weakref
+from email.mime.image import MIMEImage
+from email.mime.nonmultipart import MIMENonMultipart
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from django.conf import settings
+from templated_email.utils import InlineImage
+
+from templated_email_md.invalidation import register_cache
+from templated_email_md.utils import SizedLRUCache
+
+
+# The total size in bytes of the encoded images kept when ``TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE`` is not set
+DEFAULT_INLINE_IMAGE_CACHE_SIZE = 4 * 1024 * 1024
+
+
+class EncodedImage(NamedTuple):
+    """An image encoded for a MIME part: its detected subtype and its base64 payload."""
+
+    subtype: str
+    payload: str
+
+
+_encoded_images: Optional[SizedLRUCache] = None
+_encoded_images_lock = threading.Lock()
+
+# The part built for each InlineImage, with the content, content ID, filename and subtype it was built from
+_image_parts: "weakref.WeakKeyDictionary[InlineImage, Tuple[bytes, str, str, Optional[str], MIMENonMultipart]]" = (
+    weakref.WeakKeyDictionary()
+)
+_image_parts_lock = threading.Lock()
+
+
+def _get_encoded_images() -> Optional[SizedLRUCache]:
+    """Return the cache of encoded images, creating it with the current settings, or None if it is disabled."""
+    global _encoded_images  # pylint: disable=W0603
+
+    with _encoded_images_lock:
+        if _encoded_images is None:
+            maxbytes = getattr(settings, "TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE", DEFAULT_INLINE_IMAGE_CACHE_SIZE)
+            _encoded_images = SizedLRUCache(maxbytes=maxbytes or 0, sizeof=lambda encoded: len(encoded.payload))
+        return _encoded_images if _encoded_images.maxbytes > 0 else None
+
+
+def reset_inline_image_cache() -> None:
+    """Discard the encoded images and parts, and read ``TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE`` again on next use."""
+    global _encoded_images  # pylint: disable=W0603
+
+    with _encoded_images_lock:
+        _encoded_images = None
+    with _image_parts_lock:
+        _image_parts.clear()
+
+
+# Images are keyed by their content, so they do not depend on the template sources or other settings
+register_cache(reset_inline_image_cache, on_source_change=False, settings=("TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE",))
+
+
+def encode_image(content: bytes, subtype: Optional[str] = None) -> EncodedImage:
+    """Encode an image as ``MIMEImage`` does, reusing the encoding of identical images.
+
+    Encoded images are cached by a hash of their content and their subtype, and the least recently used ones are
+    evicted once their payloads add up to more than ``TEMPLATED_EMAIL_INLINE_IMAGE_CACHE_SIZE`` bytes.
+
+    Args:
+        content: The image data
+        subtype: The image subtype, such as ``png``, guessed from the data if None
+
+    Returns:
+        The EncodedImage
+    """
+    cache = _get_encoded_images()
+    key = (hashlib.sha256(content).digest(), subtype)
+    encoded = cache.get(key) if cache is not None else None
+    if encoded is None:
+        image = MIMEImage(content, subtype)
+        encoded = EncodedImage(image.get_content_subtype(), image.get_payload())
+        if cache is not None:
+            cache.set(key, encoded)
+    return encoded
+
+
+def build_image_part(encoded: EncodedImage, filename: str, content_id: str) -> MIMENonMultipart:
+    """Build the MIME part of an inline image from its encoding, without encoding it again.
+
+    The part is the same as the one ``InlineImage.attach_to_message`` attaches.
+
+    Args:
+        encoded: The encoded image
+        filename: The filename of the image
+        content_id: The Content-ID header of the image
+
+    Returns:
+        The MIME part
+    """
+    part = MIMENonMultipart("image", encoded.subtype)
+    part.set_payload(encoded.payload)
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "inline", filename=filename)
+    part.add_header("Content-ID", content_id)
+    return part
+
+
+def get_inline_image_part(image: InlineImage) -> MIMENonMultipart:
+    """Return the MIME part of an inline image, building it once per image and encoding it once per content.
+
+    The same part is returned for an InlineImage until its content, filename or subtype changes, so emails sent to
+    many recipients with the same image in their context share it.
+
+    Args:
+        image: The InlineImage from the context of an email
+
+    Returns:
+        The MIME part to attach to the email
+    """
+    if not image._content_id:  # pylint: disable=W0212
+        image.generate_cid()
+    content_id = image._content_id  # pylint: disable=W0212
+    content = image.content
+
+    with _image_parts_lock:
+        cached = _image_parts.get(image)
+    if cached is not None and cached[0] is content and cached[1:4] == (content_id, image.filename, image.subtype):
+        return cached[4]
+
+    part = build_image_part(encode_image(content, image.subtype), image.filename, content_id)
+    if _get_encoded_images() is not None:
+        with _image_parts_lock:
+            _image_parts[image] = (content, content_id, image.filename, image.subtype, part)
+    return part
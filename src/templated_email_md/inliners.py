@@ -0,0 +1,542 @@
+"""Pluggable CSS inliners, selected with the ``TEMPLATED_EMAIL_CSS_INLINER`` setting."""
+
+import hashlib
+import re
+from typing import Any
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Type
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+
+import cssutils
+from django.conf import settings
+from django.utils.module_loading import import_string
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from premailer.merge_style import csstext_to_pairs
+from premailer.merge_style import merge_styles
+from premailer.premailer import get_or_create_head
+
+from templated_email_md.css import CachedPremailer
+from templated_email_md.css import _premailer_options
+from templated_email_md.css import inline_css
+from templated_email_md.invalidation import register_cache
+from templated_email_md.utils import LRUCache
+
+
+# The inliner used when ``TEMPLATED_EMAIL_CSS_INLINER`` is not set
+DEFAULT_CSS_INLINER = "templated_email_md.inliners.PremailerInliner"
+
+# Maximum number of compiled stylesheets, and of compiled sets of stylesheets, to keep
+COMPILED_STYLESHEET_CACHE_SIZE = 64
+
+_importants = re.compile(r"\s*!important")
+_combinator = re.compile(r"\s*([>+~])\s*|\s+")
+_compound = re.compile(
+    r"^(?P<tag>[A-Za-z][A-Za-z0-9_-]*)?(?P<rest>(?:[.#][A-Za-z0-9_-]+|:first-child|:last-child)*)$", re.ASCII
+)
+_compound_part = re.compile(r"[.#][A-Za-z0-9_-]+|:first-child|:last-child", re.ASCII)
+
+_inliner_classes: Dict[str, Type["CSSInliner"]] = {}
+register_cache(_inliner_classes.clear, on_source_change=False)
+
+
+class CSSInliner:
+    """Base class of CSS inliners.
+
+    An inliner moves the styles of an HTML document's ``<style>`` elements into the ``style`` attributes of the
+    elements they apply to. Subclasses implement :meth:`inline`. An inliner is created for each email, with the options of the backend.
+    """
+
+    #: Whether ``TEMPLATED_EMAIL_SPLIT_INLINING`` applies, inlining the base HTML shell once with premailer and only the
+    #: Markdown content per email. Otherwise every email is inlined in full by the inliner.
+    supports_split_inlining = False
+
+    def __init__(self, base_url: str = "", strip_important: bool = False, keep_style_tags: bool = False):
+        """Initialize the CSSInliner.
+
+        Args:
+            base_url: Base URL used to resolve relative URLs
+            strip_important: Whether to strip ``!important`` from the inlined styles
+            keep_style_tags: Whether to keep the ``<style>`` tags after inlining
+        """
+        self.base_url = base_url
+        self.strip_important = strip_important
+        self.keep_style_tags = keep_style_tags
+
+    def inline(self, html: str) -> str:
+        """Return an HTML document with its CSS inlined.
+
+        Args:
+            html: The HTML document
+
+        Returns:
+            HTML with inlined CSS
+        """
+        raise NotImplementedError
+
+
+class PremailerInliner(CSSInliner):
+    """Inlines CSS with premailer, reusing the parsed rules of the stylesheets it has already seen."""
+
+    supports_split_inlining = True
+
+    def inline(self, html: str) -> str:
+        """Return an HTML document with its CSS inlined by premailer."""
+        return inline_css(html, self.base_url, self.strip_important, self.keep_style_tags)
+
+
+class Compound(NamedTuple):
+    """The tag, classes, id and structural pseudo-classes one element of a selector must have."""
+
+    tag: Optional[str]
+    classes: FrozenSet[str]
+    element_id: Optional[str]
+    first_child: bool
+    last_child: bool
+
+
+class CompiledRule(NamedTuple):
+    """A rule of a stylesheet ready to be matched against elements.
+
+    ``compounds`` and ``combinators`` are None for selectors that are matched with lxml's ``CSSSelector``.
+    """
+
+    specificity: Tuple[int, ...]
+    selector: str
+    pairs: List[Tuple[str, str]]
+    compounds: Optional[Tuple[Compound, ...]]
+    combinators: Optional[Tuple[Optional[str], ...]]
+    key: Optional[Tuple[str, str]]
+
+
+class CompiledRuleset:
+    """The rules of the stylesheets of a document.
+
+    Rules are kept in the order premailer applies them, and indexed by the tag, class or id their last element must
+    have.
+    """
+
+    __slots__ = (
+        "rules",
+        "by_key",
+        "unkeyed",
+        "fallback",
+        "ancestors",
+        "exact",
+        "compounds_by_key",
+        "compounds_unkeyed",
+        "numbers",
+    )
+
+    def __init__(self, rules: Sequence[CompiledRule]):
+        """Initialize the CompiledRuleset.
+
+        Args:
+            rules: The compiled rules of every stylesheet of the document
+        """
+        self.rules = sorted(rules, key=lambda rule: rule.specificity)
+        self.by_key: Dict[Tuple[str, str], List[int]] = {}
+        self.unkeyed: List[int] = []
+        # Rules whose selectors are matched by lxml, with the CSSSelector of each
+        self.fallback: Dict[int, CSSSelector] = {}
+        # For rules with only descendant and child combinators, the number of each of their other compounds, which an
+        # ancestor of the element must match, and whether that is enough for the rule to match
+        self.ancestors: List[Optional[Tuple[int, ...]]] = []
+        self.exact: List[bool] = []
+        # The number of each of those compounds, indexed like the rules
+        self.compounds_by_key: Dict[Tuple[str, str], List[Tuple[int, Compound]]] = {}
+        self.compounds_unkeyed: List[Tuple[int, Compound]] = []
+
+        numbers: Dict[Compound, int] = {}
+        for position, rule in enumerate(self.rules):
+            if rule.compounds is None:
+                self.fallback[position] = CSSSelector(rule.selector)
+            if rule.key is None:
+                self.unkeyed.append(position)
+            else:
+                self.by_key.setdefault(rule.key, []).append(position)
+
+            if rule.compounds is None or any(combinator not in (None, ">") for combinator in rule.combinators):
+                self.ancestors.append(None)
+                self.exact.append(False)
+                continue
+            ancestors = []
+            for compound in rule.compounds[:-1]:
+                if compound not in numbers:
+                    numbers[compound] = len(numbers)
+                    key = _compound_key(compound)
+                    if key is None:
+                        self.compounds_unkeyed.append((numbers[compound], compound))
+                    else:
+                        self.compounds_by_key.setdefault(key, []).append((numbers[compound], compound))
+                ancestors.append(numbers[compound])
+            self.ancestors.append(tuple(ancestors))
+            self.exact.append(rule.combinators in ((), (None,)))
+        self.numbers = len(numbers)
+
+
+_compiled_stylesheets = LRUCache(maxsize=COMPILED_STYLESHEET_CACHE_SIZE)
+_compiled_rulesets = LRUCache(maxsize=COMPILED_STYLESHEET_CACHE_SIZE)
+# Stylesheets are keyed by their content, so they do not depend on the template sources
+register_cache(_compiled_stylesheets.clear, on_source_change=False)
+register_cache(_compiled_rulesets.clear, on_source_change=False)
+
+
+def _parse_compound(text: str) -> Optional[Compound]:
+    """Parse one element of a selector, or return None if it uses syntax that is matched by lxml."""
+    match = _compound.match(text)
+    if match is None or not text:
+        return None
+    parts = _compound_part.findall(match.group("rest"))
+    ids = [part[1:] for part in parts if part.startswith("#")]
+    if len(set(ids)) > 1:
+        return None
+    return Compound(
+        match.group("tag"),
+        frozenset(part[1:] for part in parts if part.startswith(".")),
+        ids[0] if ids else None,
+        ":first-child" in parts,
+        ":last-child" in parts,
+    )
+
+
+def compile_selector(
+    selector: str,
+) -> Tuple[Optional[Tuple[Compound, ...]], Optional[Tuple[Optional[str], ...]], Optional[Tuple[str, str]]]:
+    """Split a selector into the elements it matches and the combinators between them.
+
+    Selectors made of tags, classes, ids, ``:first-child`` and ``:last-child``, joined by descendant, child and
+    sibling combinators, are matched natively. Other selectors, such as attribute selectors, are matched by lxml.
+
+    Args:
+        selector: A single selector
+
+    Returns:
+        The compounds and combinators, or None for both if the selector is matched by lxml, and the index key of its
+        last element: its id, one of its classes, or its tag, or None if it has none or is matched by lxml
+    """
+    # Validates the selector as premailer does, raising SelectorError for invalid ones
+    CSSSelector(selector)
+
+    parts = _combinator.split(selector.strip())
+    texts = parts[0::2]
+    combinators = tuple(parts[1::2])
+    compounds = [_parse_compound(text) for text in texts]
+    if any(compound is None for compound in compounds):
+        return None, None, None
+
+    return tuple(compounds), combinators, _compound_key(compounds[-1])
+
+
+def _compound_key(compound: Compound) -> Optional[Tuple[str, str]]:
+    """Return the id, one of the classes, or the tag a compound requires, or None if it requires none."""
+    if compound.element_id is not None:
+        return ("id", compound.element_id)
+    if compound.classes:
+        return ("class", min(compound.classes))
+    if compound.tag is not None:
+        return ("tag", compound.tag)
+    return None
+
+
+def _compound_matches(element: Any, compound: Compound) -> bool:
+    """Return True if an element has the tag, classes, id and position of a compound."""
+    if compound.tag is not None and element.tag != compound.tag:
+        return False
+    if compound.element_id is not None and element.get("id") != compound.element_id:
+        return False
+    if compound.classes and not compound.classes.issubset((element.get("class") or "").split()):
+        return False
+    if compound.first_child and _previous_element(element) is not None:
+        return False
+    if compound.last_child and _next_element(element) is not None:
+        return False
+    return True
+
+
+def _previous_element(element: Any) -> Optional[Any]:
+    """Return the previous sibling element, skipping comments and processing instructions."""
+    sibling = element.getprevious()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getprevious()
+    return sibling
+
+
+def _next_element(element: Any) -> Optional[Any]:
+    """Return the next sibling element, skipping comments and processing instructions."""
+    sibling = element.getnext()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getnext()
+    return sibling
+
+
+def _selector_matches(element: Any, rule: CompiledRule, index: int) -> bool:
+    """Return True if an element matches the selector of a rule, from its ``index``-th compound leftwards."""
+    if not _compound_matches(element, rule.compounds[index]):
+        return False
+    if index == 0:
+        return True
+
+    combinator = rule.combinators[index - 1]
+    if combinator is None:
+        return any(_selector_matches(ancestor, rule, index - 1) for ancestor in element.iterancestors())
+    if combinator == ">":
+        parent = element.getparent()
+        return parent is not None and _selector_matches(parent, rule, index - 1)
+    sibling = _previous_element(element)
+    if combinator == "+":
+        return sibling is not None and _selector_matches(sibling, rule, index - 1)
+    while sibling is not None:
+        if _selector_matches(sibling, rule, index - 1):
+            return True
+        sibling = _previous_element(sibling)
+    return False
+
+
+def compile_stylesheet(premailer: CachedPremailer, css_body: str, ruleset_index: int) -> Tuple[List, List]:
+    """Return the compiled rules and the leftover rules of a stylesheet, compiling it only once.
+
+    Args:
+        premailer: The CachedPremailer used to parse the stylesheet, with the inlining options
+        css_body: The stylesheet
+        ruleset_index: The position of the stylesheet in the document
+
+    Returns:
+        The CompiledRule of each rule to inline, and the rules that cannot be inlined
+    """
+    if not css_body:
+        return [], []
+    key = premailer._cache_key(css_body, ruleset_index)  # pylint: disable=W0212
+    compiled = _compiled_stylesheets.get(key)
+    if compiled is None:
+        rules, leftover = premailer._parse_style_rules(css_body, ruleset_index)  # pylint: disable=W0212
+        compiled_rules = []
+        for specificity, selector, bulk in rules:
+            compounds, combinators, index_key = compile_selector(selector)
+            pairs = csstext_to_pairs(bulk, validate=not premailer.disable_validation)
+            compiled_rules.append(CompiledRule(specificity, selector, pairs, compounds, combinators, index_key))
+        compiled = (tuple(compiled_rules), leftover)
+        _compiled_stylesheets.set(key, compiled)
+    rules, leftover = compiled
+    return list(rules), leftover
+
+
+def _element_keys(element: Any) -> List[Tuple[str, str]]:
+    """Return the index keys an element can be matched by."""
+    keys = [("tag", element.tag)]
+    element_id = element.get("id")
+    if element_id is not None:
+        keys.append(("id", element_id))
+    classes = element.get("class")
+    if classes:
+        keys.extend(("class", name) for name in classes.split())
+    return keys
+
+
+class LxmlInliner(CSSInliner):
+    """Inlines CSS in a single walk of the document's lxml tree, producing the same output as premailer.
+
+    Each stylesheet is parsed and compiled once: its rules are sorted by specificity, their declarations are parsed,
+    and they are indexed by the id, class or tag of the element their selector ends with. Each element of a document
+    is then only matched against the rules that can apply to it, rather than every selector being searched for in the
+    whole document. Selectors other than tags, classes, ids, ``:first-child`` and ``:last-child`` with combinators are
+    matched by lxml.
+
+    Documents that link to external stylesheets are inlined with premailer, which loads them.
+    """
+
+    def inline(self, html: str) -> str:
+        """Return an HTML document with its CSS inlined."""
+        options = _premailer_options(self.base_url, self.strip_important, self.keep_style_tags)
+        premailer = CachedPremailer(**options)
+
+        stripped = html.strip()
+        tree = etree.fromstring(stripped, etree.HTMLParser()).getroottree()
+        page = tree.getroot()
+        if page.xpath("//link[contains(concat(' ', normalize-space(@rel), ' '), ' stylesheet ')]"):
+            return inline_css(html, self.base_url, self.strip_important, self.keep_style_tags)
+        # lxml inserts a doctype if none exists, so only include it if it was in the original html
+        root = tree if stripped.startswith(tree.docinfo.doctype) else page
+        get_or_create_head(tree)
+
+        ruleset = self._collect_rules(premailer, page)
+        if ruleset.rules:
+            self._apply_rules(premailer, page, ruleset)
+        self._align_floating_images(page)
+        if self.base_url:
+            self._rewrite_urls(page)
+        return etree.tostring(root, method="html", pretty_print=False, encoding="utf-8").decode("utf-8")
+
+    def _collect_rules(self, premailer: CachedPremailer, page: Any) -> CompiledRuleset:
+        """Compile the rules of the document's ``<style>`` elements, and replace them with their leftover rules."""
+        keys = []
+        rules: List[CompiledRule] = []
+        index = 0
+        for element in list(page.iter("style")):
+            # Stylesheets for other media than screens are ignored
+            media = element.attrib.get("media")
+            if media and media not in ("all", "screen"):
+                continue
+            if element.attrib.get(premailer.attribute_name) == "ignore":
+                del element.attrib[premailer.attribute_name]
+                continue
+
+            css_body = element.text
+            these_rules, leftover = compile_stylesheet(premailer, css_body, index)
+            if css_body:
+                keys.append(premailer._cache_key(css_body, index))  # pylint: disable=W0212
+            index += 1
+            rules.extend(these_rules)
+
+            if leftover or self.keep_style_tags:
+                if self.keep_style_tags:
+                    element.text = css_body
+                else:
+                    element.text = premailer._css_rules_to_string(leftover)  # pylint: disable=W0212
+                if self.strip_important:
+                    element.text = _importants.sub("", element.text)
+            elif not self.keep_style_tags:
+                element.getparent().remove(element)
+
+        ruleset_key = hashlib.sha256(repr(keys).encode("utf-8")).hexdigest()
+        ruleset = _compiled_rulesets.get(ruleset_key)
+        if ruleset is None:
+            ruleset = CompiledRuleset(rules)
+            _compiled_rulesets.set(ruleset_key, ruleset)
+        return ruleset
+
+    def _apply_rules(self, premailer: CachedPremailer, page: Any, ruleset: CompiledRuleset) -> None:
+        """Merge the declarations of the rules that match each element into its ``style`` attribute.
+
+        The tree is walked once, counting the ancestors of the current element that match each compound of the
+        selectors, so that an element is only matched against a selector when its ancestors can match it.
+        """
+        # Elements matched by the selectors that lxml matches, found once per document
+        fallback_matches = {position: set(selector(page)) for position, selector in ruleset.fallback.items()}
+        merged: Dict[Tuple[str, Tuple[int, ...]], str] = {}
+        counts = [0] * ruleset.numbers
+        # The numbers of the compounds matched by each element being walked
+        stack: List[List[int]] = []
+
+        for event, element in etree.iterwalk(page, events=("start", "end")):
+            if event == "end":
+                for number in stack.pop():
+                    counts[number] -= 1
+                continue
+            if not isinstance(element.tag, str):
+                stack.append([])
+                continue
+
+            keys = _element_keys(element)
+            self._apply_matching_rules(premailer, element, keys, ruleset, counts, fallback_matches, merged)
+
+            matched = [
+                number
+                for number, compound in self._candidates(keys, ruleset.compounds_by_key, ruleset.compounds_unkeyed)
+                if _compound_matches(element, compound)
+            ]
+            for number in matched:
+                counts[number] += 1
+            stack.append(matched)
+
+    @staticmethod
+    def _candidates(keys: List[Tuple[str, str]], by_key: Dict, unkeyed: List) -> List:
+        """Return the unkeyed entries of an index and those of each of the keys."""
+        candidates = list(unkeyed)
+        for key in keys:
+            candidates.extend(by_key.get(key, ()))
+        return candidates
+
+    @staticmethod
+    def _apply_matching_rules(  # pylint: disable=R0913
+        premailer: CachedPremailer,
+        element: Any,
+        keys: List[Tuple[str, str]],
+        ruleset: CompiledRuleset,
+        counts: List[int],
+        fallback_matches: Dict[int, set],
+        merged: Dict[Tuple[str, Tuple[int, ...]], str],
+    ) -> None:
+        """Merge the declarations of the rules that match an element into its ``style`` attribute."""
+        positions = LxmlInliner._candidates(keys, ruleset.by_key, ruleset.unkeyed)
+        if not positions:
+            return
+
+        matched_positions = []
+        for position in sorted(set(positions)):
+            rule = ruleset.rules[position]
+            if rule.compounds is None:
+                matched = element in fallback_matches[position]
+            else:
+                ancestors = ruleset.ancestors[position]
+                if ancestors is not None and not all(counts[number] for number in ancestors):
+                    continue
+                if ruleset.exact[position]:
+                    matched = _compound_matches(element, rule.compounds[-1])
+                else:
+                    matched = _selector_matches(element, rule, len(rule.compounds) - 1)
+            if matched:
+                matched_positions.append(position)
+        if not matched_positions:
+            return
+
+        # Elements with the same style attribute that match the same rules get the same style, merged only once
+        inline_style = element.attrib.get("style", "")
+        key = (inline_style, tuple(matched_positions))
+        final_style = merged.get(key)
+        if final_style is None:
+            styles = [ruleset.rules[position].pairs for position in matched_positions]
+            final_style = merged[key] = merge_styles(
+                inline_style, styles, [""] * len(styles), remove_unset_properties=True
+            )
+        if final_style:
+            element.attrib["style"] = final_style
+        premailer._style_to_basic_html_attributes(element, final_style, force=True)  # pylint: disable=W0212
+
+    @staticmethod
+    def _align_floating_images(page: Any) -> None:
+        """Add an ``align`` attribute to images floated to the left or right, for Outlook."""
+        for item in page.xpath("//img[@style]"):
+            # Only styles that mention float can set it, so the others are not parsed
+            if "float" not in item.attrib["style"].lower():
+                continue
+            image_float = cssutils.parseStyle(item.attrib["style"]).float
+            if image_float in ("left", "right"):
+                item.attrib["align"] = image_float
+
+    def _rewrite_urls(self, page: Any) -> None:
+        """Resolve the relative ``href`` and ``src`` URLs of the document against the base URL, as premailer does."""
+        if not urlparse(self.base_url).scheme:
+            raise ValueError("Base URL must have a scheme")
+        for attr in ("href", "src"):
+            for item in page.xpath(f"//@{attr}"):
+                parent = item.getparent()
+                url = parent.attrib[attr]
+                if attr == "src" and url.startswith("cid:"):
+                    continue
+                if attr == "href" and url.startswith("tel:"):
+                    continue
+                parent.attrib[attr] = urljoin(self.base_url, url)
+
+
+def get_inliner_class(path: Optional[str] = None) -> Type[CSSInliner]:
+    """Return an inliner class, importing it on first use.
+
+    Args:
+        path: The dotted path of the class, defaults to the ``TEMPLATED_EMAIL_CSS_INLINER`` setting
+
+    Returns:
+        The inliner class
+    """
+    path = path or getattr(settings, "TEMPLATED_EMAIL_CSS_INLINER", DEFAULT_CSS_INLINER)
+    inliner_class = _inliner_classes.get(path)
+    if inliner_class is None:
+        inliner_class = _inliner_classes[path] = import_string(path)
+    return inliner_class
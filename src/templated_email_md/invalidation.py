@@ -0,0 +1,224 @@
+"""Invalidation of the in-process caches when template sources or settings change."""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from django.conf import settings
+from django.template import Template
+from django.template.autoreload import reset_loaders
+from django.template.base import Variable
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode
+from django.template.loader_tags import IncludeNode
+
+
+logger = logging.getLogger(__name__)
+
+# Default number of seconds between two checks of the template sources
+DEFAULT_SOURCE_CHECK_INTERVAL = 2.0
+
+# Prefix of the settings that change how emails are rendered
+SETTINGS_PREFIX = "TEMPLATED_EMAIL_"
+
+Signature = Optional[Tuple[Any, ...]]
+
+
+class RegisteredCache(NamedTuple):
+    """A cache and the changes that clear it."""
+
+    clear: Callable[[], None]
+    on_source_change: bool
+    settings: Optional[Tuple[str, ...]]
+
+
+_lock = threading.RLock()
+_caches: List[RegisteredCache] = []
+_tracked_templates: "weakref.WeakSet[Template]" = weakref.WeakSet()
+_signatures: Dict[str, Signature] = {}
+_next_check = 0.0
+
+
+def register_cache(
+    clear: Callable[[], None], on_source_change: bool = True, settings: Optional[Iterable[str]] = None
+) -> Callable[[], None]:
+    """Register a function that clears an in-process cache.
+
+    Args:
+        clear: Clears the cache
+        on_source_change: Whether to clear the cache when a template source changes. Caches keyed by content rather
+            than by template only need clearing when settings change.
+        settings: Names of the settings that clear the cache when they change, defaults to every
+            ``TEMPLATED_EMAIL_`` setting and ``TEMPLATES``
+
+    Returns:
+        The clear function, so that this can be used as a decorator
+    """
+    with _lock:
+        _caches.append(RegisteredCache(clear, on_source_change, tuple(settings) if settings is not None else None))
+    return clear
+
+
+def clear_caches(source_change: bool = False, setting: Optional[str] = None) -> None:
+    """Clear the registered caches.
+
+    Args:
+        source_change: Only clear the caches that depend on template sources
+        setting: Only clear the caches that depend on this setting
+    """
+    with _lock:
+        caches = list(_caches)
+    for cache in caches:
+        if source_change and not cache.on_source_change:
+            continue
+        if setting is not None:
+            names = cache.settings
+            if names is None and not (setting.startswith(SETTINGS_PREFIX) or setting == "TEMPLATES"):
+                continue
+            if names is not None and setting not in names:
+                continue
+        cache.clear()
+
+
+def _static_template_name(node: Any) -> Optional[str]:
+    """Return the name of the template an extends or include node loads, if it does not depend on the context."""
+    expression = node.parent_name if isinstance(node, ExtendsNode) else node.template
+    if expression.filters or isinstance(expression.var, Variable) or not isinstance(expression.var, str):
+        return None
+    return expression.var
+
+
+def template_chain(template: Template) -> Iterator[Template]:
+    """Yield a template and every template it extends or includes by a constant name, each once.
+
+    Args:
+        template: The compiled ``django.template.base.Template``
+
+    Yields:
+        The templates, starting with the given one
+    """
+    seen: Set[str] = set()
+    pending = [template]
+    while pending:
+        template = pending.pop()
+        if template.origin.name in seen:
+            continue
+        seen.add(template.origin.name)
+        yield template
+        for node in template.nodelist.get_nodes_by_type((ExtendsNode, IncludeNode)):
+            template_name = _static_template_name(node)
+            if template_name is not None:
+                pending.append(get_template(template_name).template)
+
+
+def _signature(path: str) -> Signature:
+    """Return what identifies the current version of a source file, or None if it does not exist."""
+    try:
+        if getattr(settings, "TEMPLATED_EMAIL_SOURCE_CHECK_METHOD", "mtime") == "hash":
+            with open(path, "rb") as source_file:
+                return (hashlib.sha256(source_file.read()).hexdigest(),)
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def track_template(template: Template) -> None:
+    """Record the source files of a template and of the templates it extends or includes, to detect changes.
+
+    Templates that do not come from files, such as templates compiled from strings, are not tracked.
+
+    Args:
+        template: The compiled ``django.template.base.Template``
+    """
+    if template in _tracked_templates:
+        return
+    try:
+        paths = [t.origin.name for t in template_chain(template)]
+    except Exception as e:  # pylint: disable=W0718
+        # Errors are reported when the template is rendered
+        logger.debug("Failed to track template sources: %s", e)
+        return
+    with _lock:
+        for path in paths:
+            if path not in _signatures and os.path.isfile(path):
+                _signatures[path] = _signature(path)
+        _tracked_templates.add(template)
+
+
+def tracked_sources() -> List[str]:
+    """Return the paths of the tracked source files."""
+    with _lock:
+        return list(_signatures)
+
+
+def check_sources(force: bool = False) -> List[str]:
+    """Invalidate the caches if a tracked source file changed.
+
+    Sources are checked at most once every ``TEMPLATED_EMAIL_SOURCE_CHECK_INTERVAL`` seconds, so that this can be
+    called for every email. With an interval of None, sources are only checked when forced.
+
+    Args:
+        force: Check the sources regardless of the interval
+
+    Returns:
+        The paths of the source files that changed
+    """
+    global _next_check  # pylint: disable=W0603
+
+    interval = getattr(settings, "TEMPLATED_EMAIL_SOURCE_CHECK_INTERVAL", DEFAULT_SOURCE_CHECK_INTERVAL)
+    now = time.monotonic()
+    if not force and (interval is None or now < _next_check):
+        return []
+    with _lock:
+        _next_check = now + (interval or 0)
+        signatures = list(_signatures.items())
+
+    changed = [path for path, signature in signatures if _signature(path) != signature]
+    if changed:
+        invalidate(changed)
+    return changed
+
+
+def invalidate(paths: Optional[Iterable[str]] = None) -> None:
+    """Reload templates and clear the caches that depend on template sources.
+
+    Django's cached template loaders are reset, so every template is compiled again from its source on next use.
+
+    Args:
+        paths: The source files that changed, used for logging
+    """
+    logger.info("Template sources changed, clearing email caches: %s", ", ".join(paths or ()) or "all")
+    reset_loaders()
+    with _lock:
+        _signatures.clear()
+        _tracked_templates.clear()
+    clear_caches(source_change=True)
+
+
+def on_setting_changed(setting: str, **kwargs: Any) -> None:
+    """Clear the caches that depend on a setting when it changes, such as with ``override_settings``."""
+    if setting.startswith(SETTINGS_PREFIX) or setting == "TEMPLATES":
+        clear_caches(setting=setting)
+
+
+def on_file_changed(file_path: Any, **kwargs: Any) -> None:
+    """Invalidate the caches when the autoreloader reports a change to a tracked source file."""
+    path = str(file_path)
+    with _lock:
+        tracked = path in _signatures
+    if tracked:
+        invalidate([path])
@@ -0,0 +1 @@
+"""Management commands for templated_email_md."""
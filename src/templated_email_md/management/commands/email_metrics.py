@@ -0,0 +1,71 @@
+"""Print the stage timings of the emails rendered and sent by the current process."""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from templated_email_md.metrics import get_metrics
+from templated_email_md.metrics import is_metrics_enabled
+from templated_email_md.metrics import reset_metrics
+
+
+def _milliseconds(seconds):
+    """Format a duration in seconds as milliseconds, or as unbounded if it is None."""
+    return "inf" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+class Command(BaseCommand):
+    """Print the metrics registry of the current process, such as when called with ``call_command``.
+
+    Metrics are only kept in the memory of the process that rendered the emails, so running the command with
+    ``manage.py`` starts a new process that has none. Call it with ``call_command`` from within the process instead.
+    """
+
+    help = (
+        "Print the count, errors, latency and output size of each stage of each email template rendered and sent by "
+        "the current process, as recorded when TEMPLATED_EMAIL_METRICS is on. Metrics are kept in memory by each "
+        "process, so run from manage.py, which starts a new process, this prints none: call it with call_command "
+        "from within the process that sends emails, such as from a shell or a periodic task."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command's arguments."""
+        parser.add_argument(
+            "--format",
+            choices=("text", "json"),
+            default="text",
+            help="Print a table, or a JSON list with the latency histogram of each stage.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Remove the metrics once they are printed.",
+        )
+
+    def handle(self, *args, **options):
+        """Print the metrics."""
+        metrics = get_metrics()
+        if options["reset"]:
+            reset_metrics()
+
+        if options["format"] == "json":
+            self.stdout.write(json.dumps(metrics, indent=2))
+            return
+        if not is_metrics_enabled():
+            self.stderr.write(self.style.WARNING("TEMPLATED_EMAIL_METRICS is off, so no stages are timed."))
+        if not metrics:
+            self.stdout.write(
+                "No emails were rendered or sent by this process. Metrics are kept by each process, so call this "
+                "command with call_command from the process that sends emails."
+            )
+            return
+
+        header = f"{'template':<40} {'stage':<16} {'count':>7} {'errors':>6} {'mean ms':>9} {'p95 ms':>8} {'max ms':>9}"
+        self.stdout.write(f"{header} {'mean bytes':>10}")
+        for metric in metrics:
+            mean_size = metric["total_size"] // metric["count"] if metric["count"] else 0
+            self.stdout.write(
+                f"{metric['template'] or '-':<40} {metric['stage']:<16} {metric['count']:>7} {metric['errors']:>6} "
+                f"{_milliseconds(metric['mean_time']):>9} {_milliseconds(metric['p95_time']):>8} "
+                f"{_milliseconds(metric['max_time']):>9} {mean_size:>10}"
+            )
@@ -0,0 +1,84 @@
+"""Compile, validate and warm the Markdown email templates of a project."""
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from templated_email import get_connection
+
+from templated_email_md.backend import MarkdownTemplateBackend
+from templated_email_md.warmup import warm_templates
+
+
+class Command(BaseCommand):
+    """Compile, validate and warm every Markdown email template, and report how long each one takes."""
+
+    help = (
+        "Compile, validate and render every Markdown email template, reporting compile and render times. "
+        "Exits with an error if any template fails."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command's arguments."""
+        parser.add_argument(
+            "templates",
+            nargs="*",
+            help="Names of the templates to warm, as passed to send_templated_mail. Defaults to every template found.",
+        )
+        parser.add_argument(
+            "--context",
+            default="{}",
+            help="JSON object to render each template with.",
+        )
+        parser.add_argument(
+            "--compile-only",
+            action="store_true",
+            help="Only compile the templates and build their render plans, without rendering them.",
+        )
+        parser.add_argument(
+            "--store",
+            action="store_true",
+            help="Store the rendered emails in the render cache, even if TEMPLATED_EMAIL_RENDER_CACHE is off.",
+        )
+        parser.add_argument(
+            "--parallel",
+            type=int,
+            default=None,
+            help="Number of templates warmed at the same time. Defaults to the number of CPUs.",
+        )
+
+    def handle(self, *args, **options):
+        """Warm the templates and print a report."""
+        try:
+            context = json.loads(options["context"])
+        except ValueError as e:
+            raise CommandError(f"--context is not valid JSON: {e}") from e
+        if not isinstance(context, dict):
+            raise CommandError("--context must be a JSON object.")
+
+        backend = get_connection()
+        if not isinstance(backend, MarkdownTemplateBackend):
+            raise CommandError("TEMPLATED_EMAIL_BACKEND is not a MarkdownTemplateBackend.")
+        reports = warm_templates(
+            backend,
+            options["templates"] or None,
+            context,
+            render=not options["compile_only"],
+            store=options["store"],
+            workers=options["parallel"],
+        )
+
+        for report in reports:
+            render_time = "-" if report.render_time is None else f"{report.render_time * 1000:.1f} ms"
+            line = f"{report.template_name}: compile {report.compile_time * 1000:.1f} ms, render {render_time}"
+            if report.cached:
+                line += ", cached"
+            if report.success:
+                self.stdout.write(line)
+            else:
+                self.stderr.write(self.style.ERROR(f"{line}, failed: {report.error}"))
+
+        failures = sum(1 for report in reports if not report.success)
+        if failures:
+            raise CommandError(f"{failures} of {len(reports)} email templates failed.")
+        self.stdout.write(self.style.SUCCESS(f"Warmed {len(reports)} email templates."))
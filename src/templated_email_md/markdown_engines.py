@@ -0,0 +1,313 @@
+"""Pluggable Markdown engines, selected with the ``TEMPLATED_EMAIL_MARKDOWN_ENGINE`` setting."""
+
+import logging
+import re
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from templated_email_md.converters import get_markdown_converter
+from templated_email_md.converters import render_markdown
+from templated_email_md.invalidation import register_cache
+from templated_email_md.partial import supports_partial_rendering
+
+
+logger = logging.getLogger(__name__)
+
+# The engine used when ``TEMPLATED_EMAIL_MARKDOWN_ENGINE`` is not set
+DEFAULT_MARKDOWN_ENGINE = "templated_email_md.markdown_engines.PythonMarkdownEngine"
+
+# The Python-Markdown extensions enabled by ``extra``
+EXTRA_EXTENSIONS = ("abbr", "attr_list", "def_list", "fenced_code", "footnotes", "md_in_html", "tables")
+
+# Python-Markdown's meta-data syntax: an optional ``---`` line, then ``key: value`` lines up to a blank line
+_META_BEGIN = re.compile(r"^-{3}(\s.*)?")
+_META_END = re.compile(r"^(-{3}|\.{3})(\s.*)?")
+_META_LINE = re.compile(r"^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)")
+_META_MORE = re.compile(r"^[ ]{4,}(?P<value>.*)")
+# The start of a line that a value could turn into a meta-data line
+_META_KEY_START = re.compile(r"[ ]{0,3}[A-Za-z0-9_-]*")
+
+_local = threading.local()
+
+# The engines and unsupported extensions already warned about, so that each thread does not warn again
+_warned: Set[Tuple[str, Tuple[str, ...]]] = set()
+
+# Incremented to discard the engines of every thread
+_generation = 0
+
+
+def extension_names(extensions: Sequence[Any]) -> List[str]:
+    """Return the short names of Python-Markdown extensions, with ``extra`` expanded to the extensions it enables.
+
+    Args:
+        extensions: Python-Markdown extensions, as set by ``TEMPLATED_EMAIL_MARKDOWN_EXTENSIONS``
+
+    Returns:
+        The names of the extensions, such as ``tables``, or the extensions themselves if they are not names
+    """
+    names: List[str] = []
+    for extension in extensions:
+        if not isinstance(extension, str):
+            names.append(extension)
+            continue
+        name = extension.split(":")[0]
+        if name.startswith("markdown.extensions."):
+            name = name[len("markdown.extensions.") :]
+        for expanded in EXTRA_EXTENSIONS if name == "extra" else (name,):
+            if expanded not in names:
+                names.append(expanded)
+    return names
+
+
+def strip_meta(content: str) -> str:
+    """Remove the meta-data at the start of Markdown content, as Python-Markdown's ``meta`` extension does.
+
+    Args:
+        content: Markdown content
+
+    Returns:
+        The content without its meta-data
+    """
+    lines = content.split("\n")
+    if lines and _META_BEGIN.match(lines[0]):
+        lines.pop(0)
+    key = None
+    while lines:
+        line = lines.pop(0)
+        if line.strip() == "" or _META_END.match(line):
+            break
+        if _META_LINE.match(line):
+            key = True
+        elif key and _META_MORE.match(line):
+            continue
+        else:
+            lines.insert(0, line)
+            break
+    return "\n".join(lines)
+
+
+def find_meta_placeholder(placeholders: Dict[str, str], content: str) -> Optional[str]:
+    """Return the name of a personalized variable whose value could be read as meta-data, if there is one.
+
+    The ``meta`` extension reads ``key: value`` lines at the start of the content as meta-data and removes them. A
+    value such as ``Reminder: payment due`` at the start of the first line that is not meta-data would be removed
+    when the email is rendered in full, but not when the value is substituted after rendering.
+
+    Args:
+        placeholders: Dictionary mapping each personalized variable name to its placeholder
+        content: The Markdown content rendered with placeholders
+
+    Returns:
+        The name of the variable, or None if no value can change the meta-data
+    """
+    lines = content.split("\n")
+    if lines and _META_BEGIN.match(lines[0]):
+        lines.pop(0)
+    key = None
+    for line in lines:
+        if line.strip() == "" or _META_END.match(line):
+            return None
+        match = _META_LINE.match(line)
+        if match:
+            # A value in the key would make the line meta-data or not depending on the value
+            key = match.group("key")
+            for name, placeholder in placeholders.items():
+                if placeholder in key:
+                    return name
+        elif not (key and _META_MORE.match(line)):
+            # The meta-data ends at this line, unless a value makes it a meta-data line
+            for name, placeholder in placeholders.items():
+                if placeholder in line and _META_KEY_START.fullmatch(line[: line.index(placeholder)]):
+                    return name
+            return None
+    return None
+
+
+class MarkdownEngine:
+    """Base class of Markdown engines, which convert the Markdown content of emails to HTML.
+
+    An engine is built once per thread for each list of extensions, so building it can do expensive setup, and
+    :meth:`render` must not keep state from one conversion to the next. Engines other than Python-Markdown support the
+    Python-Markdown extensions listed in :attr:`features`, and log a warning for the others.
+    """
+
+    #: The Python-Markdown extensions the engine supports, by name, or None if it supports every extension
+    features: Optional[Tuple[str, ...]] = ()
+
+    def __init__(self, extensions: Sequence[Any]):
+        """Initialize the MarkdownEngine.
+
+        Args:
+            extensions: The Python-Markdown extensions set by ``TEMPLATED_EMAIL_MARKDOWN_EXTENSIONS``
+        """
+        self.extensions = list(extensions)
+        names = extension_names(extensions)
+        if self.features is None:
+            self.enabled = names
+            return
+        self.enabled = [name for name in names if name in self.features]
+        unsupported = tuple(str(name) for name in names if name not in self.features)
+        if unsupported and (type(self).__name__, unsupported) not in _warned:
+            _warned.add((type(self).__name__, unsupported))
+            logger.warning(
+                "%s does not support the Markdown extensions %s, which are ignored",
+                type(self).__name__,
+                ", ".join(unsupported),
+            )
+
+    def render(self, content: str) -> str:
+        """Convert Markdown content to HTML.
+
+        Args:
+            content: Markdown content to convert
+
+        Returns:
+            Converted HTML content
+        """
+        if "meta" in self.enabled:
+            content = strip_meta(content)
+        return self.convert(content)
+
+    def convert(self, content: str) -> str:
+        """Convert Markdown content, without meta-data, to HTML."""
+        raise NotImplementedError
+
+    def supports_partial_rendering(self) -> bool:
+        """Return True if the engine leaves personalized values as they are.
+
+        Emails sent to many recipients are then rendered once and personalized by substitution.
+        """
+        return False
+
+
+class PythonMarkdownEngine(MarkdownEngine):
+    """Converts Markdown with Python-Markdown and the configured extensions, reusing a converter per thread."""
+
+    features = None
+
+    def __init__(self, extensions: Sequence[Any]):
+        """Initialize the PythonMarkdownEngine, building the converter of the current thread.
+
+        Args:
+            extensions: The Python-Markdown extensions to enable
+        """
+        super().__init__(extensions)
+        get_markdown_converter(self.extensions)
+
+    def render(self, content: str) -> str:
+        """Convert Markdown content to HTML, with the ``meta`` extension removing any meta-data."""
+        return render_markdown(content, self.extensions)
+
+    def supports_partial_rendering(self) -> bool:
+        """Return True if every extension leaves personalized values as they are."""
+        return supports_partial_rendering(self.extensions)
+
+
+class MarkdownItEngine(MarkdownEngine):
+    """Converts Markdown with markdown-it-py, a CommonMark parser.
+
+    Requires ``markdown-it-py``, and ``mdit-py-plugins`` for footnotes and definition lists. Tables, fenced code and
+    meta-data are supported, along with raw HTML. Python-Markdown's ``abbr``, ``attr_list`` and ``md_in_html`` are not.
+    """
+
+    features = ("def_list", "fenced_code", "footnotes", "meta", "tables")
+
+    def __init__(self, extensions: Sequence[Any]):
+        """Initialize the MarkdownItEngine.
+
+        Args:
+            extensions: The Python-Markdown extensions to emulate
+        """
+        super().__init__(extensions)
+        from markdown_it import MarkdownIt  # pylint: disable=C0415
+
+        self.parser = MarkdownIt("commonmark")
+        if "tables" in self.enabled:
+            self.parser.enable("table")
+        if "footnotes" in self.enabled:
+            from mdit_py_plugins import footnote  # pylint: disable=C0415
+
+            self.parser.use(footnote.footnote_plugin)
+        if "def_list" in self.enabled:
+            from mdit_py_plugins.deflist import deflist_plugin  # pylint: disable=C0415
+
+            self.parser.use(deflist_plugin)
+
+    def convert(self, content: str) -> str:
+        """Convert Markdown content to HTML with markdown-it-py."""
+        return self.parser.render(content)
+
+
+class MistuneEngine(MarkdownEngine):
+    """Converts Markdown with mistune 3.
+
+    Requires ``mistune``. Tables, footnotes, definition lists, abbreviations, fenced code and meta-data are supported,
+    along with raw HTML. Python-Markdown's ``attr_list`` and ``md_in_html`` are not.
+    """
+
+    features = ("abbr", "def_list", "fenced_code", "footnotes", "meta", "tables")
+
+    # The mistune plugin of each supported extension
+    plugins = {"abbr": "abbr", "def_list": "def_list", "footnotes": "footnotes", "tables": "table"}
+
+    def __init__(self, extensions: Sequence[Any]):
+        """Initialize the MistuneEngine.
+
+        Args:
+            extensions: The Python-Markdown extensions to emulate
+        """
+        super().__init__(extensions)
+        import mistune  # pylint: disable=C0415
+
+        plugins = [self.plugins[name] for name in self.enabled if name in self.plugins]
+        self.parser: Callable[[str], str] = mistune.create_markdown(escape=False, plugins=plugins)
+
+    def convert(self, content: str) -> str:
+        """Convert Markdown content to HTML with mistune."""
+        return self.parser(content)
+
+
+def get_markdown_engine(extensions: Sequence[Any], path: Optional[str] = None) -> MarkdownEngine:
+    """Return this thread's Markdown engine for a list of extensions, building it on first use.
+
+    Args:
+        extensions: The Python-Markdown extensions set by ``TEMPLATED_EMAIL_MARKDOWN_EXTENSIONS``
+        path: The dotted path of the engine class, defaults to the ``TEMPLATED_EMAIL_MARKDOWN_ENGINE`` setting
+
+    Returns:
+        A Markdown engine owned by the current thread
+    """
+    if path is None:
+        path = getattr(settings, "TEMPLATED_EMAIL_MARKDOWN_ENGINE", DEFAULT_MARKDOWN_ENGINE)
+
+    key = (path, tuple(extensions))
+    engines: Dict[Tuple, MarkdownEngine] = getattr(_local, "engines", None)
+    if engines is None or _local.generation != _generation:
+        engines = _local.engines = {}
+        _local.generation = _generation
+
+    engine = engines.get(key)
+    if engine is None:
+        engine = engines[key] = import_string(path)(extensions)
+    return engine
+
+
+def reset_markdown_engines() -> None:
+    """Discard the engines of every thread, so that they are built again on next use."""
+    global _generation  # pylint: disable=W0603
+
+    _generation += 1
+
+
+# Engines are keyed by their settings, so they do not depend on the template sources
+register_cache(reset_markdown_engines, on_source_change=False)
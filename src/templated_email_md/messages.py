@@ -0,0 +1,123 @@
+"""Email message classes that reuse the encoded MIME parts of bodies already sent by the process."""
+
+import hashlib
+import threading
+from typing import Any
+from typing import Optional
+
+import django
+from django.conf import settings
+from django.core import mail
+from django.core.mail.message import SafeMIMEMultipart
+from django.core.mail.message import SafeMIMEText
+
+from templated_email_md.invalidation import register_cache
+from templated_email_md.utils import SizedLRUCache
+
+
+# The total size in bytes of the encoded parts kept when ``TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE`` is not set
+DEFAULT_MIME_PART_CACHE_SIZE = 4 * 1024 * 1024
+
+# Whether Django builds the alternatives of a message with the ``_create_alternatives`` method that SharedPartsMixin
+# overrides, with the signature and behavior it was written for. Other versions build messages as usual.
+SHARED_PARTS_SUPPORTED = (4, 2) <= django.VERSION < (6, 0)
+
+_text_parts: Optional[SizedLRUCache] = None
+_text_parts_lock = threading.Lock()
+
+
+def _get_text_parts() -> Optional[SizedLRUCache]:
+    """Return the cache of encoded text parts, creating it with the current settings, or None if it is disabled."""
+    global _text_parts  # pylint: disable=W0603
+
+    with _text_parts_lock:
+        if _text_parts is None:
+            maxbytes = getattr(settings, "TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE", DEFAULT_MIME_PART_CACHE_SIZE)
+            _text_parts = SizedLRUCache(maxbytes=maxbytes or 0, sizeof=lambda part: len(part.get_payload()))
+        return _text_parts if _text_parts.maxbytes > 0 else None
+
+
+def reset_text_part_cache() -> None:
+    """Discard the encoded text parts, and read ``TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE`` again on next use."""
+    global _text_parts  # pylint: disable=W0603
+
+    with _text_parts_lock:
+        _text_parts = None
+
+
+# Parts are keyed by their content, so they do not depend on the template sources or other settings
+register_cache(reset_text_part_cache, on_source_change=False, settings=("TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE",))
+
+
+def get_text_part(content: str, subtype: str, encoding: str) -> SafeMIMEText:
+    """Return the encoded MIME part of a text body, encoding it only once per distinct body.
+
+    Parts are cached by a hash of their content, subtype and encoding, and the least recently used ones are evicted
+    once their encoded payloads add up to more than ``TEMPLATED_EMAIL_MIME_PART_CACHE_SIZE`` bytes. The returned part
+    is shared, and must not be changed.
+
+    Args:
+        content: The text of the body
+        subtype: The MIME subtype, such as ``html``
+        encoding: The character set to encode the text with
+
+    Returns:
+        The encoded part, the same as Django builds for the body
+    """
+    cache = _get_text_parts()
+    if cache is None:
+        return SafeMIMEText(content, subtype, encoding)
+
+    key = (hashlib.sha256(content.encode("utf-8", "surrogateescape")).digest(), subtype, str(encoding))
+    part = cache.get(key)
+    if part is None:
+        part = SafeMIMEText(content, subtype, encoding)
+        cache.set(key, part)
+    return part
+
+
+class SharedPartsMixin:
+    """Builds the alternatives of an email message from encoded MIME parts shared by every message with the same ones.
+
+    Encoding the HTML alternative, which is quoted-printable encoded when it has lines longer than 998 characters, is
+    the most expensive step of building a message to send over SMTP. Messages with the same alternatives, such as an
+    announcement sent to many recipients, reuse the parts encoded for the first one, and only their headers are built
+    for each message. Use it with subclasses of Django's ``EmailMultiAlternatives``.
+
+    It overrides a private method of Django's ``EmailMultiAlternatives``, so parts are only shared on the Django versions
+    where :data:`SHARED_PARTS_SUPPORTED` is True.
+    """
+
+    def _create_alternatives(self, msg: Any) -> Any:
+        """Wrap the body part in a multipart with the shared parts of the alternatives.
+
+        Args:
+            msg: The MIME part of the body
+
+        Returns:
+            The MIME message holding the body and its alternatives
+        """
+        if not SHARED_PARTS_SUPPORTED:
+            return super()._create_alternatives(msg)
+        if not self.alternatives:
+            return msg
+
+        encoding = self.encoding or settings.DEFAULT_CHARSET
+        multipart = SafeMIMEMultipart(_subtype=self.alternative_subtype, encoding=encoding)
+        if self.body:
+            multipart.attach(msg)
+        for content, mimetype in self.alternatives:
+            basetype, subtype = mimetype.split("/", 1)
+            if basetype == "text" and isinstance(content, str):
+                multipart.attach(get_text_part(content, subtype, encoding))
+            else:
+                multipart.attach(self._create_mime_attachment(content, mimetype))
+        return multipart
+
+
+class EmailMultiAlternatives(SharedPartsMixin, mail.EmailMultiAlternatives):
+    """An ``EmailMultiAlternatives`` that shares the encoded parts of its alternatives with identical messages.
+
+    Set ``TEMPLATED_EMAIL_EMAIL_MULTIALTERNATIVES_CLASS`` to ``"templated_email_md.messages.EmailMultiAlternatives"``
+    for the emails sent by the backend to use it.
+    """
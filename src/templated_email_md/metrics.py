@@ -0,0 +1,349 @@
+"""Timing of the stages of rendering and sending emails, and an in-process registry of the timings."""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from django.conf import settings
+
+from templated_email_md.invalidation import register_cache
+from templated_email_md.signals import stage_completed
+
+
+logger = logging.getLogger(__name__)
+
+# Stages of rendering and sending an email, in the order they run
+STAGES = ("blocks", "markdown", "base_template", "inline_css", "remove_comments", "plain_text", "render", "deliver")
+
+# Upper bounds in seconds of the buckets of the latency histograms, the last bucket holding every longer duration
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The template whose stages are being timed
+_current_template: ContextVar[Optional[str]] = ContextVar("current_template", default=None)
+
+
+class StageTiming(NamedTuple):
+    """The duration in seconds of a run of a stage, the size of its output in bytes, and whether it failed."""
+
+    stage: str
+    duration: float
+    size: Optional[int]
+    error: bool
+
+
+# Timings of the stages run within collect_stages, or None
+_collected_stages: ContextVar[Optional[List[StageTiming]]] = ContextVar("collected_stages", default=None)
+
+_enabled: Optional[bool] = None
+
+
+def _reset_enabled() -> None:
+    """Read ``TEMPLATED_EMAIL_METRICS`` again the next time it is checked."""
+    global _enabled  # pylint: disable=W0603
+    _enabled = None
+
+
+register_cache(_reset_enabled, on_source_change=False, settings=("TEMPLATED_EMAIL_METRICS",))
+
+
+def is_metrics_enabled() -> bool:
+    """Return True if the stages of rendering and sending emails are timed, as set by ``TEMPLATED_EMAIL_METRICS``."""
+    global _enabled  # pylint: disable=W0603
+    if _enabled is None:
+        _enabled = bool(getattr(settings, "TEMPLATED_EMAIL_METRICS", False))
+    return _enabled
+
+
+class StageMetrics:
+    """The counts, durations and output sizes of a stage of a template."""
+
+    __slots__ = ("count", "errors", "total_time", "max_time", "total_size", "buckets")
+
+    def __init__(self):
+        """Initialize the StageMetrics with no observations."""
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_size = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, duration: float, size: Optional[int], error: bool) -> None:
+        """Count a run of the stage."""
+        self.count += 1
+        self.errors += error
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.total_size += size or 0
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return the upper bound of the bucket holding a percentile of the durations, or None if it is unbounded."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the metrics as a JSON-serializable dictionary."""
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_time": self.total_time,
+            "mean_time": self.total_time / self.count if self.count else 0.0,
+            "max_time": self.max_time,
+            "p50_time": self.percentile(0.5),
+            "p95_time": self.percentile(0.95),
+            "total_size": self.total_size,
+            "histogram": [[bound, count] for bound, count in zip([*LATENCY_BUCKETS, None], self.buckets)],
+        }
+
+
+class MetricsRegistry:
+    """Counters and latency histograms for each template and stage, kept for the current process."""
+
+    def __init__(self):
+        """Initialize the MetricsRegistry with no metrics."""
+        self._lock = threading.Lock()
+        self._metrics: Dict[Tuple[str, str], StageMetrics] = {}
+
+    def observe(
+        self, template_name: Optional[str], stage: str, duration: float, size: Optional[int] = None, error: bool = False
+    ) -> None:
+        """Count a run of a stage for a template.
+
+        Args:
+            template_name: The template, or None if it is not known
+            stage: The name of the stage
+            duration: How long the stage took in seconds
+            size: The size of the stage's output in bytes, if it has one
+            error: Whether the stage raised an exception
+        """
+        key = (template_name or "", stage)
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = StageMetrics()
+            metrics.observe(duration, size, error)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return the metrics of every template and stage, sorted by template and in the order of the stages."""
+        with self._lock:
+            items = [(key, metrics.as_dict()) for key, metrics in self._metrics.items()]
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        items.sort(key=lambda item: (item[0][0], order.get(item[0][1], len(STAGES)), item[0][1]))
+        return [{"template": template_name, "stage": stage, **metrics} for (template_name, stage), metrics in items]
+
+    def reset(self) -> None:
+        """Remove every metric."""
+        with self._lock:
+            self._metrics.clear()
+
+
+registry = MetricsRegistry()
+
+
+def get_metrics() -> List[Dict[str, Any]]:
+    """Return the metrics of every template and stage of the current process."""
+    return registry.snapshot()
+
+
+def reset_metrics() -> None:
+    """Remove the metrics of the current process."""
+    registry.reset()
+
+
+def record(
+    stage: str,
+    template_name: Optional[str],
+    duration: float,
+    size: Optional[int] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """Count a run of a stage in the registry and send the ``stage_completed`` signal.
+
+    Args:
+        stage: The name of the stage
+        template_name: The template, or None if it is not known
+        duration: How long the stage took in seconds
+        size: The size of the stage's output in bytes, if it has one
+        error: The exception the stage raised, if it failed
+    """
+    registry.observe(template_name, stage, duration, size, error is not None)
+    # Receivers that raise are logged by Django, and do not fail the email
+    stage_completed.send_robust(sender=stage, template_name=template_name, duration=duration, size=size, error=error)
+
+
+class StageTimer:
+    """Times a stage in a ``with`` block, and records it on leaving the block."""
+
+    __slots__ = ("stage", "template_name", "output", "start")
+
+    def __init__(self, stage: str, template_name: Optional[str]):
+        """Initialize the StageTimer.
+
+        Args:
+            stage: The name of the stage
+            template_name: The template whose stage is timed
+        """
+        self.stage = stage
+        self.template_name = template_name
+        self.output: Optional[str] = None
+        self.start = 0.0
+
+    def set_output(self, output: Optional[str]) -> None:
+        """Set the output of the stage, whose size is recorded."""
+        self.output = output
+
+    def __enter__(self) -> "StageTimer":
+        """Start timing the stage."""
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Optional[BaseException], traceback: Any) -> None:
+        """Record the duration of the stage, its output size and any error it raised."""
+        duration = time.perf_counter() - self.start
+        size = len(self.output.encode("utf-8")) if isinstance(self.output, str) else None
+        collected = _collected_stages.get()
+        if collected is not None:
+            collected.append(StageTiming(self.stage, duration, size, exc_value is not None))
+        if not is_metrics_enabled():
+            return
+        try:
+            record(self.stage, self.template_name, duration, size, exc_value)
+        except Exception as e:  # pylint: disable=W0718
+            logger.warning("Failed to record the %s stage: %s", self.stage, e)
+
+
+class _NullTimer:
+    """Stands in for a StageTimer when metrics are disabled."""
+
+    __slots__ = ()
+
+    def set_output(self, output: Optional[str]) -> None:
+        """Ignore the output."""
+
+    def __enter__(self) -> "_NullTimer":
+        """Do nothing."""
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Optional[BaseException], traceback: Any) -> None:
+        """Do nothing."""
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage: str, template_name: Optional[str] = None) -> Any:
+    """Return a context manager that times a stage, or does nothing if metrics are off and stages are not collected.
+
+    Args:
+        stage: The name of the stage
+        template_name: The template whose stage is timed, defaults to the one set by :func:`template_scope`
+
+    Returns:
+        A StageTimer, whose ``set_output`` sets the output of the stage to record its size
+    """
+    if not is_metrics_enabled() and _collected_stages.get() is None:
+        return _NULL_TIMER
+    return StageTimer(stage, template_name or _current_template.get())
+
+
+@contextlib.contextmanager
+def collect_stages() -> Iterator[List[StageTiming]]:
+    """Collect the timings of the stages run within a ``with`` block, whether metrics are enabled or not.
+
+    Yields:
+        The list the StageTiming of each stage is added to, in the order the stages finish
+    """
+    collected: List[StageTiming] = []
+    token = _collected_stages.set(collected)
+    try:
+        yield collected
+    finally:
+        _collected_stages.reset(token)
+
+
+def timed_call(stage: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call a function, timing it as a stage.
+
+    Args:
+        stage: The name of the stage
+        func: The function
+        *args: Arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        The value returned by the function
+    """
+    with timed(stage):
+        return func(*args, **kwargs)
+
+
+class _TemplateScope:
+    """Attributes the stages timed in a ``with`` block to a template."""
+
+    __slots__ = ("template_name", "token")
+
+    def __init__(self, template_name: Optional[str]):
+        """Initialize the _TemplateScope."""
+        self.template_name = template_name
+        self.token = None
+
+    def __enter__(self) -> None:
+        """Set the current template."""
+        self.token = _current_template.set(self.template_name)
+
+    def __exit__(self, exc_type: Any, exc_value: Optional[BaseException], traceback: Any) -> None:
+        """Restore the previous template."""
+        _current_template.reset(self.token)
+
+
+def template_scope(template_name: Optional[str]) -> Any:
+    """Return a context manager that attributes the stages timed within it to a template.
+
+    Args:
+        template_name: The template
+
+    Returns:
+        The context manager, which does nothing if metrics are disabled
+    """
+    if not is_metrics_enabled():
+        return _NULL_TIMER
+    return _TemplateScope(template_name)
+
+
+def bind_template(template_name: Optional[str], func: Callable[..., Any]) -> Callable[..., Any]:
+    """Return a function that attributes the stages timed while it runs to a template.
+
+    Used for parts of an email that are rendered later, outside of the scope of the template.
+
+    Args:
+        template_name: The template
+        func: The function
+
+    Returns:
+        The wrapped function, or the function itself if metrics are disabled
+    """
+    if not is_metrics_enabled():
+        return func
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with _TemplateScope(template_name):
+            return func(*args, **kwargs)
+
+    return wrapper
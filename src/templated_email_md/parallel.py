@@ -0,0 +1,229 @@
+"""Rendering emails in worker processes for bulk sends."""
+
+import logging
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+import django
+from django.apps import apps
+from django.template.loader import get_template
+from templated_email.utils import InlineImage
+
+from templated_email_md.bulk import chunked
+from templated_email_md.converters import get_html2text_converter
+from templated_email_md.exceptions import RenderWorkerError
+from templated_email_md.markdown_engines import get_markdown_engine
+from templated_email_md.render_plan import get_render_plan
+from templated_email_md.rendered_email import RenderedEmail
+
+
+logger = logging.getLogger(__name__)
+
+# Default number of messages rendered by a worker per task
+DEFAULT_RENDER_CHUNK_SIZE = 10
+
+# The backend used to render emails in a worker process
+_worker_backend = None
+
+
+def backend_config(backend: Any) -> Dict[str, Any]:
+    """Return the configuration of a backend, to recreate it in a worker process.
+
+    Args:
+        backend: The MarkdownTemplateBackend to copy
+
+    Returns:
+        The backend's attributes
+    """
+    return dict(vars(backend))
+
+
+def _initialize_worker(backend_class: type, config: Dict[str, Any], warm_templates: Sequence[str]) -> None:
+    """Set up Django and the backend in a worker process, and warm the caches used to render the templates.
+
+    Args:
+        backend_class: The class of the backend to recreate
+        config: The attributes of the backend, from :func:`backend_config`
+        warm_templates: Paths of the Markdown templates that will be rendered
+    """
+    global _worker_backend  # pylint: disable=W0603
+
+    if not apps.ready:
+        # Worker processes that are spawned rather than forked start without Django set up
+        django.setup()
+
+    backend = backend_class(fail_silently=config.get("fail_silently", False))
+    backend.__dict__.update(config)
+    _worker_backend = backend
+
+    try:
+        for template_path in warm_templates:
+            get_render_plan(template_path)
+        get_template(backend.base_html_template)
+        get_markdown_engine(backend.markdown_extensions, backend.markdown_engine)
+        get_html2text_converter(backend.html2text_settings)
+    except Exception as e:  # pylint: disable=W0718
+        # Errors are reported for each message when it is rendered
+        logger.warning("Failed to prepare render worker: %s", e)
+
+
+def _render_batch(
+    template_name: Union[str, list, tuple],
+    contexts: List[Dict[str, Any]],
+    template_dir: Optional[str],
+    file_extension: Optional[str],
+) -> List[Union[Dict[str, Optional[str]], Exception]]:
+    """Render an email for each context in a worker process.
+
+    Args:
+        template_name: The name of the Markdown template to render
+        contexts: The context of each email
+        template_dir: The directory to look for the template in
+        file_extension: The file extension of the template file
+
+    Returns:
+        The rendered parts of each email, or the exception raised while rendering it
+    """
+    results: List[Union[Dict[str, Optional[str]], Exception]] = []
+    for context in contexts:
+        try:
+            rendered = _worker_backend._render_email(  # pylint: disable=W0212
+                template_name, context, template_dir, file_extension
+            )
+            # Reading every part renders the HTML and plain text here rather than in the parent process
+            results.append(dict(rendered))
+        except Exception as e:  # pylint: disable=W0718
+            results.append(_picklable_error(e))
+    return results
+
+
+def _picklable_error(error: Exception) -> Exception:
+    """Return an error that can be sent back to the calling process in place of an error raised in a worker.
+
+    Args:
+        error: The error raised while rendering an email
+
+    Returns:
+        The error itself, a copy of it that only holds its message, or a RenderWorkerError
+    """
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:  # pylint: disable=W0718
+        pass
+
+    # Some errors, such as TemplateDoesNotExist, hold on to objects that cannot be pickled
+    try:
+        copy = type(error)(*(str(arg) for arg in error.args))
+        pickle.dumps(copy)
+        return copy
+    except Exception:  # pylint: disable=W0718
+        return RenderWorkerError(f"{type(error).__name__}: {error}")
+
+
+def _assign_content_ids(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of a context, giving its inline images the content IDs they are attached with.
+
+    Workers render unpickled copies of the images, so a content ID generated there would not match the one of the
+    image attached to the message.
+    """
+    for value in context.values():
+        if isinstance(value, InlineImage) and not value._content_id:  # pylint: disable=W0212
+            value.generate_cid()
+    return dict(context)
+
+
+class RenderPool:
+    """A pool of worker processes that render emails for a backend.
+
+    Each worker recreates the backend from its configuration and warms its caches once. Emails are rendered in
+    tasks of ``chunk_size`` messages, and results are returned in the order of the contexts. Only a bounded number
+    of tasks is queued at a time, so contexts are read from the iterable as results are consumed.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        workers: int,
+        chunk_size: int = DEFAULT_RENDER_CHUNK_SIZE,
+        warm_templates: Sequence[str] = (),
+    ):
+        """Initialize the RenderPool.
+
+        Args:
+            backend: The MarkdownTemplateBackend whose configuration the workers use
+            workers: Number of worker processes
+            chunk_size: Number of messages rendered by a worker per task
+            warm_templates: Paths of the Markdown templates to prepare in each worker
+        """
+        if chunk_size < 1:
+            raise ValueError("Render chunk size must be at least 1.")
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(type(backend), backend_config(backend), tuple(warm_templates)),
+        )
+
+    def __enter__(self) -> "RenderPool":
+        """Return the pool."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Shut the pool down."""
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the worker processes, cancelling any task that has not started."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def render(
+        self,
+        template_name: Union[str, list, tuple],
+        contexts: Iterable[Dict[str, Any]],
+        template_dir: Optional[str] = None,
+        file_extension: Optional[str] = None,
+    ) -> Iterator[Union[RenderedEmail, Exception]]:
+        """Render an email for each context in the worker processes.
+
+        Contexts are copied and pickled to be sent to the workers, so they must be picklable. Their inline images are
+        given a content ID first, which is the one the rendered emails refer to.
+
+        Args:
+            template_name: The name of the Markdown template to render
+            contexts: The context of each email
+            template_dir: The directory to look for the template in
+            file_extension: The file extension of the template file
+
+        Yields:
+            The RenderedEmail for each context, in order, or the exception raised while rendering it
+        """
+        pending = deque()
+        for batch in chunked((_assign_content_ids(context) for context in contexts), self.chunk_size):
+            pending.append(
+                (len(batch), self.executor.submit(_render_batch, template_name, batch, template_dir, file_extension))
+            )
+            # Keep every worker busy while bounding the number of queued contexts
+            if len(pending) >= self.workers * 2:
+                yield from self._results(*pending.popleft())
+        while pending:
+            yield from self._results(*pending.popleft())
+
+    def _results(self, size: int, future: Any) -> Iterator[Union[RenderedEmail, Exception]]:
+        """Yield the results of a task, or the error that made it fail for each of its messages."""
+        try:
+            results = future.result()
+        except Exception as e:  # pylint: disable=W0718
+            results = [e] * size
+        for result in results:
+            yield result if isinstance(result, Exception) else RenderedEmail(**result)
@@ -0,0 +1,255 @@
+"""Rendering emails once for a shared context, and only substituting the variables that differ per recipient."""
+
+import re
+import secrets
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Sequence
+from urllib.parse import urljoin
+
+
+# Markdown extensions whose output does not depend on the text of the personalized values
+PARTIAL_RENDER_EXTENSIONS = frozenset(
+    {
+        "abbr",
+        "admonition",
+        "attr_list",
+        "def_list",
+        "extra",
+        "fenced_code",
+        "footnotes",
+        "legacy_attrs",
+        "legacy_em",
+        "md_in_html",
+        "meta",
+        "nl2br",
+        "sane_lists",
+        "tables",
+    }
+)
+
+# Personalized values made only of letters, digits, single spaces and punctuation that Markdown, CSS inlining,
+# comment removal and html2text leave as they are. Values start with a letter or digit and do not end with a space.
+SAFE_VALUE_PATTERN = re.compile(r"[^\W_](?:[^\W_]|[@.,:/?=%+~#-]| (?! ))*(?<! )")
+
+# Values for placeholders inside HTML tags or Markdown link targets, where spaces and non-ASCII letters are escaped or
+# end the target
+SAFE_URL_VALUE_PATTERN = re.compile(r"[A-Za-z0-9@.,:/?=%+~#-]+")
+
+# Values that read as an ordered list item when they start a line
+_LIST_ITEM_PATTERN = re.compile(r"\d+[.)](?:\s|$)")
+
+# A '//' that comment removal would treat as the start of a comment rather than part of a URL
+_COMMENT_START_PATTERN = re.compile(r"(?<!:)//")
+
+# Markdown abbreviation definitions, which change any matching word of the text
+_ABBREVIATION_PATTERN = re.compile(r"(?m)^[ \t]*\*\[")
+
+
+def supports_partial_rendering(extensions: Sequence[Any]) -> bool:
+    """Return True if every Markdown extension leaves personalized values as they are.
+
+    Args:
+        extensions: The Markdown extensions in use
+
+    Returns:
+        Whether emails can be rendered once and personalized by substitution
+    """
+    for extension in extensions:
+        if not isinstance(extension, str):
+            return False
+        name = extension.split(":")[0]
+        if name.startswith("markdown.extensions."):
+            name = name[len("markdown.extensions.") :]
+        if name not in PARTIAL_RENDER_EXTENSIONS:
+            return False
+    return True
+
+
+def supports_plain_text_substitution(
+    html2text_settings: Dict[str, Any], placeholders: Dict[str, str], html: str
+) -> bool:
+    """Return True if html2text leaves personalized values in an email as they are.
+
+    Wrapping lines depends on the length of the values, ``escape_snob`` escapes their punctuation, and a link whose
+    text matches its URL is written differently from other links.
+
+    Args:
+        html2text_settings: The html2text settings in use, including the defaults
+        placeholders: Dictionary mapping each personalized variable name to its placeholder
+        html: The final HTML rendered with placeholders
+
+    Returns:
+        Whether the plain text can be personalized by substitution
+    """
+    if html2text_settings.get("body_width") != 0 or html2text_settings.get("escape_snob"):
+        return False
+    return not any(
+        re.search(rf"(?is)<a\b[^>]*>(?:(?!</a>).)*?{placeholder}", html) for placeholder in placeholders.values()
+    )
+
+
+def make_placeholders(names: Iterable[str]) -> Dict[str, str]:
+    """Return a unique placeholder for each personalized variable.
+
+    Placeholders are made of uppercase letters and digits only, so every rendering stage leaves them as they are.
+
+    Args:
+        names: The names of the personalized variables
+
+    Returns:
+        Dictionary mapping each variable name to its placeholder
+    """
+    prefix = f"PERSONALIZED{secrets.token_hex(8).upper()}X"
+    return {name: f"{prefix}{index}X" for index, name in enumerate(sorted(names))}
+
+
+class PartialRender:
+    """An email rendered once with placeholders in place of the personalized variables.
+
+    Each output is kept with placeholders in it, so that the email of a recipient is made by substituting the
+    recipient's values for the placeholders.
+    """
+
+    __slots__ = (
+        "placeholders",
+        "blocks",
+        "html_content",
+        "rendered_html",
+        "html",
+        "plain",
+        "_pattern",
+        "_in_url",
+        "_no_leading_digit",
+        "_no_trailing_punctuation",
+    )
+
+    def __init__(
+        self,
+        placeholders: Dict[str, str],
+        blocks: Dict[str, Optional[str]],
+        html_content: str,
+        rendered_html: str,
+        html: str,
+        plain: Optional[str],
+    ):
+        """Initialize the PartialRender.
+
+        Args:
+            placeholders: Dictionary mapping each personalized variable name to its placeholder
+            blocks: The rendered subject, preheader and content
+            html_content: The HTML converted from the Markdown content
+            rendered_html: The rendered base template, before CSS inlining
+            html: The final HTML content
+            plain: The plain text content, or None if it has to be generated for each recipient
+        """
+        self.placeholders = placeholders
+        self.blocks = blocks
+        self.html_content = html_content
+        self.rendered_html = rendered_html
+        self.html = html
+        self.plain = plain
+        self._pattern = re.compile("|".join(re.escape(placeholder) for placeholder in placeholders.values()))
+
+        sources = [value for value in blocks.values() if value] + [html_content, rendered_html]
+        # Placeholders in HTML tags, link targets, attribute lists and footnote references
+        self._in_url = {
+            name
+            for name, placeholder in placeholders.items()
+            if any(
+                re.search(
+                    rf"<[^<>]*{placeholder}|\]\([^)]*{placeholder}|\{{[^}}]*{placeholder}|\[\^[^\]]*{placeholder}",
+                    source,
+                )
+                for source in sources
+            )
+        }
+        # A value starting with digits could become a list item, or be escaped as one by html2text
+        self._no_leading_digit = {
+            name
+            for name, placeholder in placeholders.items()
+            if any(re.search(rf"(?m)(?:^|>)[ \t]*{placeholder}", source) for source in sources)
+        }
+        # A value ending with punctuation before more punctuation could start or end a comment, such as '//' or '-->'
+        self._no_trailing_punctuation = {
+            name
+            for name, placeholder in placeholders.items()
+            if any(re.search(rf"{placeholder}[^\w\s]", source) for source in sources)
+        }
+
+    def values_for(self, context: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """Return the text to substitute for each placeholder, or None if a value cannot be substituted.
+
+        Args:
+            context: The personalized variables of a recipient
+
+        Returns:
+            Dictionary mapping each placeholder to its replacement, or None
+        """
+        values = {}
+        for name, placeholder in self.placeholders.items():
+            value = context.get(name)
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                return None
+            text = str(value)
+            if not SAFE_VALUE_PATTERN.fullmatch(text) or _LIST_ITEM_PATTERN.match(text):
+                return None
+            if _COMMENT_START_PATTERN.search(text) or "--" in text or ".." in text:
+                return None
+            if name in self._in_url and not SAFE_URL_VALUE_PATTERN.fullmatch(text):
+                return None
+            if name in self._no_leading_digit and text[0].isdigit():
+                return None
+            if name in self._no_trailing_punctuation and not text[-1].isalnum():
+                return None
+            values[placeholder] = text
+        return values
+
+    def substitute(self, text: Optional[str], values: Dict[str, str]) -> Optional[str]:
+        """Replace the placeholders in a rendered text with their values.
+
+        Args:
+            text: The text rendered with placeholders
+            values: Dictionary mapping each placeholder to its replacement, from :meth:`values_for`
+
+        Returns:
+            The personalized text
+        """
+        if not text or not values:
+            return text
+        return self._pattern.sub(lambda match: values[match.group()], text)
+
+
+def find_unsupported_placeholder(
+    placeholders: Dict[str, str], content: str, rendered_html: str, html: str, base_url: Optional[str]
+) -> Optional[str]:
+    """Return the name of a personalized variable used where its value cannot be substituted, if there is one.
+
+    Args:
+        placeholders: Dictionary mapping each personalized variable name to its placeholder
+        content: The Markdown content rendered with placeholders
+        rendered_html: The base template rendered with placeholders, before CSS inlining
+        html: The final HTML rendered with placeholders
+        base_url: The base URL relative URLs are resolved against, if any
+
+    Returns:
+        The name of the variable, or None if every variable can be substituted
+    """
+    if _ABBREVIATION_PATTERN.search(content):
+        # Abbreviations apply to the values as well as to the template
+        return next(iter(placeholders), None)
+
+    style_sources = re.findall(r"(?is)<style\b.*?</style>|\bstyle\s*=\s*(?:\"[^\"]*\"|'[^']*')", rendered_html)
+    for name, placeholder in placeholders.items():
+        # Markdown turns an address or URL between angle brackets into an obfuscated link
+        if re.search(rf"<[^<>\s]*{placeholder}[^<>\s]*>", content):
+            return name
+        # CSS is parsed and serialized again when it is inlined
+        if any(placeholder in source for source in style_sources):
+            return name
+        # A relative URL starting with a value is resolved differently depending on the value
+        if base_url and urljoin(base_url, placeholder) in html and urljoin(base_url, placeholder) not in rendered_html:
+            return name
+    return None
@@ -0,0 +1,179 @@
+"""Profiling a sample of email renders with cProfile, to find the hot paths with real templates and contexts."""
+
+import cProfile
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from django.conf import settings
+
+from templated_email_md.metrics import StageTiming
+from templated_email_md.metrics import collect_stages
+
+
+logger = logging.getLogger(__name__)
+
+# Default maximum number of profiles kept in the profile directory
+DEFAULT_PROFILE_MAX_FILES = 100
+
+# Prefix of the directory created in the system's temporary directory that profiles are written to by default
+DEFAULT_PROFILE_DIR_PREFIX = "templated_email_md_profiles-"
+
+# The directory created for the profiles of this process when ``TEMPLATED_EMAIL_PROFILE_DIR`` is not set
+_default_profile_dir: Optional[Path] = None
+_default_profile_dir_lock = threading.Lock()
+
+# Only one profiler can be active at a time, so renders sampled while another one is profiled are not profiled
+_profiler_lock = threading.Lock()
+
+# Whether the current render is profiled, so that nested renders are not sampled again
+_profiling: ContextVar[bool] = ContextVar("profiling", default=False)
+
+_sequence = itertools.count()
+
+
+def get_profile_rate() -> float:
+    """Return the fraction of renders that are profiled, as set by ``TEMPLATED_EMAIL_PROFILE_RATE``."""
+    return getattr(settings, "TEMPLATED_EMAIL_PROFILE_RATE", 0.0) or 0.0
+
+
+def get_profile_dir() -> Path:
+    """Return the directory that profiles are written to, as set by ``TEMPLATED_EMAIL_PROFILE_DIR``.
+
+    If the setting is not set, a directory only readable by the current user is created in the system's temporary
+    directory on first use, with a name that cannot be guessed, and used for the rest of the process.
+    """
+    global _default_profile_dir  # pylint: disable=W0603
+
+    directory = getattr(settings, "TEMPLATED_EMAIL_PROFILE_DIR", None)
+    if directory:
+        return Path(directory)
+
+    with _default_profile_dir_lock:
+        if _default_profile_dir is None:
+            _default_profile_dir = Path(tempfile.mkdtemp(prefix=DEFAULT_PROFILE_DIR_PREFIX))
+            logger.info("Writing email render profiles to %s", _default_profile_dir)
+        return _default_profile_dir
+
+
+def get_profile_max_files() -> int:
+    """Return the number of profiles kept in the profile directory, as set by ``TEMPLATED_EMAIL_PROFILE_MAX_FILES``."""
+    return getattr(settings, "TEMPLATED_EMAIL_PROFILE_MAX_FILES", DEFAULT_PROFILE_MAX_FILES)
+
+
+def should_profile() -> bool:
+    """Return True if the current render is sampled for profiling.
+
+    Renders within a profiled render, and renders started while another one is profiled, are not sampled.
+    """
+    rate = get_profile_rate()
+    if rate <= 0 or _profiling.get():
+        return False
+    return rate >= 1 or random.random() < rate  # nosec
+
+
+def profile_render(template_name: str, render: Callable[[], Any]) -> Any:
+    """Render an email under cProfile, and write the profile with the template name and stage timings.
+
+    The profile is written to ``<timestamp>-<pid>-<sequence>-<template>.prof`` in the profile directory, in the format
+    read by ``pstats``, with a JSON file of the same name holding the template name, the total duration and the timing
+    of each stage. The oldest profiles are removed once there are more than ``TEMPLATED_EMAIL_PROFILE_MAX_FILES``.
+
+    Args:
+        template_name: The template being rendered
+        render: Renders the email and returns it
+
+    Returns:
+        The value returned by ``render``
+    """
+    token = _profiling.set(True)
+    if not _profiler_lock.acquire(blocking=False):
+        # Another render is profiled, so this one is rendered as usual, without being sampled again by ``render``
+        try:
+            return render()
+        finally:
+            _profiling.reset(token)
+
+    profiler = cProfile.Profile()
+    error: Optional[BaseException] = None
+    try:
+        with collect_stages() as stages:
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                return render()
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                profiler.disable()
+                duration = time.perf_counter() - start
+    finally:
+        _profiling.reset(token)
+        _profiler_lock.release()
+        try:
+            write_profile(profiler, template_name, duration, stages, error)
+        except Exception as e:  # pylint: disable=W0718
+            logger.warning("Failed to write the profile of %s: %s", template_name, e)
+
+
+def write_profile(
+    profiler: cProfile.Profile,
+    template_name: str,
+    duration: float,
+    stages: List[StageTiming],
+    error: Optional[BaseException] = None,
+) -> Path:
+    """Write a profile and its details to the profile directory, and remove the oldest profiles.
+
+    Args:
+        profiler: The profiler, once disabled
+        template_name: The template that was rendered
+        duration: How long the render took in seconds
+        stages: The timing of each stage of the render
+        error: The exception the render raised, if it failed
+
+    Returns:
+        The path of the profile
+    """
+    directory = get_profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", template_name)[-80:]
+    stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_sequence):06d}-{slug}"
+    path = directory / f"{stem}.prof"
+    profiler.dump_stats(str(path))
+    details: Dict[str, Any] = {
+        "template": template_name,
+        "timestamp": time.time(),
+        "pid": os.getpid(),
+        "duration": duration,
+        "error": repr(error) if error is not None else None,
+        "stages": [stage._asdict() for stage in stages],
+    }
+    (directory / f"{stem}.json").write_text(json.dumps(details, indent=2))
+    rotate_profiles(directory, get_profile_max_files())
+    return path
+
+
+def rotate_profiles(directory: Path, max_files: int) -> None:
+    """Remove the oldest profiles in a directory, and their details, so that at most ``max_files`` are left."""
+    profiles = sorted(directory.glob("*.prof"), key=lambda path: (path.stat().st_mtime, path.name))
+    for path in profiles[: max(len(profiles) - max_files, 0)]:
+        for stale in (path, path.with_suffix(".json")):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,274 @@
+"""A cache of rendered emails, backed by Django's cache framework."""
+
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import threading
+import uuid
+import weakref
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template import Template
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils import translation
+from django.utils.functional import Promise
+
+from templated_email_md.invalidation import register_cache
+from templated_email_md.invalidation import template_chain
+
+
+logger = logging.getLogger(__name__)
+
+# Default number of seconds a rendered email is kept in the cache
+DEFAULT_RENDER_CACHE_TIMEOUT = 300
+
+# Default maximum size in bytes of a rendered email stored in the cache
+DEFAULT_RENDER_CACHE_MAX_ENTRY_SIZE = 256 * 1024
+
+# Prefix of the keys of rendered emails in the cache
+KEY_PREFIX = "templated_email_md:render"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "skipped": 0}
+
+_template_versions: "weakref.WeakKeyDictionary[Template, str]" = weakref.WeakKeyDictionary()
+_template_versions_lock = threading.Lock()
+register_cache(_template_versions.clear)
+
+
+class UncacheableContext(Exception):
+    """Raised when a context holds a value that has no stable fingerprint."""
+
+
+def is_render_cache_enabled() -> bool:
+    """Return True if rendered emails are cached, as set by ``TEMPLATED_EMAIL_RENDER_CACHE``."""
+    return getattr(settings, "TEMPLATED_EMAIL_RENDER_CACHE", False)
+
+
+def get_render_cache() -> Any:
+    """Return the Django cache named by ``TEMPLATED_EMAIL_RENDER_CACHE_ALIAS``."""
+    return caches[getattr(settings, "TEMPLATED_EMAIL_RENDER_CACHE_ALIAS", "default")]
+
+
+def get_render_cache_timeout() -> Optional[int]:
+    """Return the number of seconds a rendered email is kept in the cache, or None to keep it until it is evicted."""
+    return getattr(settings, "TEMPLATED_EMAIL_RENDER_CACHE_TIMEOUT", DEFAULT_RENDER_CACHE_TIMEOUT)
+
+
+def get_render_cache_max_entry_size() -> int:
+    """Return the maximum size in bytes of a rendered email stored in the cache."""
+    return getattr(settings, "TEMPLATED_EMAIL_RENDER_CACHE_MAX_ENTRY_SIZE", DEFAULT_RENDER_CACHE_MAX_ENTRY_SIZE)
+
+
+def _encode_dict(value: Dict[Any, Any]) -> Any:
+    """Return the encoded form of a dictionary with string keys."""
+    if not all(type(key) is str for key in value):  # pylint: disable=C0123
+        raise UncacheableContext("Dictionary keys must be strings.")
+    return ["dict", {key: _encode(item) for key, item in value.items()}]
+
+
+def _encode_set(value: Any) -> Any:
+    """Return the encoded form of a set, which does not depend on the order of its items."""
+    return ["set", sorted(json.dumps(_encode(item), sort_keys=True) for item in value)]
+
+
+def _encode_string(value: Any) -> Any:
+    """Return the encoded form of a string subclass or a lazy string.
+
+    Strings marked safe are not escaped when rendered, so they must not share a fingerprint with plain strings.
+    """
+    if hasattr(value, "__html__"):
+        return ["safe", str(value)]
+    if isinstance(value, Promise):
+        # Lazy translations are resolved in the active language, which is part of the key
+        return str(value)
+    raise UncacheableContext(f"Values of type {type(value).__name__} have no stable fingerprint.")
+
+
+# The encoder of each type of context value other than None, booleans, integers and strings. Each encoded form is
+# tagged with its type, so that values of different types never share an encoding.
+_ENCODERS: Dict[type, Callable[[Any], Any]] = {
+    float: lambda value: ["float", repr(value)],
+    # Templates render lists and tuples the same way
+    list: lambda value: ["list", [_encode(item) for item in value]],
+    tuple: lambda value: ["list", [_encode(item) for item in value]],
+    dict: _encode_dict,
+    set: _encode_set,
+    frozenset: _encode_set,
+    decimal.Decimal: lambda value: ["decimal", str(value)],
+    datetime.date: lambda value: ["date", value.isoformat()],
+    datetime.datetime: lambda value: ["datetime", value.isoformat()],
+    datetime.time: lambda value: ["time", value.isoformat()],
+    datetime.timedelta: lambda value: ["timedelta", value.total_seconds()],
+    uuid.UUID: lambda value: ["uuid", str(value)],
+}
+
+
+def _encode(value: Any) -> Any:
+    """Return a JSON-serializable form of a context value that only depends on the value itself.
+
+    Values of different types, or that render differently, such as strings marked safe, have different forms.
+
+    Raises:
+        UncacheableContext: If the value, or a value it holds, is of any other type, such as a model instance
+    """
+    if value is None or type(value) in (bool, int, str):
+        return value
+    encoder = _ENCODERS.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    if isinstance(value, (str, Promise)):
+        return _encode_string(value)
+    raise UncacheableContext(f"Values of type {type(value).__name__} have no stable fingerprint.")
+
+
+def fingerprint_context(context: Dict[str, Any]) -> str:
+    """Return a digest of a context that is the same for equal contexts, across processes.
+
+    Args:
+        context: The context to render a template with
+
+    Returns:
+        The hexadecimal digest of the context
+
+    Raises:
+        UncacheableContext: If the context holds a value other than strings, numbers, dates, lists and dictionaries
+    """
+    encoded = json.dumps(_encode(dict(context)), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def get_template_version(template_name: str) -> str:
+    """Return a digest of the sources of a template and of the templates it extends or includes.
+
+    Digests are kept for each compiled template, so a template that is reloaded after it changes gets a new one.
+    Templates whose name depends on the context are not part of the digest.
+
+    Args:
+        template_name: The name of the template
+
+    Returns:
+        The hexadecimal digest of the sources
+    """
+    template = get_template(template_name).template
+    with _template_versions_lock:
+        version = _template_versions.get(template)
+    if version is None:
+        digest = hashlib.sha256()
+        for source_template in template_chain(template):
+            digest.update(source_template.origin.name.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(source_template.source.encode("utf-8"))
+            digest.update(b"\0")
+        version = digest.hexdigest()
+        with _template_versions_lock:
+            _template_versions[template] = version
+    return version
+
+
+def make_render_cache_key(template_path: str, context: Dict[str, Any], backend_config: Dict[str, Any]) -> str:
+    """Return the cache key of an email.
+
+    The key depends on the template, the base HTML template, the sources they are built from (including the
+    stylesheet), the active language and time zone, the context, and the configuration of the backend.
+
+    Args:
+        template_path: Path to the Markdown template
+        context: The context to render the template with
+        backend_config: The settings of the backend that change the rendered email
+
+    Returns:
+        The cache key
+
+    Raises:
+        UncacheableContext: If the context has no stable fingerprint
+    """
+    key = json.dumps(
+        [
+            template_path,
+            get_template_version(template_path),
+            backend_config["base_html_template"],
+            get_template_version(backend_config["base_html_template"]),
+            translation.get_language(),
+            timezone.get_current_timezone_name(),
+            fingerprint_context(context),
+            _encode(backend_config),
+        ],
+        sort_keys=True,
+    )
+    return f"{KEY_PREFIX}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+def _record(outcome: str) -> None:
+    """Count a cache hit, miss, or skipped lookup."""
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_render_cache_stats() -> Dict[str, int]:
+    """Return the number of emails found in the cache, not found, and skipped because they could not be cached.
+
+    Counts are kept for the current process.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_render_cache_stats() -> None:
+    """Reset the cache hit, miss, and skip counts of the current process."""
+    with _stats_lock:
+        for outcome in _stats:
+            _stats[outcome] = 0
+
+
+def get_cached_email(key: str) -> Optional[Dict[str, Optional[str]]]:
+    """Return the parts of a rendered email from the cache, counting the hit or miss.
+
+    Args:
+        key: The cache key of the email
+
+    Returns:
+        The html, plain, subject and preheader of the email, or None
+    """
+    try:
+        parts = get_render_cache().get(key)
+    except Exception as e:  # pylint: disable=W0718
+        logger.warning("Failed to read rendered email from cache: %s", e)
+        parts = None
+    _record("hits" if parts is not None else "misses")
+    return parts
+
+
+def set_cached_email(key: str, parts: Dict[str, Optional[str]]) -> bool:
+    """Store the parts of a rendered email in the cache, unless they are larger than the maximum entry size.
+
+    Args:
+        key: The cache key of the email
+        parts: The html, plain, subject and preheader of the email
+
+    Returns:
+        Whether the email was stored
+    """
+    size = sum(len(part.encode("utf-8")) for part in parts.values() if part)
+    if size > get_render_cache_max_entry_size():
+        logger.debug("Not caching rendered email of %d bytes", size)
+        return False
+    try:
+        get_render_cache().set(key, parts, get_render_cache_timeout())
+    except Exception as e:  # pylint: disable=W0718
+        logger.warning("Failed to store rendered email in cache: %s", e)
+        return False
+    return True
+
+
+def record_skipped() -> None:
+    """Count an email that could not be looked up in the cache."""
+    _record("skipped")
@@ -0,0 +1,199 @@
+"""Render plans that resolve the blocks of a Markdown email template once per compiled template."""
+
+import re
+import threading
+import weakref
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from django.template import Context
+from django.template import Template
+from django.template.base import Variable
+from django.template.loader import get_template
+from django.template.loader_tags import BLOCK_CONTEXT_KEY
+from django.template.loader_tags import BlockContext
+from django.template.loader_tags import BlockNode
+from django.template.loader_tags import ExtendsNode
+
+from templated_email_md.invalidation import check_sources
+from templated_email_md.invalidation import register_cache
+from templated_email_md.invalidation import track_template
+from templated_email_md.utils import LRUCache
+
+
+EMAIL_BLOCKS = ("subject", "preheader", "content")
+
+# Maximum number of compiled content templates kept for templates without a 'content' block
+CONTENT_TEMPLATE_CACHE_SIZE = 256
+
+# Patterns used to strip the 'subject' and 'preheader' blocks when a template has no 'content' block
+STRIP_BLOCK_PATTERNS = [
+    r"{% block subject %}.*?{% endblock %}",
+    r"{% block subject %}.*?{% endblock subject %}",
+    r"{% block preheader %}.*?{% endblock %}",
+    r"{% block preheader %}.*?{% endblock preheader %}",
+]
+
+
+def strip_subject_and_preheader(template_source: str) -> str:
+    """Remove the 'subject' and 'preheader' blocks from a template source.
+
+    Args:
+        template_source: The raw source of the Markdown template
+
+    Returns:
+        The template source without the 'subject' and 'preheader' blocks
+    """
+    for pattern in STRIP_BLOCK_PATTERNS:
+        template_source = re.sub(pattern, "", template_source, flags=re.DOTALL).strip()
+    return template_source
+
+
+_content_templates = LRUCache(maxsize=CONTENT_TEMPLATE_CACHE_SIZE)
+register_cache(_content_templates.clear)
+
+
+def get_content_template(template: Template) -> Template:
+    """Return the compiled template for a template's source without its 'subject' and 'preheader' blocks.
+
+    Compiled content templates are cached by the origin of the template they were built from. An entry is rebuilt
+    when the source of the template no longer matches the source it was built from.
+
+    Args:
+        template: The compiled Markdown email template
+
+    Returns:
+        The compiled template to render as the email content
+    """
+    origin = template.origin
+    key = (origin.name, origin.template_name)
+    cached = _content_templates.get(key)
+    if cached is not None:
+        cached_source, content_template = cached
+        if cached_source is template.source or cached_source == template.source:
+            return content_template
+
+    content_template = Template(strip_subject_and_preheader(template.source))
+    _content_templates.set(key, (template.source, content_template))
+    return content_template
+
+
+def _has_static_parent(node: ExtendsNode) -> bool:
+    """Return True if the parent of an ExtendsNode does not depend on the render context."""
+    return not node.parent_name.filters and not isinstance(node.parent_name.var, Variable)
+
+
+class RenderPlan:
+    """The resolved blocks of a compiled Markdown email template.
+
+    Walking a template's node tree and its ``{% extends %}`` chain is done once, when the plan is built.
+    Each render then only binds a single Context and renders the subject, preheader and content blocks from it.
+    """
+
+    def __init__(self, template: Template):
+        """Initialize the RenderPlan.
+
+        Args:
+            template: The compiled ``django.template.base.Template`` to build the plan for
+        """
+        self.template = template
+        self.block_layers: Optional[List[Dict[str, BlockNode]]] = None
+
+        context = Context()
+        with context.render_context.push_state(template):
+            with context.bind_template(template):
+                layers, static = self._resolve_block_layers(context, static_only=True)
+        if static:
+            # The extends chain cannot change between renders, so it can be reused as is
+            self.block_layers = layers
+
+    def _resolve_block_layers(
+        self, context: Context, static_only: bool = False
+    ) -> Tuple[List[Dict[str, BlockNode]], bool]:
+        """Collect the blocks of the template and of each of its parents.
+
+        Args:
+            context: A Context bound to the template
+            static_only: If True, stop at the first parent that depends on the context, such as
+                ``{% extends layout %}``, since the context does not hold the variables to resolve it
+
+        Returns:
+            The blocks of each template in the extends chain (child first), and whether the chain is static
+        """
+        layers = []
+        static = True
+        template = self.template
+        while template is not None:
+            layers.append({n.name: n for n in template.nodelist.get_nodes_by_type(BlockNode)})
+            extends_nodes = template.nodelist.get_nodes_by_type(ExtendsNode)
+            template = None
+            for node in extends_nodes:
+                static = static and _has_static_parent(node)
+                if not static and static_only:
+                    return layers, False
+                template = node.get_parent(context)
+        return layers, static
+
+    def render(self, context: Dict[str, Any], block_names: Tuple[str, ...] = EMAIL_BLOCKS) -> Dict[str, Optional[str]]:
+        """Render the requested blocks over a single Context.
+
+        Args:
+            context: Context to render the template with
+            block_names: Names of the blocks to render
+
+        Returns:
+            Dictionary mapping each block name to its stripped rendered content, or None if the block is not defined
+        """
+        context_instance = Context(context)
+        with context_instance.render_context.push_state(self.template):
+            with context_instance.bind_template(self.template):
+                block_layers = self.block_layers
+                if block_layers is None:
+                    block_layers = self._resolve_block_layers(context_instance)[0]
+
+                block_context = BlockContext()
+                for blocks in block_layers:
+                    block_context.add_blocks(blocks)
+                context_instance.render_context[BLOCK_CONTEXT_KEY] = block_context
+
+                rendered = {}
+                for name in block_names:
+                    block_node = block_context.get_block(name)
+                    rendered[name] = block_node.render(context_instance).strip() if block_node is not None else None
+
+        if "content" in rendered and rendered["content"] is None:
+            # If 'content' block is not defined, render the entire template without 'subject' and 'preheader' blocks
+            rendered["content"] = get_content_template(self.template).render(context_instance)
+        return rendered
+
+
+_render_plans: "weakref.WeakKeyDictionary[Template, RenderPlan]" = weakref.WeakKeyDictionary()
+_render_plans_lock = threading.Lock()
+register_cache(_render_plans.clear)
+
+
+def get_render_plan(template_path: str) -> RenderPlan:
+    """Return the render plan for a template, building it on first use.
+
+    Plans are keyed by the compiled template returned by Django's template loaders, so a template that is reloaded
+    after it changes gets a new plan, and plans for discarded templates are garbage collected.
+
+    Args:
+        template_path: Path to the template file
+
+    Returns:
+        The RenderPlan for the template
+    """
+    check_sources()
+    template = get_template(template_path).template
+    with _render_plans_lock:
+        plan = _render_plans.get(template)
+    if plan is None:
+        track_template(template)
+        plan = RenderPlan(template)
+        with _render_plans_lock:
+            plan = _render_plans.setdefault(template, plan)
+    return plan
@@ -0,0 +1,142 @@
+"""The result of rendering a Markdown email template."""
+
+from collections.abc import MutableMapping
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+
+
+# Parts of a rendered email, in the order they are listed
+PARTS = ("html", "plain", "subject", "preheader")
+
+# Marks a part that has not been rendered yet
+_PENDING = object()
+
+# Marks a part that has been deleted
+_MISSING = object()
+
+
+class RenderedEmail(MutableMapping):
+    """The parts of a rendered email, with the HTML and plain text rendered on first access.
+
+    The subject and preheader are known when the email is created. The HTML is rendered the first time it is read,
+    and the plain text is generated from the HTML the first time it is read. Each part is rendered at most once.
+
+    It behaves like the dictionary of parts that ``templated_email``'s ``TemplateBackend`` expects from
+    ``_render_email``: parts can be checked with ``in``, read and replaced with ``[]``, and the parts are also
+    available as attributes.
+    """
+
+    __slots__ = ("_html", "_plain", "_subject", "_preheader", "_render_html", "_render_plain")
+
+    def __init__(
+        self,
+        subject: Optional[str],
+        preheader: Optional[str],
+        html: Optional[str] = None,
+        plain: Optional[str] = None,
+        render_html: Optional[Callable[[], str]] = None,
+        render_plain: Optional[Callable[[str], str]] = None,
+    ):
+        """Initialize the RenderedEmail.
+
+        Args:
+            subject: The email subject
+            preheader: The email preheader
+            html: The HTML content, if it is already rendered
+            plain: The plain text content, if it is already rendered
+            render_html: Returns the HTML content, called on first access if ``html`` is not given
+            render_plain: Returns the plain text content from the HTML, called on first access if ``plain`` is not
+                given
+        """
+        self._subject = subject
+        self._preheader = preheader
+        self._html = html if html is not None or render_html is None else _PENDING
+        self._plain = plain if plain is not None or render_plain is None else _PENDING
+        self._render_html = render_html
+        self._render_plain = render_plain
+
+    @property
+    def html(self) -> Optional[str]:
+        """The HTML content, rendered on first access."""
+        return self["html"]
+
+    @property
+    def plain(self) -> Optional[str]:
+        """The plain text content, generated from the HTML on first access."""
+        return self["plain"]
+
+    @property
+    def subject(self) -> Optional[str]:
+        """The email subject."""
+        return self["subject"]
+
+    @property
+    def preheader(self) -> Optional[str]:
+        """The email preheader."""
+        return self["preheader"]
+
+    @property
+    def is_rendered(self) -> bool:
+        """Whether the HTML and plain text have both been rendered."""
+        return self._html is not _PENDING and self._plain is not _PENDING
+
+    def render(self) -> "RenderedEmail":
+        """Render the parts that have not been rendered yet, and return the email."""
+        self.get("plain")
+        self.get("html")
+        return self
+
+    def _check_part(self, key: str) -> str:
+        """Return the slot holding a part, raising KeyError for names that are not parts."""
+        if key not in PARTS:
+            raise KeyError(key)
+        return f"_{key}"
+
+    def __getitem__(self, key: str) -> Optional[str]:
+        """Return a part, rendering it if needed."""
+        slot = self._check_part(key)
+        value = getattr(self, slot)
+        if value is _PENDING:
+            if key == "html":
+                value = self._render_html()
+                # The renderer holds on to the template context, which is no longer needed
+                self._render_html = None
+            else:
+                value = self._render_plain(self["html"])
+                self._render_plain = None
+            setattr(self, slot, value)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Optional[str]) -> None:
+        """Replace a part."""
+        setattr(self, self._check_part(key), value)
+
+    def __delitem__(self, key: str) -> None:
+        """Remove a part."""
+        slot = self._check_part(key)
+        if getattr(self, slot) is _MISSING:
+            raise KeyError(key)
+        setattr(self, slot, _MISSING)
+
+    def __contains__(self, key: object) -> bool:
+        """Return True if the email has a part, without rendering it."""
+        return key in PARTS and getattr(self, f"_{key}") is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the names of the parts the email has."""
+        return (key for key in PARTS if key in self)
+
+    def __len__(self) -> int:
+        """Return the number of parts the email has."""
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        """Return a representation that does not render pending parts."""
+        parts = ", ".join(
+            f"{key}=<pending>" if getattr(self, f"_{key}") is _PENDING else f"{key}={getattr(self, f'_{key}')!r}"
+            for key in self
+        )
+        return f"{self.__class__.__name__}({parts})"
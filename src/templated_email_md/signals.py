@@ -0,0 +1,9 @@
+"""Signals sent by templated_email_md."""
+
+from django.dispatch import Signal
+
+
+# Sent after each stage of rendering or sending an email, when ``TEMPLATED_EMAIL_METRICS`` is enabled. The sender is
+# the name of the stage, and the arguments are ``template_name``, ``duration`` in seconds, ``size`` in bytes of the
+# stage's output (or None) and ``error``, the exception the stage raised (or None).
+stage_completed = Signal()
@@ -0,0 +1,143 @@
+"""Utilities for templated_email_md."""
+
+import threading
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+
+
+class LRUCache:
+    """A small thread-safe cache that evicts the least recently used entries once it holds ``maxsize`` entries."""
+
+    def __init__(self, maxsize: int = 128):
+        """Initialize the LRUCache.
+
+        Args:
+            maxsize: Maximum number of entries to keep
+        """
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Return True if the key is cached."""
+        return key in self._data
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Return the value cached for a key, marking it as recently used.
+
+        Args:
+            key: The cache key
+            default: Value to return if the key is not cached
+
+        Returns:
+            The cached value, or the default
+        """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Remove a key from the cache and return its value.
+
+        Args:
+            key: The cache key
+            default: Value to return if the key is not cached
+
+        Returns:
+            The removed value, or the default
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._data.clear()
+
+
+class SizedLRUCache(LRUCache):
+    """An LRUCache that also evicts the least recently used entries once the sizes of its values exceed ``maxbytes``.
+
+    Values larger than ``maxbytes`` are not cached.
+    """
+
+    def __init__(self, maxbytes: int, sizeof: Callable[[Any], int] = len, maxsize: int = 1024):
+        """Initialize the SizedLRUCache.
+
+        Args:
+            maxbytes: Maximum total size of the cached values
+            sizeof: Returns the size of a value
+            maxsize: Maximum number of entries to keep
+        """
+        super().__init__(maxsize=maxsize)
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.currsize = 0
+        self._sizes: Dict[Hashable, int] = {}
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self.currsize -= self._sizes.pop(key)
+            if size > self.maxbytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.currsize += size
+            while self.currsize > self.maxbytes or len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self.currsize -= self._sizes.pop(evicted)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Remove a key from the cache and return its value.
+
+        Args:
+            key: The cache key
+            default: Value to return if the key is not cached
+
+        Returns:
+            The removed value, or the default
+        """
+        with self._lock:
+            if key in self._sizes:
+                self.currsize -= self._sizes.pop(key)
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.currsize = 0
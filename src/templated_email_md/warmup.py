@@ -0,0 +1,227 @@
+"""Finding, validating and warming the Markdown email templates of a project."""
+
+import copy
+import gc
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from django.conf import settings
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.loader import get_template
+
+from templated_email_md.converters import get_html2text_converter
+from templated_email_md.markdown_engines import get_markdown_engine
+from templated_email_md.render_cache import get_template_version
+from templated_email_md.render_plan import get_render_plan
+
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateReport(NamedTuple):
+    """The outcome of warming a template, with the time spent compiling and rendering it in seconds.
+
+    ``cached`` is True if the rendered email was read from or stored in the render cache.
+    """
+
+    template_name: str
+    compile_time: float
+    render_time: Optional[float] = None
+    cached: bool = False
+    error: Optional[Exception] = None
+
+    @property
+    def success(self) -> bool:
+        """Whether the template compiled, and rendered if it was rendered."""
+        return self.error is None
+
+
+def get_template_directories() -> List[Path]:
+    """Return the directories the Django template loaders look in, in the order they look in them."""
+    directories: List[Path] = []
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for loader in engine.engine.template_loaders:
+            for directory in loader.get_dirs() if hasattr(loader, "get_dirs") else ():
+                directory = Path(directory)
+                if directory not in directories:
+                    directories.append(directory)
+    return directories
+
+
+def find_templates(template_prefix: str, file_extension: str) -> List[str]:
+    """Find the Markdown email templates in the template directories.
+
+    Args:
+        template_prefix: The directory, relative to the template directories, that email templates are in
+        file_extension: The file extension of the templates
+
+    Returns:
+        The sorted names of the templates, relative to ``template_prefix`` and without their extension, as they are
+        passed to ``send_templated_mail``
+    """
+    suffix = f".{file_extension.lstrip('.')}"
+    names = set()
+    for directory in get_template_directories():
+        root = directory / template_prefix
+        if not root.is_dir():
+            continue
+        for path in root.rglob(f"*{suffix}"):
+            if path.is_file():
+                names.add(path.relative_to(root).as_posix()[: -len(suffix)])
+    return sorted(names)
+
+
+def warm_shared_caches(backend: Any) -> None:
+    """Compile the base HTML template and build the converters every template uses.
+
+    Args:
+        backend: The MarkdownTemplateBackend to warm the caches of
+    """
+    get_template(backend.base_html_template)
+    get_template_version(backend.base_html_template)
+    get_markdown_engine(backend.markdown_extensions, backend.markdown_engine)
+    get_html2text_converter(backend.html2text_settings)
+
+
+def warm_template(
+    backend: Any, template_name: str, context: Optional[Dict[str, Any]] = None, render: bool = True, store: bool = False
+) -> TemplateReport:
+    """Compile a template and build its render plan, then render it to warm the caches it uses.
+
+    Args:
+        backend: The MarkdownTemplateBackend to render the template with
+        template_name: The name of the template, as passed to ``send_templated_mail``
+        context: The context to render the template with
+        render: Whether to render the template, rather than only compile it
+        store: Whether to store the rendered email in the render cache, even if it is not enabled
+
+    Returns:
+        The TemplateReport for the template
+    """
+    template_path = backend._get_template_path(template_name, None, None)  # pylint: disable=W0212
+    start = time.perf_counter()
+    try:
+        get_render_plan(template_path)
+        get_template_version(template_path)
+    except Exception as e:  # pylint: disable=W0718
+        return TemplateReport(template_name, time.perf_counter() - start, error=e)
+    compile_time = time.perf_counter() - start
+    if not render:
+        return TemplateReport(template_name, compile_time)
+
+    context = dict(context or {})
+    start = time.perf_counter()
+    cached = False
+    try:
+        if store:
+            rendered = backend._render_email_cached(template_name, context)  # pylint: disable=W0212
+            cached = rendered is not None
+        if not cached:
+            # Rendered without falling back, so that template errors are reported
+            strict_backend = copy.copy(backend)
+            strict_backend.fail_silently = False
+            strict_backend._render_email(template_name, context).render()  # pylint: disable=W0212
+    except Exception as e:  # pylint: disable=W0718
+        return TemplateReport(template_name, compile_time, time.perf_counter() - start, error=e)
+    return TemplateReport(template_name, compile_time, time.perf_counter() - start, cached)
+
+
+def warm_templates(
+    backend: Any,
+    template_names: Optional[Iterable[str]] = None,
+    context: Optional[Dict[str, Any]] = None,
+    render: bool = True,
+    store: bool = False,
+    workers: Optional[int] = None,
+) -> List[TemplateReport]:
+    """Compile, validate and warm many templates in a pool of threads.
+
+    Args:
+        backend: The MarkdownTemplateBackend to render the templates with
+        template_names: The names of the templates, defaults to every template found by :func:`find_templates`
+        context: The context to render each template with
+        render: Whether to render the templates, rather than only compile them
+        store: Whether to store the rendered emails in the render cache, even if it is not enabled
+        workers: Number of threads, defaults to the number of CPUs
+
+    Returns:
+        A TemplateReport per template, in the order of the names
+    """
+    if template_names is None:
+        template_names = find_templates(backend.template_prefix, backend.template_suffix)
+    template_names = list(template_names)
+    warm_shared_caches(backend)
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="templated-email-warmup") as executor:
+        reports = list(
+            executor.map(lambda name: warm_template(backend, name, context, render=render, store=store), template_names)
+        )
+    _log_failures(reports)
+    return reports
+
+
+def warm_up(
+    template_names: Optional[Iterable[str]] = None, context: Optional[Dict[str, Any]] = None, freeze: bool = False
+) -> List[TemplateReport]:
+    """Warm the templates and caches used to send emails, in the calling thread.
+
+    Meant to be called once in a process that forks workers, such as the master process of gunicorn with
+    ``preload_app`` or of a celery prefork pool, before it forks. The rendering dependencies are imported, and the
+    templates, render plans, converters and parsed stylesheets are built, so that workers share them copy-on-write
+    and their first email is not slow. Markdown converters belong to the thread that builds them, so templates are
+    rendered in the calling thread rather than in a pool.
+
+    Args:
+        template_names: The names of the templates, defaults to the ``TEMPLATED_EMAIL_WARMUP_TEMPLATES`` setting, then
+            to every template found by :func:`find_templates`
+        context: The context to render each template with
+        freeze: Whether to call :func:`gc.freeze` afterwards, so that garbage collection in the workers does not copy
+            the memory pages holding the warmed objects
+
+    Returns:
+        A TemplateReport per template, in the order of the names
+    """
+    from templated_email import get_connection  # pylint: disable=C0415
+
+    from templated_email_md import backend as backend_module  # pylint: disable=C0415
+
+    backend = get_connection()
+    if not isinstance(backend, backend_module.MarkdownTemplateBackend):
+        logger.warning("Not warming email templates, TEMPLATED_EMAIL_BACKEND is not a MarkdownTemplateBackend")
+        return []
+
+    if template_names is None:
+        template_names = getattr(settings, "TEMPLATED_EMAIL_WARMUP_TEMPLATES", None)
+    if template_names is None:
+        template_names = find_templates(backend.template_prefix, backend.template_suffix)
+    warm_shared_caches(backend)
+
+    start = time.perf_counter()
+    reports = [warm_template(backend, name, context) for name in template_names]
+    _log_failures(reports)
+    logger.info("Warmed %d email templates in %.1f ms", len(reports), (time.perf_counter() - start) * 1000)
+
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return reports
+
+
+def _log_failures(reports: List[TemplateReport]) -> None:
+    """Log a warning for each template that failed to warm."""
+    for report in reports:
+        if not report.success:
+            logger.warning("Failed to warm email template %s: %s", report.template_name, report.error)